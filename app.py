@@ -1,9 +1,11 @@
 import streamlit as st
 import datetime
 import os
+import time
 import html
 import logging
 import base64
+import streamlit.components.v1 as components
 from config_manager import ConfigManager
 import traceback
 from PIL import Image
@@ -19,9 +21,15 @@ try:
     from gemini_chatbot import GeminiChatbot
     from stable_diffusion_api import StableDiffusionAPI
     from voice_manager import VoiceManager
+    from tts_renderer import browser_playlist_html, browser_stop_html
     from conversation_manager import ConversationManager
-    from emotion_analyzer import EmotionalCharacterManager, Emotion
+    from emotion_analyzer import EmotionalCharacterManager
     from theme_manager import ThemeManager
+    from sprite_cache import EmotionSpriteCache
+    from image_scheduler import ImageJobScheduler, PRIORITY_AUTO, PRIORITY_MANUAL
+    from image_writer import ImageWriter
+    from scene_change_detector import SceneChangeDetector
+    from prompt_compiler import PromptCompiler
 except ImportError as e:
     st.error(f"モジュールの読み込みに失敗しました: {e}")
     st.error("必要なパッケージがインストールされていない可能性があります。")
@@ -171,18 +179,28 @@ def initialize_components():
         # 必須コンポーネントの初期化
         character_manager = CharacterManager()
         chatbot = GeminiChatbot(GEMINI_API_KEY)
-        sd_api = StableDiffusionAPI()
+        sd_api = StableDiffusionAPI(
+            settings=config_manager.data.get("sd", {}),
+            image_writer=ImageWriter(settings=config_manager.data.get("images", {}))
+        )
         conversation_manager = ConversationManager()
-        emotion_manager = EmotionalCharacterManager()
+        emotion_manager = EmotionalCharacterManager(
+            history_size=config_manager.data.get("emotion", {}).get("history_size", 10),
+            decay=config_manager.data.get("emotion", {}).get("decay", 0.9)
+        )
         theme_manager = ThemeManager()
         memory_manager = MemoryManager()
+        image_scheduler = ImageJobScheduler(
+            sd_api,
+            max_affinity_wait=config_manager.data.get("sd", {}).get("checkpoint_max_wait", 20)
+        )
+        sprite_cache = EmotionSpriteCache(sd_api, emotion_manager.emotion_analyzer, scheduler=image_scheduler)
 
         # 音声マネージャーは失敗しても良いオプションコンポーネント
+        # （エンジンの検出は音声を初めて有効にしたときに行うので、ここでは待たない）
         voice_manager = None
         try:
             voice_manager = VoiceManager()
-            if not voice_manager.is_available():
-                st.toast("🔊 音声エンジンは利用可能ですが、正常に動作していません。", icon="⚠️")
         except Exception as e:
             print(f"VoiceManagerの初期化に失敗: {e}")
             st.toast("🔊 音声機能の初期化に失敗したため、無効化されました。", icon="⚠️")
@@ -198,16 +216,16 @@ def initialize_components():
         except Exception as e:
             st.error(f"Gemini APIへの接続テストに失敗しました: {e}")
             st.info("APIキーが正しいか、ネットワーク接続が有効か確認してください。")
-            return (None,) * 8 # Return a tuple of Nones matching the number of managers
+            return (None,) * 10 # Return a tuple of Nones matching the number of managers
 
-        return character_manager, chatbot, sd_api, voice_manager, conversation_manager, emotion_manager, theme_manager, memory_manager
+        return character_manager, chatbot, sd_api, voice_manager, conversation_manager, emotion_manager, theme_manager, memory_manager, sprite_cache, image_scheduler
 
     except Exception as e:
         st.error("アプリケーションの初期化中に致命的なエラーが発生しました。")
         st.error(f"エラー詳細: {e}")
         st.code(traceback.format_exc())
         st.info("必要なパッケージがすべてインストールされているか、`requirements.txt`を確認してください。")
-        return (None,) * 8 # Return a tuple of Nones matching the number of managers
+        return (None,) * 10 # Return a tuple of Nones matching the number of managers
 
 # セッション状態の初期化
 def initialize_session_state():
@@ -231,11 +249,149 @@ def initialize_session_state():
         st.session_state.needs_ai_response = False
     if 'needs_image_generation' not in st.session_state:
         st.session_state.needs_image_generation = False
+    if 'scene_detector' not in st.session_state:
+        st.session_state.scene_detector = SceneChangeDetector(
+            threshold=config_manager.data.get("sd", {}).get("scene_skip_threshold", 0.8)
+        )
+    if 'scene_generation' not in st.session_state:
+        st.session_state.scene_generation = config_manager.data.get("sd", {}).get("scene_generation", True)
+    if 'prompt_compiler' not in st.session_state:
+        st.session_state.prompt_compiler = PromptCompiler()
+    if 'pending_speech' not in st.session_state:
+        # ブラウザ再生で合成中の応答（{"speech": BrowserSpeech, "message_index": 音声を付けるメッセージ}）
+        st.session_state.pending_speech = None
+
+def play_browser_audio(container, paths):
+    """
+    合成できた音声をブラウザの再生待ちの列に加える（ブラウザ再生モード）
+
+    Args:
+        container: 再生用の要素を置く Streamlit のコンテナ
+        paths (List[str]): 音声ファイル（この順番で再生する）
+    """
+    if not paths:
+        return
+    try:
+        with container:
+            components.html(browser_playlist_html(paths), height=0)
+    except Exception as e:
+        print(f"ブラウザへの音声送信エラー: {e}")
+
+
+def deliver_pending_speech():
+    """
+    合成中の応答の音声を、合成できたものから順にブラウザへ送る（ブラウザ再生モード）
+
+    合成の完了を待つと再実行・画像生成まで止まるため、応答は session_state に残して
+    この関数で取り出す。st.fragment が使える場合はこの部分だけを1秒ごとに再実行する。
+    """
+    pending = st.session_state.get("pending_speech")
+    if not pending:
+        return
+    speech = pending["speech"]
+    play_browser_audio(st.container(), speech.ready_audio())
+    index = pending.get("message_index")
+    messages = st.session_state.messages
+    if index is not None and index < len(messages) and speech.audio_paths:
+        messages[index]["audio"] = list(speech.audio_paths)
+    if speech.done:
+        st.session_state.pending_speech = None
+
+
+if hasattr(st, "fragment"):
+    deliver_pending_speech = st.fragment(run_every=1.0)(deliver_pending_speech)
+
+
+def stop_browser_audio(container):
+    """
+    ブラウザで再生中・再生待ちの音声を止める（ブラウザ再生モード）
+
+    Args:
+        container: 停止用の要素を置く Streamlit のコンテナ
+    """
+    try:
+        with container:
+            components.html(browser_stop_html(), height=0)
+    except Exception as e:
+        print(f"ブラウザの音声停止エラー: {e}")
+
+
+def build_image_prompt(emotion_manager, character, scene=""):
+    """
+    キャラクターの外見・現在の感情・シーンから画像プロンプトを組み立てる（LoRAは末尾に1回だけ付与）。
+    """
+    emotion_analyzer = emotion_manager.emotion_analyzer
+    return st.session_state.prompt_compiler.compile(
+        character.get("image_prompt", ""),
+        emotion_analyzer.emotion_prompts.get(emotion_manager.current_emotion, ""),
+        scene,
+        st.session_state.get("lora_weights", {})
+    )
+
+def find_previous_image(messages):
+    """
+    最後のメッセージより前で、画像が付いている直近のAIメッセージの画像とプロンプトを返す。
+    """
+    for msg in reversed(messages[:-1]):
+        if msg.get("role") == "assistant" and msg.get("image") is not None:
+            return msg.get("image"), msg.get("image_prompt")
+    return None, None
+
+def generate_image(sd_api, image_scheduler, prompt, negative_prompt="", job_key="manual", turn=0,
+                   priority=PRIORITY_AUTO, checkpoint=None, previous_image=None, previous_prompt=None):
+    """
+    画像生成ジョブをスケジューラへ投入し、完了まで待つ。
+    プログレッシブ生成では先にプレビューを表示し、高画質化後に差し替える。
+    同じ job_key の古いジョブは置き換えられ、不要になった実行中ジョブは中断される。
+    checkpoint を指定すると、同じモデルのジョブがまとめて処理される。
+    previous_image を渡すと、継続モードでシーンが変わっていなければ img2img で引き継ぐ。
+    """
+    previews = []
+    if previous_image is not None and sd_api.settings.get("continuity", False):
+        def job():
+            return sd_api.generate_continuous_image(
+                prompt, negative_prompt, previous_image, previous_prompt,
+                on_preview=previews.append, checkpoint=checkpoint,
+                is_cancelled=image_scheduler.is_current_job_obsolete
+            )
+    elif sd_api.settings.get("progressive", False):
+        def job():
+            return sd_api.generate_progressive_image(
+                prompt, negative_prompt, on_preview=previews.append, checkpoint=checkpoint,
+                is_cancelled=image_scheduler.is_current_job_obsolete
+            )
+    else:
+        def job():
+            return sd_api.generate_character_image(prompt, negative_prompt, checkpoint=checkpoint)
+
+    future = image_scheduler.submit(job_key, job, priority=priority, turn=turn, checkpoint=checkpoint)
+
+    status_slot = st.empty()
+    preview_slot = st.empty()
+    shown_preview = None
+    # 待機中もUIを更新し続けることで、ユーザーが次の操作をしたら待機を打ち切れる
+    while not future.done():
+        position = image_scheduler.get_queue_position(future)
+        status_slot.caption(f"⏳ 画像生成の順番待ち（{position}番目）" if position else "🎨 画像生成中...")
+        if previews and previews[-1] is not shown_preview:
+            shown_preview = previews[-1]
+            preview_slot.image(shown_preview, caption="プレビュー（高画質化中...）", width=256)
+        time.sleep(0.2)
+    status_slot.empty()
+    preview_slot.empty()
+
+    if future.cancelled():
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"画像生成エラー: {e}")
+        return None
 
 def main():
     # コンポーネントの初期化
     components = initialize_components()
-    character_manager, chatbot, sd_api, voice_manager, conversation_manager, emotion_manager, theme_manager, memory_manager = components
+    character_manager, chatbot, sd_api, voice_manager, conversation_manager, emotion_manager, theme_manager, memory_manager, sprite_cache, image_scheduler = components
 
     # 必須コンポーネントが初期化されたかチェック
     # voice_managerはオプションなのでNoneでも許容
@@ -246,7 +402,9 @@ def main():
         "ConversationManager": conversation_manager,
         "EmotionalCharacterManager": emotion_manager,
         "ThemeManager": theme_manager,
-        "MemoryManager": memory_manager
+        "MemoryManager": memory_manager,
+        "EmotionSpriteCache": sprite_cache,
+        "ImageJobScheduler": image_scheduler
     }
     
     failed_components = [name for name, comp in required_components_map.items() if comp is None]
@@ -264,8 +422,24 @@ def main():
     assert emotion_manager is not None
     assert theme_manager is not None
     assert memory_manager is not None
+    assert sprite_cache is not None
+    assert image_scheduler is not None
 
     initialize_session_state()
+
+    # 設定ページでの変更を画像生成に反映
+    sd_api.update_settings(config_manager.data.get("sd", {}))
+    sd_api.image_writer.update_settings(config_manager.data.get("images", {}))
+    emotion_manager.set_history_size(config_manager.data.get("emotion", {}).get("history_size", 10))
+    emotion_manager.set_decay(config_manager.data.get("emotion", {}).get("decay", 0.9))
+    emotion_manager.emotion_analyzer.configure_classifier(config_manager.data.get("emotion", {}))
+    if voice_manager:
+        voice_manager.apply_config(config_manager.data.get("voice", {}))
+    st.session_state.prompt_compiler.update_settings(config_manager.data.get("sd", {}))
+    chatbot.set_tag_extraction(
+        bool(config_manager.data.get("sd", {}).get("local_tags", True)),
+        float(config_manager.data.get("sd", {}).get("local_tags_min_coverage", 0.5))
+    )
     
     # ユーザーペルソナをチャットボットへ適用
     user_persona = config_manager.data.get("user", {}).get("persona", "")
@@ -308,9 +482,9 @@ def main():
         # 音声設定
         st.subheader("🔊 音声設定")
         try:
-            if voice_manager and voice_manager.is_available():
+            if voice_manager:
                 voice_settings = voice_manager.get_voice_settings_ui()
-                st.session_state.voice_enabled = voice_settings.get('enabled', False)
+                st.session_state.voice_enabled = voice_settings.get('enabled', False) and voice_manager.is_available()
             else:
                 st.warning("音声機能が利用できません")
                 st.caption("音声エンジンの初期化に失敗しました")
@@ -385,6 +559,9 @@ def main():
                 chatbot.load_history(loaded_messages)
                 # 3. UIの履歴をAIの履歴に完全に一致させる
                 st.session_state.messages = chatbot.conversation_history
+                # 4. 感情履歴を会話全体から一括で復元
+                emotion_manager.restore_history(loaded_messages)
+                st.session_state.scene_detector.reset()
 
                 # 音声設定（エラーハンドリング追加）
                 try:
@@ -392,6 +569,10 @@ def main():
                         voice_manager.set_character_voice(character_data)
                 except Exception as e:
                     st.warning(f"音声設定でエラーが発生しました: {e}")
+
+                # 感情スプライトの事前生成（バックグラウンド）
+                if config_manager.data.get("sd", {}).get("sprite_atlas", True):
+                    sprite_cache.pregenerate(character_data)
             
             st.success(f"✅ 会話が復元されました: {character_name}")
             # 状態を完全に更新して不整合を防ぐために再実行が必須
@@ -421,18 +602,25 @@ def main():
                     try:
                         if voice_manager:
                             voice_manager.set_character_voice(character_data)
+                            # 会話開始メッセージを先に合成しておく
+                            if config_manager.data.get("voice", {}).get("prerender_starters", False):
+                                voice_manager.prerender_character(character_data)
                     except Exception as e:
                         st.warning(f"音声設定でエラーが発生しました: {e}")
                     
                     # 感情とメッセージをリセット
-                    emotion_manager.current_emotion = Emotion.NEUTRAL
-                    emotion_manager.emotion_history = []
+                    emotion_manager.reset()
+                    st.session_state.scene_detector.reset()
                     st.session_state.messages = []
                     st.session_state.conversation_starter = None  # スターターもリセット
                     
                     # キャラクターに応じたテーマを自動適用
                     auto_theme = theme_manager.apply_character_theme(character_data)
                     st.session_state.current_theme = auto_theme
+
+                    # 感情スプライトの事前生成（バックグラウンド）
+                    if config_manager.data.get("sd", {}).get("sprite_atlas", True):
+                        sprite_cache.pregenerate(character_data)
                     
                     st.success(f"✅ {selected_character_name}が設定されました！")
                     # リロードを削除（状態が更新されれば自動で反映される）
@@ -451,6 +639,7 @@ def main():
             new_char_base_prompt = st.text_area("基本プロンプト")
             new_char_image_prompt = st.text_area("画像生成プロンプト")
             new_char_image_negative = st.text_area("ネガティブプロンプト")
+            new_char_image_checkpoint = st.text_input("チェックポイント（任意）", help="Stable Diffusion のモデル名。空なら読み込み済みのモデルを使用します")
             
             if st.button("キャラクター作成"):
                 if new_char_name and new_char_personality:
@@ -462,6 +651,7 @@ def main():
                         "base_prompt": new_char_base_prompt,
                         "image_prompt": new_char_image_prompt,
                         "image_negative_prompt": new_char_image_negative,
+                        "image_checkpoint": new_char_image_checkpoint,
                         "conversation_starters": [
                             f"こんにちは！私は{new_char_name}です。",
                             "何かお話ししましょうか？",
@@ -481,6 +671,14 @@ def main():
         st.subheader("🎨 画像生成")
         # 直近の会話を画像プロンプトに使うか選択
         use_chat_prompt = st.checkbox("直近の会話を画像プロンプトに使用", value=True, help="オンの場合、直近のユーザーメッセージを画像プロンプトに含めます")
+        st.session_state.scene_generation = st.checkbox(
+            "応答ごとにシーン画像を生成",
+            value=st.session_state.scene_generation,
+            key="scene_generation_toggle",
+            help="オフの場合、事前生成した感情スプライトのみを表示します"
+        )
+        if st.session_state.current_character and sprite_cache.is_generating(st.session_state.current_character.get('name', '')):
+            st.caption("🖼️ 感情スプライトをバックグラウンドで生成中...")
 
         # LoRA設定
         available_loras = sd_api.get_loras()
@@ -519,51 +717,47 @@ def main():
             if st.session_state.current_character and st.button("キャラクター画像生成"):
                 with st.spinner("画像生成中..."):
                     character = st.session_state.current_character
-                    base_prompt = character.get('image_prompt', '')
                     negative_prompt = character.get('image_negative_prompt', '')
                     
                     # プロンプト決定ロジック
-                    image_prompt = base_prompt or ""
+                    scene_prompt = ""
                     if use_chat_prompt and st.session_state.messages:
                         # 直近のユーザー発言を取得
-                        last_user_msg = None
                         for msg in reversed(st.session_state.messages):
                             if msg["role"] == "user":
-                                last_user_msg = msg["content"]
+                                scene_prompt = msg["content"]
                                 break
-                        if last_user_msg:
-                            image_prompt = f"{image_prompt} {last_user_msg}".strip()
-                    if not image_prompt:
+                    if not character.get('image_prompt') and not scene_prompt:
                         st.warning("画像プロンプトが生成できませんでした。会話を入力するか、キャラクターの image_prompt を設定してください。")
                     else:
-                        # LoRAプロンプトを追加
-                        lora_prompts = []
-                        if 'lora_weights' in st.session_state:
-                            for lora_name, weight in st.session_state.lora_weights.items():
-                                if weight > 0:
-                                    lora_prompts.append(f"<lora:{lora_name}:{weight}>")
-                        
-                        final_prompt = f"{image_prompt} {' '.join(lora_prompts)}".strip()
+                        final_prompt = build_image_prompt(emotion_manager, character, scene_prompt)
 
-                        image = sd_api.generate_character_image(
+                        image = generate_image(
+                            sd_api,
+                            image_scheduler,
                             final_prompt, 
-                            negative_prompt
+                            negative_prompt,
+                            job_key=f"manual-{character.get('name', 'character')}",
+                            turn=len(st.session_state.messages),
+                            priority=PRIORITY_MANUAL,
+                            checkpoint=character.get('image_checkpoint') or None
                         )
                         
                         if image:
                             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
                             emotion_info = emotion_manager.get_current_emotion_info()
                             
-                            saved_path = sd_api.save_character_image(
+                            # 保存はバックグラウンドで行い、保存先パスだけ先に受け取る
+                            save_handle = sd_api.save_character_image(
                                 image, 
                                 character.get('name', 'character'), 
                                 timestamp
                             )
                             
-                            if saved_path:
+                            if save_handle:
                                 st.session_state.generated_images.append({
                                     'image': image,
-                                    'path': saved_path,
+                                    'path': save_handle.path,
                                     'character': character.get('name', ''),
                                     'timestamp': timestamp,
                                     'emotion': emotion_info['description'],
@@ -609,8 +803,8 @@ def main():
                 st.session_state.conversation_starter = None  # スターターもリセット
                 if st.session_state.current_character:
                     chatbot.clear_conversation()
-                    emotion_manager.current_emotion = Emotion.NEUTRAL
-                    emotion_manager.emotion_history = []
+                    emotion_manager.reset()
+                st.session_state.scene_detector.reset()
                 st.success("✅ 会話がリセットされました！")
         
         # 開発者向けツール
@@ -629,10 +823,13 @@ def main():
                 st.write("**システム状態:**")
                 st.write(f"- 音声マネージャー: {'✅' if voice_manager else '❌'}")
                 if voice_manager:
-                    st.write(f"- 音声利用可能: {'✅' if voice_manager.is_available() else '❌'}")
+                    st.write(f"- 音声利用可能: {('✅' if voice_manager.is_available() else '❌') if voice_manager.is_ready() else '未検出'}")
                 st.write(f"- 現在のキャラクター: {st.session_state.current_character.get('name', 'None') if st.session_state.current_character else 'None'}")
                 st.write(f"- メッセージ数: {len(st.session_state.messages)}")
                 st.write(f"- 音声有効: {'✅' if st.session_state.voice_enabled else '❌'}")
+                st.write(f"- 画像生成キュー: {image_scheduler.get_stats()}")
+                st.write(f"- プロンプトキャッシュ: {st.session_state.prompt_compiler.get_stats()}")
+                st.write(f"- 感情分類器: {emotion_manager.emotion_analyzer.classifier_stats if emotion_manager.emotion_analyzer.classifier else '無効'}")
     
     # メインエリア
     col1, col2 = st.columns([2, 1])
@@ -647,6 +844,10 @@ def main():
         # 現在のキャラクター表示
         if st.session_state.current_character:
             character = st.session_state.current_character
+            # 現在の感情に対応するスプライトを即座に表示
+            current_sprite = sprite_cache.get_sprite(character.get('name', ''), emotion_manager.current_emotion)
+            if current_sprite:
+                st.image(current_sprite, width=160)
             st.markdown(f"""
             <div class="character-card">
                 <h4>🎭 現在のキャラクター: {character.get('name', 'Unknown')}</h4>
@@ -685,6 +886,11 @@ def main():
                                 image_html = f'<img src="data:image/png;base64,{img_str}" style="max-width: 100%; border-radius: 10px; margin-top: 10px;">'
                             except Exception as e:
                                 print(f"画像のHTML変換でエラー: {e}")
+                        elif message.get("sprite") and os.path.exists(message["sprite"]):
+                            # シーン画像が無い場合は感情スプライトを表示
+                            with open(message["sprite"], "rb") as sprite_fp:
+                                img_str = base64.b64encode(sprite_fp.read()).decode()
+                            image_html = f'<img src="data:image/png;base64,{img_str}" style="max-width: 40%; border-radius: 10px; margin-top: 10px;">'
 
                         st.markdown(f"""
                         <div class="ai-message">
@@ -692,6 +898,12 @@ def main():
                             {image_html}
                         </div>
                         """, unsafe_allow_html=True)
+                        # ブラウザ再生モードで合成した音声（キャッシュから消えたものは表示しない）
+                        audio_paths = [path for path in message.get("audio", []) if os.path.exists(path)]
+                        if audio_paths:
+                            with st.expander("🔊 音声", expanded=False):
+                                for audio_path in audio_paths:
+                                    st.audio(audio_path)
             else:
                 if st.session_state.current_character:
                     # 一度だけ会話スターターを生成
@@ -706,6 +918,10 @@ def main():
                     </div>
                     """, unsafe_allow_html=True)
         
+        # 合成中の音声をブラウザへ送る（st.fragment が無い場合は再実行のたびに送る）
+        if st.session_state.pending_speech:
+            deliver_pending_speech()
+        
         # チャット入力ロジックを修正
         if st.session_state.current_character:
             # --- Stage 1: ユーザー入力受付 ---
@@ -729,26 +945,88 @@ def main():
                 if last_user_message:
                     with st.spinner("応答生成中..."):
                         # 感情分析 (ユーザー入力に対して)
+                        user_annotation = None
                         if st.session_state.emotion_tracking:
                             emotion_manager.update_emotion(last_user_message)
+                            user_annotation = emotion_manager.last_annotation
                         
-                        # AI応答生成
-                        ai_response = chatbot.chat(last_user_message)
+                        # AI応答生成（届いた分から表示し、感情も逐次分析する）
+                        stream_analyzer = emotion_manager.start_stream() if st.session_state.emotion_tracking else None
+                        # 音声読み上げ（文が揃うたびに読み上げを始める）
+                        speech = None
+                        audio_container = st.container()
+                        # 前の応答の読み上げを止める（まだ合成していない文も合成しない）
+                        if voice_manager and config_manager.data.get("voice", {}).get("interrupt_on_new_message", True):
+                            voice_manager.stop_speaking()
+                            if voice_manager.output_mode == "browser":
+                                stop_browser_audio(audio_container)
+                        if st.session_state.voice_enabled and voice_manager and voice_manager.is_available():
+                            speech = voice_manager.start_speech()
+                        stream_placeholder = st.empty()
+                        streamed_emotion = None
+                        ai_response = ""
+                        for chunk in chatbot.chat_stream(last_user_message):
+                            ai_response += chunk
+                            if speech:
+                                try:
+                                    speech.feed(chunk)
+                                    play_browser_audio(audio_container, speech.ready_audio())
+                                except Exception as e:
+                                    print(f"音声読み上げエラー: {e}")
+                                    speech = None
+                            with stream_placeholder.container():
+                                if stream_analyzer:
+                                    emotion = stream_analyzer.feed(chunk)
+                                    if emotion != streamed_emotion:
+                                        streamed_emotion = emotion
+                                        streamed_sprite = sprite_cache.get_sprite(
+                                            st.session_state.current_character.get('name', ''),
+                                            emotion
+                                        )
+                                    if streamed_sprite:
+                                        st.image(streamed_sprite, width=96)
+                                    st.caption(emotion_manager.emotion_analyzer.get_emotion_description(emotion))
+                                st.markdown(ai_response)
+                        stream_placeholder.empty()
                         st.session_state.messages = chatbot.conversation_history
 
                         # 感情分析 (AI応答に対して)
                         if st.session_state.emotion_tracking:
-                            emotion_manager.update_emotion(ai_response)
+                            emotion_manager.update_emotion(
+                                ai_response,
+                                stream_analyzer.finish() if stream_analyzer else None,
+                                stream_analyzer.get_annotation() if stream_analyzer else None
+                            )
+                            # 感情の注釈をメッセージに保存（会話の保存・読み込み後も再分析しない）
+                            messages = st.session_state.messages
+                            if messages and messages[-1]["role"] == "assistant":
+                                messages[-1]["emotion"] = emotion_manager.last_annotation
+                                if len(messages) >= 2 and messages[-2]["role"] == "user" and user_annotation:
+                                    messages[-2]["emotion"] = user_annotation
+                            # 感情が変化したら対応するスプライトを即座に添付
+                            if emotion_manager.emotion_changed and st.session_state.messages:
+                                st.session_state.messages[-1]["sprite"] = sprite_cache.get_sprite(
+                                    st.session_state.current_character.get('name', ''),
+                                    emotion_manager.current_emotion
+                                )
                         
-                        # 音声読み上げ
-                        if st.session_state.voice_enabled and voice_manager and voice_manager.is_available():
+                        # 音声読み上げ（残りの文）
+                        if speech:
                             try:
-                                voice_manager.speak_text(ai_response)
+                                speech.finish()
+                                play_browser_audio(audio_container, speech.ready_audio())
+                                # ブラウザ再生の残りの文は合成を待たず、再実行後に deliver_pending_speech で送る
+                                if not speech.done and st.session_state.messages:
+                                    st.session_state.pending_speech = {
+                                        "speech": speech, "message_index": len(st.session_state.messages) - 1
+                                    }
+                                if speech.audio_paths and st.session_state.messages:
+                                    st.session_state.messages[-1]["audio"] = list(speech.audio_paths)
                             except Exception as e:
                                 print(f"音声読み上げエラー: {e}")
                     
                     # 画像生成フラグを立てて、再描画（ここでテキストが表示される）
-                    if sd_api.check_connection():
+                    if st.session_state.scene_generation and sd_api.check_connection():
                         st.session_state.needs_image_generation = True
                     st.rerun()
 
@@ -768,22 +1046,43 @@ def main():
                         image_summary = chatbot.summarize_for_image(last_ai_message_content)
                         character = st.session_state.current_character
                         assert character is not None
-                        character_base_prompt = character.get("image_prompt", "")
                         negative_prompt = character.get("image_negative_prompt", "")
-                        final_image_prompt = f"{character_base_prompt}, {image_summary}".strip(", ")
-                        
-                        lora_prompts = []
-                        if 'lora_weights' in st.session_state:
-                            for lora_name, weight in st.session_state.lora_weights.items():
-                                if weight > 0:
-                                    lora_prompts.append(f"<lora:{lora_name}:{weight}>")
-                        final_image_prompt_with_lora = f"{final_image_prompt} {' '.join(lora_prompts)}".strip()
+                        final_image_prompt_with_lora = build_image_prompt(emotion_manager, character, image_summary)
+
+                        previous_image, previous_prompt = find_previous_image(st.session_state.messages)
 
-                        generated_image = sd_api.generate_character_image(final_image_prompt_with_lora, negative_prompt)
+                        # シーンタグと感情が前回とほぼ同じなら前の画像を使い回す
+                        sd_config = config_manager.data.get("sd", {})
+                        scene_changed = True
+                        if sd_config.get("scene_skip", True):
+                            scene_detector = st.session_state.scene_detector
+                            scene_detector.threshold = float(sd_config.get("scene_skip_threshold", 0.8))
+                            scene_changed = scene_detector.should_generate(
+                                image_summary, emotion_manager.current_emotion,
+                                has_previous_image=previous_image is not None
+                            )
+
+                        if not scene_changed:
+                            generated_image = previous_image
+                            final_image_prompt_with_lora = previous_prompt
+                        else:
+                            generated_image = generate_image(
+                                sd_api,
+                                image_scheduler,
+                                final_image_prompt_with_lora,
+                                negative_prompt,
+                                job_key=f"msg-{len(st.session_state.messages) - 1}",
+                                turn=len(st.session_state.messages) - 1,
+                                priority=PRIORITY_AUTO,
+                                checkpoint=character.get('image_checkpoint') or None,
+                                previous_image=previous_image,
+                                previous_prompt=previous_prompt
+                            )
 
                         # 最後のメッセージに画像を追加
                         if st.session_state.messages:
                             st.session_state.messages[-1]["image"] = generated_image
+                            st.session_state.messages[-1]["image_prompt"] = final_image_prompt_with_lora
                     
                     # 再描画して画像を表示
                     st.rerun()
@@ -802,25 +1101,31 @@ def main():
                             if new_resp and "エラー" not in new_resp:
                                 st.session_state.messages = chatbot.conversation_history
                                 generated_image = None
+                                final_image_prompt_with_lora = None
                                 if sd_api.check_connection():
                                     image_summary = chatbot.summarize_for_image(new_resp)
                                     character = st.session_state.current_character
                                     assert character is not None
-                                    character_base_prompt = character.get("image_prompt", "")
                                     negative_prompt = character.get("image_negative_prompt", "")
-                                    final_image_prompt = f"{character_base_prompt}, {image_summary}".strip(", ")
-                                    
-                                    lora_prompts = []
-                                    if 'lora_weights' in st.session_state:
-                                        for lora_name, weight in st.session_state.lora_weights.items():
-                                            if weight > 0:
-                                                lora_prompts.append(f"<lora:{lora_name}:{weight}>")
-                                    final_image_prompt_with_lora = f"{final_image_prompt} {' '.join(lora_prompts)}".strip()
-
-                                    generated_image = sd_api.generate_character_image(final_image_prompt_with_lora, negative_prompt)
+                                    final_image_prompt_with_lora = build_image_prompt(emotion_manager, character, image_summary)
+
+                                    previous_image, previous_prompt = find_previous_image(st.session_state.messages)
+                                    generated_image = generate_image(
+                                        sd_api,
+                                        image_scheduler,
+                                        final_image_prompt_with_lora,
+                                        negative_prompt,
+                                        job_key=f"msg-{len(st.session_state.messages) - 1}",
+                                        turn=len(st.session_state.messages) - 1,
+                                        priority=PRIORITY_MANUAL,
+                                        checkpoint=character.get('image_checkpoint') or None,
+                                        previous_image=previous_image,
+                                        previous_prompt=previous_prompt
+                                    )
                                 
                                 if st.session_state.messages:
                                     st.session_state.messages[-1]["image"] = generated_image
+                                    st.session_state.messages[-1]["image_prompt"] = final_image_prompt_with_lora
                         
                         # 3. 最後に一度だけ再描画
                         st.rerun()
@@ -857,7 +1162,18 @@ def main():
         if st.session_state.current_character:
             summary = chatbot.get_conversation_summary()
             st.info(summary)
-            
+
+            # 画像生成の省略統計
+            scene_stats = st.session_state.scene_detector.get_stats()
+            if scene_stats["checked"]:
+                st.caption(
+                    f"🖼️ 画像生成の省略: {scene_stats['skipped']}/{scene_stats['checked']}回 "
+                    f"({scene_stats['skip_rate'] * 100:.0f}%) ・直近の類似度 {scene_stats['last_similarity']:.2f}"
+                )
+            summary_stats = chatbot.image_summary_stats
+            if summary_stats["local"] or summary_stats["llm"]:
+                st.caption(f"🏷️ シーンタグ: 辞書 {summary_stats['local']}回 / LLM {summary_stats['llm']}回")
+
             # 感情統計
             if st.session_state.emotion_tracking:
                 emotion_stats = emotion_manager.get_emotion_statistics()
@@ -876,6 +1192,20 @@ def main():
                     for emotion, percentage in emotion_stats.get('percentages', {}).items():
                         emotion_desc = emotion_analyzer.get_emotion_description(emotion)
                         st.write(f"- {emotion_desc}: {percentage:.1f}%")
+
+                    # 会話全体の集計（メッセージに保存された注釈から）
+                    conversation_stats = emotion_manager.get_conversation_statistics(st.session_state.messages)
+                    if conversation_stats:
+                        st.write(f"**会話全体（{conversation_stats['annotated']}件）:**")
+                        for emotion, percentage in sorted(conversation_stats['percentages'].items(), key=lambda x: x[1], reverse=True)[:3]:
+                            st.write(f"- {emotion_analyzer.get_emotion_description(emotion)}: {percentage:.1f}%")
+
+                    # 会話全体の長期傾向（減衰付き）
+                    long_term = emotion_stats.get('long_term', {})
+                    if long_term:
+                        st.write("**長期的な傾向:**")
+                        for emotion, ratio in sorted(long_term.items(), key=lambda x: x[1], reverse=True)[:3]:
+                            st.write(f"- {emotion_analyzer.get_emotion_description(emotion)}: {ratio * 100:.1f}%")
         
         total_characters = len(character_manager.get_character_list())
         total_images = len(st.session_state.generated_images)
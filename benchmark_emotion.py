@@ -0,0 +1,274 @@
+"""
+感情分析（EmotionAnalyzer）の速度と精度のベンチマーク
+
+ラベル付きコーパス（train_emotion_classifier.py と同じ JSON Lines 形式）に対して、
+1件ずつの分析と analyze_batch のスループット、1件あたりのレイテンシ（p50 / p99）、
+感情ごとの適合率・再現率を測り、結果を JSON に保存する。
+
+使い方::
+
+    python benchmark_emotion.py
+    python benchmark_emotion.py --classifier models/emotion_classifier.npz
+    python benchmark_emotion.py --compare benchmarks/results/emotion_20250101_120000.json
+
+辞書や分類器を変更したときは、変更前後の結果を --compare で比較する。
+
+既定のコーパス（benchmarks/emotion_corpus.jsonl）は辞書の語に沿って書いたスモーク用で、
+正解率は辞書が壊れていないかの確認にしかならない。精度の目安には、辞書を見ずに書いた
+benchmarks/emotion_heldout.jsonl の正解率（held-out）を見ること。
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from emotion_analyzer import Emotion, EmotionAnalyzer
+from train_emotion_classifier import load_corpus
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+DEFAULT_CORPUS_PATH = os.path.join(BENCHMARK_DIR, "emotion_corpus.jsonl")
+DEFAULT_HELDOUT_PATH = os.path.join(BENCHMARK_DIR, "emotion_heldout.jsonl")
+DEFAULT_RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+
+def percentile(values: Sequence[float], ratio: float) -> float:
+    """
+    最近傍順位法によるパーセンタイル
+
+    Args:
+        values (Sequence[float]): 測定値
+        ratio (float): 0〜1（0.99 なら p99）
+
+    Returns:
+        float: パーセンタイル値（値が無ければ0）
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(ratio * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def measure_single(analyzer: EmotionAnalyzer, texts: Sequence[str]) -> Tuple[List[Emotion], Dict]:
+    """
+    analyze_emotion を1件ずつ呼んだ場合の速度を測る
+
+    Returns:
+        Tuple[List[Emotion], Dict]: 推定結果と、スループット・レイテンシ
+    """
+    labels: List[Emotion] = []
+    latencies: List[float] = []
+    started = time.perf_counter()
+    for text in texts:
+        call_started = time.perf_counter()
+        labels.append(analyzer.analyze_emotion(text))
+        latencies.append((time.perf_counter() - call_started) * 1000.0)
+    elapsed = time.perf_counter() - started
+    return labels, {
+        "messages": len(texts),
+        "seconds": round(elapsed, 6),
+        "messages_per_second": round(len(texts) / elapsed, 1) if elapsed > 0 else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "max": round(max(latencies), 4) if latencies else 0.0,
+        },
+    }
+
+
+def measure_batch(analyzer: EmotionAnalyzer, texts: Sequence[str], batch_size: int) -> Tuple[List[Emotion], Dict]:
+    """
+    analyze_batch で batch_size 件ずつまとめて分析した場合の速度を測る
+
+    Returns:
+        Tuple[List[Emotion], Dict]: 推定結果と、スループット・バッチあたりの時間
+    """
+    labels: List[Emotion] = []
+    batch_latencies: List[float] = []
+    started = time.perf_counter()
+    for start in range(0, len(texts), batch_size):
+        call_started = time.perf_counter()
+        batch_labels, _ = analyzer.analyze_batch(list(texts[start:start + batch_size]))
+        batch_latencies.append((time.perf_counter() - call_started) * 1000.0)
+        labels.extend(batch_labels)
+    elapsed = time.perf_counter() - started
+    return labels, {
+        "messages": len(texts),
+        "batch_size": batch_size,
+        "seconds": round(elapsed, 6),
+        "messages_per_second": round(len(texts) / elapsed, 1) if elapsed > 0 else None,
+        "batch_latency_ms": {
+            "p50": round(percentile(batch_latencies, 0.50), 4),
+            "p99": round(percentile(batch_latencies, 0.99), 4),
+        },
+    }
+
+
+def evaluate(expected: Sequence[str], predicted: Sequence[Emotion]) -> Dict:
+    """
+    感情ごとの適合率・再現率と全体の正解率を計算
+
+    Args:
+        expected (Sequence[str]): 正解ラベル（Emotion の値）
+        predicted (Sequence[Emotion]): 推定結果
+
+    Returns:
+        Dict: accuracy と、感情ごとの precision / recall / f1 / support
+    """
+    predicted_values = [emotion.value for emotion in predicted]
+    per_emotion = {}
+    for emotion in Emotion:
+        label = emotion.value
+        true_positive = sum(1 for gold, guess in zip(expected, predicted_values) if gold == label and guess == label)
+        predicted_count = predicted_values.count(label)
+        support = list(expected).count(label)
+        precision = true_positive / predicted_count if predicted_count else 0.0
+        recall = true_positive / support if support else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        per_emotion[label] = {
+            "precision": round(precision, 4),
+            "recall": round(recall, 4),
+            "f1": round(f1, 4),
+            "support": support,
+            "predicted": predicted_count,
+        }
+    correct = sum(1 for gold, guess in zip(expected, predicted_values) if gold == guess)
+    return {
+        "accuracy": round(correct / len(expected), 4) if expected else 0.0,
+        "per_emotion": per_emotion,
+    }
+
+
+def git_revision() -> Optional[str]:
+    """実行時のコミット（取得できなければ None）"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def print_comparison(current: Dict, previous: Dict):
+    """前回の結果との差分を表示"""
+    print(f"\n比較: {previous.get('created_at', '?')} ({previous.get('revision') or '?'}) → 今回")
+    rows = [
+        ("単発 msgs/s", ("single", "messages_per_second")),
+        ("単発 p50 ms", ("single", "latency_ms", "p50")),
+        ("単発 p99 ms", ("single", "latency_ms", "p99")),
+        ("バッチ msgs/s", ("batch", "messages_per_second")),
+        ("正解率（スモーク）", ("accuracy", "accuracy")),
+        ("正解率（held-out）", ("heldout", "accuracy", "accuracy")),
+    ]
+    for title, keys in rows:
+        before, after = previous, current
+        for key in keys:
+            before = before.get(key, {}) if isinstance(before, dict) else None
+            after = after.get(key, {}) if isinstance(after, dict) else None
+        if isinstance(before, (int, float)) and isinstance(after, (int, float)):
+            print(f"  {title}: {before} → {after} ({after - before:+.4g})")
+    for label, after in current["accuracy"]["per_emotion"].items():
+        before = previous.get("accuracy", {}).get("per_emotion", {}).get(label)
+        if before and (before["precision"], before["recall"]) != (after["precision"], after["recall"]):
+            print(
+                f"  {label}: P {before['precision']:.2f} → {after['precision']:.2f} / "
+                f"R {before['recall']:.2f} → {after['recall']:.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="感情分析のベンチマーク")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_PATH, help="ラベル付きコーパス（JSON Lines）")
+    parser.add_argument("--heldout", default=DEFAULT_HELDOUT_PATH,
+                        help="精度だけを測る、辞書を見ずに書いたコーパス（空文字で省略）")
+    parser.add_argument("--repeat", type=int, default=20, help="速度測定でコーパスを繰り返す回数")
+    parser.add_argument("--batch-size", type=int, default=64, help="analyze_batch に渡す件数")
+    parser.add_argument("--classifier", default="", help="有効にする分類器のモデル（.npz。省略時は辞書のみ）")
+    parser.add_argument("--output", default="", help="結果の保存先（省略時は benchmarks/results/ に日時付きで保存）")
+    parser.add_argument("--compare", default="", help="比較する過去の結果（JSON）")
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus)
+    if not samples:
+        parser.error("コーパスが空です")
+    texts = [text for text, _ in samples]
+    expected = [label for _, label in samples]
+
+    analyzer = EmotionAnalyzer()
+    if args.classifier:
+        analyzer.configure_classifier({"classifier": True, "classifier_model": args.classifier})
+        if analyzer.classifier is None:
+            parser.error(f"分類器を読み込めません: {args.classifier}")
+
+    # 初回呼び出しの準備コストを測定から除く
+    analyzer.analyze_batch(texts[:8])
+    timing_texts = texts * max(1, args.repeat)
+
+    predicted, single = measure_single(analyzer, texts)
+    _, single = measure_single(analyzer, timing_texts)
+    batch_predicted, batch = measure_batch(analyzer, timing_texts, max(1, args.batch_size))
+    batch["matches_single"] = batch_predicted[:len(texts)] == predicted
+
+    result = {
+        "created_at": datetime.datetime.now().isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "corpus": os.path.relpath(os.path.abspath(args.corpus)),
+        "corpus_size": len(samples),
+        "repeat": max(1, args.repeat),
+        "analyzer": {
+            "lexicon_terms": len(analyzer.lexicon.terms),
+            "classifier": args.classifier or None,
+            "classifier_stats": dict(analyzer.classifier_stats) if analyzer.classifier else None,
+        },
+        "single": single,
+        "batch": batch,
+        "accuracy": evaluate(expected, predicted),
+        "heldout": None,
+    }
+    if args.heldout and os.path.exists(args.heldout):
+        heldout_samples = load_corpus(args.heldout)
+        heldout_predicted = [analyzer.analyze_emotion(text) for text, _ in heldout_samples]
+        result["heldout"] = {
+            "corpus": os.path.relpath(os.path.abspath(args.heldout)),
+            "corpus_size": len(heldout_samples),
+            "accuracy": evaluate([label for _, label in heldout_samples], heldout_predicted),
+        }
+
+    print(f"コーパス: {len(samples)}件 × {result['repeat']}回")
+    print(
+        f"単発: {single['messages_per_second']} msgs/s "
+        f"(p50 {single['latency_ms']['p50']:.3f} ms / p99 {single['latency_ms']['p99']:.3f} ms)"
+    )
+    print(f"バッチ({batch['batch_size']}件): {batch['messages_per_second']} msgs/s")
+    print(f"正解率（スモーク: 辞書に沿って書いたコーパスのため精度の目安にはならない）: "
+          f"{result['accuracy']['accuracy'] * 100:.1f}%")
+    for label, metrics in result["accuracy"]["per_emotion"].items():
+        print(f"  {label:<10} P {metrics['precision']:.2f}  R {metrics['recall']:.2f}  (n={metrics['support']})")
+    if result["heldout"]:
+        heldout = result["heldout"]
+        print(f"正解率（held-out: {heldout['corpus_size']}件）: {heldout['accuracy']['accuracy'] * 100:.1f}%")
+        for label, metrics in heldout["accuracy"]["per_emotion"].items():
+            print(f"  {label:<10} P {metrics['precision']:.2f}  R {metrics['recall']:.2f}  (n={metrics['support']})")
+
+    output = args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"emotion_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fp:
+        json.dump(result, fp, ensure_ascii=False, indent=2)
+    print(f"保存しました: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fp:
+            print_comparison(result, json.load(fp))
+
+
+if __name__ == "__main__":
+    main()
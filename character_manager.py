@@ -192,6 +192,8 @@ class CharacterManager:
         img_gen = data.get("image_generation", {})
         data["image_prompt"] = img_gen.get("positive_prompt", "")
         data["image_negative_prompt"] = img_gen.get("negative_prompt", "")
+        # 希望するチェックポイント（空なら WebUI で読み込み済みのモデルを使う）
+        data["image_checkpoint"] = img_gen.get("checkpoint", "")
 
         # simple card fields for UI
         data["personality"] = summary
@@ -12,19 +12,86 @@ DEFAULT_CONFIG: Dict[str, Any] = {
     "sd": {
         "positive_prompt": "",
         "negative_prompt": "",
+        # 複数の WebUI を負荷分散する場合に URL を列挙（空なら http://127.0.0.1:7860）
+        "backends": [],
         "steps": 30,
+        "width": 512,
+        "height": 512,
+        "sampler": "DPM++ 2M Karras",
+        "cfg_scale": 7,
+        # 低ステップ・低解像度のプレビューを先に表示し、後から高画質化する
+        "progressive": False,
+        "preview_steps": 8,
+        "preview_width": 384,
+        "preview_height": 384,
+        "preview_sampler": "Euler a",
+        # 高画質化の方式: "img2img" または "hires"（同じシードで hires fix）
+        "refine_mode": "img2img",
+        "refine_denoising_strength": 0.45,
+        # 継続モード: シーンが変わっていなければ前ターンの画像を img2img で引き継ぐ
+        "continuity": False,
+        "continuity_threshold": 0.5,
+        "continuity_denoising_strength": 0.35,
+        # シーンタグと感情が前回とほぼ同じなら画像生成を省略する（類似度のしきい値）
+        "scene_skip": True,
+        "scene_skip_threshold": 0.8,
+        # 読み込み済みモデルのジョブをまとめて処理する際、他モデルのジョブを待たせる最大秒数
+        "checkpoint_max_wait": 20,
+        # 感情別スプライトを事前生成し、感情変化時に即表示する
+        "sprite_atlas": True,
+        # 応答ごとにシーン画像も生成する（False ならスプライトのみ）
+        "scene_generation": True,
+        # 応答文を辞書でタグ化し、カバー率がしきい値以上なら LLM による要約を省略する
+        "local_tags": True,
+        "local_tags_min_coverage": 0.5,
+        # プロンプトに使う CLIP チャンク（75トークン）数の上限と、チャンク境界への BREAK 挿入
+        "prompt_max_chunks": 2,
+        "prompt_use_break": True,
     },
     "voice": {
         "enabled": False,
         "speed": 1.0,
         "pitch": 1.0,
+        # 読み上げ待ちの上限と、満杯・新しい応答が来たときの扱い
+        # （"drop_oldest": 古いものを捨てる / "replace_pending": 待機中を置き換える / "interrupt": 再生中も中断する）
+        "queue_size": 4,
+        "queue_policy": "drop_oldest",
+        # 合成済み音声のディスクキャッシュの上限（MB。0で無効）と、キャラクター選択時の会話開始メッセージの事前合成
+        "cache_max_mb": 200,
+        "prerender_starters": False,
+        # 出力先（"speaker": サーバーの音声デバイス / "browser": 別プロセスで合成・圧縮してブラウザで再生）
+        "output": "speaker",
+        "browser_engine": "gtts",
+        "browser_format": "ogg",
+        "render_processes": 2,
+        # 新しいメッセージを送ったら、前の応答の読み上げ（再生中・読み上げ待ち・合成前の文）を止める
+        "interrupt_on_new_message": True,
     },
     "theme": {
         "name": "default",
     },
+    "emotion": {
+        # 感情統計に使う直近の履歴の件数
+        "history_size": 10,
+        # 長期傾向の減衰率（0〜1。大きいほど昔の感情が残る。0で無効）
+        "decay": 0.9,
+        # 学習済みの感情分類器（train_emotion_classifier.py で作成）を辞書より優先して使う
+        "classifier": False,
+        "classifier_model": "models/emotion_classifier.npz",
+        # 1メッセージあたりの時間予算（超えたら辞書で判定）と、採用する最小の確率
+        "classifier_budget_ms": 5.0,
+        "classifier_min_confidence": 0.5,
+    },
     "images": {
         "background": "",
         "icon": "",
+        # 生成画像の保存形式（"png" / "webp"）と圧縮設定
+        "save_format": "png",
+        "png_compress_level": 6,
+        "webp_lossless": True,
+        "webp_quality": 80,
+        "save_queue_size": 16,
+        "save_sharded": True,
     },
     "user": {
         "name": "",
@@ -32,7 +32,7 @@ class ConversationManager:
             conversation_data = {
                 "character_name": character_name,
                 "timestamp": timestamp,
-                "messages": messages,
+                "messages": [self._serializable_message(message) for message in messages],
                 "metadata": metadata or {},
                 "message_count": len(messages),
                 "created_at": datetime.datetime.now().isoformat()
@@ -47,6 +47,24 @@ class ConversationManager:
             print(f"会話保存エラー: {e}")
             return None
     
+    @staticmethod
+    def _serializable_message(message: Dict) -> Dict:
+        """
+        メッセージから JSON に保存できない値（生成画像のオブジェクトなど）を除く
+        
+        感情の注釈（"emotion"）はそのまま保存され、読み込み時の再分析を省ける。
+        
+        Args:
+            message (Dict): メッセージ
+            
+        Returns:
+            Dict: 保存用のメッセージ
+        """
+        return {
+            key: value for key, value in message.items()
+            if value is None or isinstance(value, (str, int, float, bool, list, dict))
+        }
+    
     def load_conversation(self, filepath: str) -> Optional[Dict]:
         """
         会話履歴を読み込み
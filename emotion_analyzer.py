@@ -1,7 +1,17 @@
+import datetime
 import re
-from typing import Dict, List, Optional
+from collections import deque
+from typing import Dict, List, Optional, Tuple
 from enum import Enum
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from emotion_classifier import DEFAULT_MODEL_PATH, HashingEmotionClassifier
+from emotion_lexicon import DEFAULT_LEXICON_PATH, LexiconStream, load_lexicon
+
 class Emotion(Enum):
     """感情の種類"""
     HAPPY = "happy"
@@ -13,42 +23,62 @@ class Emotion(Enum):
     WORRIED = "worried"
     SHY = "shy"
 
+def make_emotion_annotation(emotion: Emotion, scores) -> Dict:
+    """
+    メッセージに保存する感情の注釈を作る（JSON に保存できる形）
+    
+    Args:
+        emotion (Emotion): 判定した感情
+        scores: 感情ごとのスコア（Emotion の定義順）
+        
+    Returns:
+        Dict: {"label": 感情の値, "scores": {感情の値: スコア}}
+    """
+    return {
+        "label": emotion.value,
+        "scores": {
+            key.value: round(float(score), 4)
+            for key, score in zip(Emotion, scores)
+        }
+    }
+
+def read_emotion_annotation(message: Dict) -> Optional[Tuple[Emotion, List[float]]]:
+    """
+    メッセージに保存された感情の注釈を読み出す
+    
+    Args:
+        message (Dict): 会話履歴のメッセージ
+        
+    Returns:
+        Optional[Tuple[Emotion, List[float]]]: 感情とスコア（Emotion の定義順）。注釈が無い・壊れている場合は None
+    """
+    annotation = message.get("emotion")
+    if not isinstance(annotation, dict):
+        return None
+    try:
+        emotion = Emotion(annotation.get("label"))
+        stored_scores = annotation.get("scores") or {}
+        return emotion, [float(stored_scores.get(key.value, 0.0)) for key in Emotion]
+    except (ValueError, TypeError, AttributeError):
+        return None
+
 class EmotionAnalyzer:
-    def __init__(self):
+    def __init__(self, lexicon_path: str = DEFAULT_LEXICON_PATH):
         """
         感情分析クラスの初期化
+        
+        Args:
+            lexicon_path (str): 感情辞書（感情語の重み・強調語・否定表現）のパス
         """
-        # 感情キーワード辞書
-        self.emotion_keywords = {
-            Emotion.HAPPY: [
-                "嬉しい", "楽しい", "幸せ", "喜ぶ", "笑う", "笑顔", "ハッピー", "最高", "素晴らしい",
-                "やったー", "わーい", "やった", "良かった", "ありがとう", "感謝", "ありがたい"
-            ],
-            Emotion.SAD: [
-                "悲しい", "辛い", "寂しい", "泣く", "涙", "残念", "落ち込む", "憂鬱", "がっかり",
-                "つらい", "悲しみ", "さみしい", "しょんぼり", "ため息"
-            ],
-            Emotion.ANGRY: [
-                "怒る", "腹立つ", "イライラ", "むかつく", "怒り", "キレる", "頭にくる", "許せない",
-                "ふざけるな", "バカ", "あほ", "うざい", "腹が立つ"
-            ],
-            Emotion.SURPRISED: [
-                "驚く", "びっくり", "まさか", "え！", "えー", "うそ", "信じられない", "すごい",
-                "わあ", "おお", "驚き", "びっくりした"
-            ],
-            Emotion.EXCITED: [
-                "興奮", "ワクワク", "ドキドキ", "楽しみ", "期待", "待ちきれない", "テンション",
-                "やる気", "元気", "活発", "エネルギッシュ"
-            ],
-            Emotion.WORRIED: [
-                "心配", "不安", "気になる", "大丈夫", "どうしよう", "困る", "悩む", "迷う",
-                "緊張", "ドキドキ", "ハラハラ", "気がかり"
-            ],
-            Emotion.SHY: [
-                "恥ずかしい", "照れる", "はずかしい", "もじもじ", "赤面", "テレる", "恥",
-                "内気", "シャイ", "遠慮", "控えめ"
-            ]
-        }
+        # 感情辞書（コンパイル結果は辞書ファイルのハッシュごとにディスクへキャッシュされる）
+        self.load_lexicon(lexicon_path)
+        
+        # 任意の学習済み分類器（configure_classifier で有効化。時間予算を超えたら辞書で判定）
+        self.classifier: Optional[HashingEmotionClassifier] = None
+        self.classifier_path: Optional[str] = None
+        self.classifier_budget_ms = 5.0
+        self.classifier_min_confidence = 0.5
+        self.classifier_stats: Dict[str, int] = {"classifier": 0, "fallback": 0}
         
         # 感情に対応する画像プロンプト修飾子
         self.emotion_prompts = {
@@ -62,6 +92,53 @@ class EmotionAnalyzer:
             Emotion.SHY: "shy expression, blushing, bashful, timid, cute"
         }
     
+    def load_lexicon(self, lexicon_path: str):
+        """
+        感情辞書を読み込み、分析に使う語彙を切り替える
+        
+        Args:
+            lexicon_path (str): 感情辞書のパス
+        """
+        self.lexicon_path = lexicon_path
+        self.lexicon = load_lexicon(lexicon_path, [emotion.value for emotion in Emotion])
+        # 参照用: 感情ごとの語の一覧
+        self.emotion_keywords = {
+            Emotion(name): terms for name, terms in self.lexicon.get_emotion_terms().items() if terms
+        }
+        
+        # 一括解析用: 語×感情の重み行列（列は Emotion の定義順）
+        self._weight_matrix = None
+        self._negated_weight_matrix = None
+        if np is not None:
+            empty_row = [[0.0] * len(Emotion)]
+            self._weight_matrix = np.asarray(self.lexicon.weights or empty_row, dtype=np.float64)
+            self._negated_weight_matrix = np.asarray(self.lexicon.negated_weights or empty_row, dtype=np.float64)
+    
+    def configure_classifier(self, settings: Dict):
+        """
+        学習済み分類器の利用を設定
+        
+        Args:
+            settings (Dict): ConfigManager の "emotion" セクション
+        """
+        self.classifier_budget_ms = float(settings.get("classifier_budget_ms", self.classifier_budget_ms))
+        self.classifier_min_confidence = float(settings.get("classifier_min_confidence", self.classifier_min_confidence))
+        if not settings.get("classifier", False):
+            self.classifier = None
+            self.classifier_path = None
+            return
+        
+        model_path = settings.get("classifier_model") or DEFAULT_MODEL_PATH
+        if model_path == self.classifier_path:
+            return
+        # 読み込みに失敗した場合も同じパスを何度も試さないよう記録しておく
+        self.classifier_path = model_path
+        try:
+            self.classifier = HashingEmotionClassifier.load(model_path)
+        except Exception as e:
+            print(f"感情分類器の読み込みエラー: {e}")
+            self.classifier = None
+    
     def analyze_emotion(self, text: str) -> Emotion:
         """
         テキストから感情を分析
@@ -72,21 +149,103 @@ class EmotionAnalyzer:
         Returns:
             Emotion: 検出された感情
         """
-        emotion_scores = {emotion: 0 for emotion in Emotion}
+        return self.analyze_with_scores(text)[0]
+    
+    def analyze_with_scores(self, text: str) -> Tuple[Emotion, List[float]]:
+        """
+        テキストから感情と感情ごとのスコアを分析
+        
+        Args:
+            text (str): 分析するテキスト
+            
+        Returns:
+            Tuple[Emotion, List[float]]: 検出された感情と、辞書によるスコア（Emotion の定義順）
+        """
+        scores = self.lexicon.score(text)
+        if self.classifier is not None:
+            emotion = self._classify([text])[0]
+            if emotion is not None:
+                return emotion, scores
+        return self._label(scores), scores
+    
+    def analyze_batch(self, texts: List[str]) -> Tuple[List[Emotion], "np.ndarray"]:
+        """
+        複数のテキストの感情をまとめて分析
         
-        # 各感情のキーワードをチェック
-        for emotion, keywords in self.emotion_keywords.items():
-            for keyword in keywords:
-                if keyword in text:
-                    emotion_scores[emotion] += 1
+        メッセージ×語の出現を疎な形で集め、NumPy で感情ごとのスコアに集約する。
+        結果は analyze_emotion を1件ずつ呼んだ場合と同じになる。
         
-        # 最もスコアの高い感情を返す
-        max_emotion = max(emotion_scores.items(), key=lambda x: x[1])
+        Args:
+            texts (List[str]): 分析するテキストのリスト
+            
+        Returns:
+            Tuple[List[Emotion], np.ndarray]: テキストごとの感情と、
+                辞書によるスコア行列（行がテキスト、列が Emotion の定義順）。
+                NumPy が無い環境ではスコアはリストのリストになる。
+                分類器が有効な場合、感情は分類器の結果を優先する。
+        """
+        labels, scores = self._analyze_batch_with_lexicon(texts)
+        if self.classifier is not None:
+            for index, emotion in enumerate(self._classify(texts)):
+                if emotion is not None:
+                    labels[index] = emotion
+        return labels, scores
+    
+    def _analyze_batch_with_lexicon(self, texts: List[str]) -> Tuple[List[Emotion], "np.ndarray"]:
+        if self._weight_matrix is None:
+            scores = [self.lexicon.score(text or "") for text in texts]
+            return [self._label(row_scores) for row_scores in scores], scores
         
-        if max_emotion[1] > 0:
-            return max_emotion[0]
-        else:
-            return Emotion.NEUTRAL
+        rows: List[int] = []
+        term_ids: List[int] = []
+        multipliers: List[float] = []
+        negated_flags: List[bool] = []
+        for row, text in enumerate(texts):
+            for term_id, multiplier, negated in self.lexicon.find_hits(text or ""):
+                rows.append(row)
+                term_ids.append(term_id)
+                multipliers.append(multiplier)
+                negated_flags.append(negated)
+        
+        scores = np.zeros((len(texts), len(Emotion)), dtype=np.float64)
+        if rows:
+            term_index = np.asarray(term_ids)
+            contributions = np.where(
+                np.asarray(negated_flags)[:, None],
+                self._negated_weight_matrix[term_index],
+                self._weight_matrix[term_index]
+            ) * np.asarray(multipliers, dtype=np.float64)[:, None]
+            np.add.at(scores, np.asarray(rows), contributions)
+        
+        emotions = list(Emotion)
+        # argmax は同点なら先頭の列（Emotion の定義順で最初の感情）を返す
+        best_columns = scores.argmax(axis=1) if len(texts) else np.zeros(0, dtype=np.int64)
+        has_hit = scores.max(axis=1) > 0 if len(texts) else np.zeros(0, dtype=bool)
+        labels = [
+            emotions[column] if hit else Emotion.NEUTRAL
+            for column, hit in zip(best_columns.tolist(), has_hit.tolist())
+        ]
+        return labels, scores
+    
+    def _classify(self, texts: List[str]) -> List[Optional[Emotion]]:
+        """分類器で判定する（時間予算超過・確信度不足は None）"""
+        results = self.classifier.classify(texts, self.classifier_budget_ms, self.classifier_min_confidence)
+        emotions: List[Optional[Emotion]] = []
+        for result in results:
+            if result is None:
+                self.classifier_stats["fallback"] += 1
+                emotions.append(None)
+            else:
+                self.classifier_stats["classifier"] += 1
+                emotions.append(Emotion(result[0]))
+        return emotions
+    
+    def _label(self, scores: List[float]) -> Emotion:
+        """スコアが最も高い感情を返す（同点なら Emotion の定義順、すべて0以下なら中立）"""
+        best = max(scores)
+        if best > 0:
+            return list(Emotion)[scores.index(best)]
+        return Emotion.NEUTRAL
     
     def get_emotion_prompt(self, emotion: Emotion, base_prompt: str) -> str:
         """
@@ -184,42 +343,259 @@ class EmotionAnalyzer:
         
         return descriptions.get(emotion, "😐 中立")
 
+class IncrementalEmotionAnalyzer:
+    def __init__(self, emotion_analyzer: Optional[EmotionAnalyzer] = None):
+        """
+        ストリーミングで届く応答を、届いた分だけ追加で分析するクラスの初期化
+        
+        チャンクごとの処理量はチャンクの長さに比例し、途中でも現在の感情を取得できる。
+        全チャンクを feed した後の finish() は、全文を analyze_emotion した結果と一致する。
+        
+        Args:
+            emotion_analyzer (EmotionAnalyzer): 辞書を共有する感情分析器
+        """
+        self.emotion_analyzer = emotion_analyzer or EmotionAnalyzer()
+        self._stream = LexiconStream(self.emotion_analyzer.lexicon)
+        # 分類器は全文で判定するため、有効な場合のみ本文を保持する
+        self._chunks: List[str] = []
+        self.current_emotion = Emotion.NEUTRAL
+    
+    def feed(self, chunk: str) -> Emotion:
+        """
+        応答の続きを追加して分析
+        
+        Args:
+            chunk (str): 新しく届いたテキスト
+            
+        Returns:
+            Emotion: 現時点で最も強い感情
+        """
+        if self.emotion_analyzer.classifier is not None:
+            self._chunks.append(chunk)
+        scores = self._stream.feed(chunk)
+        self.current_emotion = self.emotion_analyzer._label(scores)
+        return self.current_emotion
+    
+    def finish(self) -> Emotion:
+        """
+        応答の終わりとして保留中の語を確定させる
+        
+        Returns:
+            Emotion: 応答全体の感情
+        """
+        self.current_emotion = self.emotion_analyzer._label(self._stream.finish())
+        if self.emotion_analyzer.classifier is not None and self._chunks:
+            emotion = self.emotion_analyzer._classify(["".join(self._chunks)])[0]
+            if emotion is not None:
+                self.current_emotion = emotion
+        return self.current_emotion
+    
+    def get_scores(self) -> Dict[Emotion, float]:
+        """
+        現時点の感情ごとのスコアを取得
+        
+        Returns:
+            Dict[Emotion, float]: 感情 -> スコア
+        """
+        return dict(zip(Emotion, self._stream.current_scores()))
+    
+    def get_annotation(self) -> Dict:
+        """
+        現時点の感情とスコアを、メッセージに保存する注釈として取得
+        
+        Returns:
+            Dict: make_emotion_annotation の形式の注釈
+        """
+        return make_emotion_annotation(self.current_emotion, self._stream.current_scores())
+
 class EmotionalCharacterManager:
-    def __init__(self):
+    def __init__(self, history_size: int = 10, decay: float = 0.9):
         """
         感情表現キャラクター管理クラスの初期化
+        
+        Args:
+            history_size (int): 統計に使う直近の履歴の件数
+            decay (float): 長期傾向の減衰率（0〜1。大きいほど昔の感情が残る。0で無効）
         """
         self.emotion_analyzer = EmotionAnalyzer()
         self.current_emotion = Emotion.NEUTRAL
-        self.emotion_history = []
-    
-    def update_emotion(self, text: str) -> Emotion:
+        self.decay = decay
+        # 直近 history_size 件の履歴（古いものは自動的に押し出される）と、その感情ごとの件数
+        self.emotion_history: deque = deque(maxlen=max(1, int(history_size)))
+        self._emotion_counts: Dict[Emotion, int] = {emotion: 0 for emotion in Emotion}
+        # 生の履歴を持たずに済む、指数的に減衰させた感情ごとの累積値
+        self.decayed_scores: Dict[Emotion, float] = {emotion: 0.0 for emotion in Emotion}
+        self._decayed_total = 0.0
+        self._statistics: Optional[Dict] = None
+        # 直近の update_emotion で感情が変化したか（スプライト切り替え用）
+        self.emotion_changed = False
+        # 直近の update_emotion の結果（メッセージに保存する注釈）
+        self.last_annotation: Optional[Dict] = None
+
+    def reset(self):
+        """
+        現在の感情・履歴・統計を初期状態に戻す（キャラクター変更や会話リセット時）
+        """
+        self.current_emotion = Emotion.NEUTRAL
+        self.emotion_history.clear()
+        self._emotion_counts = {emotion: 0 for emotion in Emotion}
+        self.decayed_scores = {emotion: 0.0 for emotion in Emotion}
+        self._decayed_total = 0.0
+        self._statistics = None
+        self.emotion_changed = False
+        self.last_annotation = None
+
+    def set_history_size(self, history_size: int):
+        """
+        統計に使う履歴の件数を変更（減らした場合は古いものから捨てる）
+        
+        Args:
+            history_size (int): 履歴の件数
+        """
+        history_size = max(1, int(history_size))
+        if history_size == self.emotion_history.maxlen:
+            return
+        self.emotion_history = deque(self.emotion_history, maxlen=history_size)
+        self._emotion_counts = {emotion: 0 for emotion in Emotion}
+        for entry in self.emotion_history:
+            self._emotion_counts[entry["emotion"]] += 1
+        self._statistics = None
+
+    def set_decay(self, decay: float):
+        """
+        長期傾向の減衰率を変更（変わった場合だけ統計を作り直す）
+        
+        Args:
+            decay (float): 減衰率（0〜1。0で無効）
+        """
+        decay = max(0.0, min(1.0, float(decay)))
+        if decay == self.decay:
+            return
+        self.decay = decay
+        self._statistics = None
+
+    def _record(self, emotion: Emotion, text: str, timestamp: str):
+        """履歴・件数・長期傾向に1件追加する（履歴の件数によらず一定時間）"""
+        if len(self.emotion_history) == self.emotion_history.maxlen:
+            self._emotion_counts[self.emotion_history[0]["emotion"]] -= 1
+        self.emotion_history.append({
+            "emotion": emotion,
+            "text": text[:100],  # 最初の100文字のみ保存
+            "timestamp": timestamp
+        })
+        self._emotion_counts[emotion] += 1
+        
+        if self.decay > 0:
+            for key in self.decayed_scores:
+                self.decayed_scores[key] *= self.decay
+            self.decayed_scores[emotion] += 1.0
+            self._decayed_total = self._decayed_total * self.decay + 1.0
+        self._statistics = None
+
+    def update_emotion(self, text: str, emotion: Optional[Emotion] = None,
+                       annotation: Optional[Dict] = None) -> Emotion:
         """
         テキストから感情を更新
         
+        結果の注釈（感情とスコア）は last_annotation に残るので、メッセージに保存できる。
+        
         Args:
             text (str): 分析するテキスト
+            emotion (Emotion): 分析済みの感情（ストリーミング中に求めた場合など。省略時は text を分析）
+            annotation (Dict): emotion に対応する分析済みの注釈（省略時は text のスコアから作る）
             
         Returns:
             Emotion: 更新された感情
         """
-        emotion = self.emotion_analyzer.analyze_emotion(text)
+        if emotion is None:
+            emotion, scores = self.emotion_analyzer.analyze_with_scores(text)
+            annotation = make_emotion_annotation(emotion, scores)
+        elif annotation is None:
+            annotation = make_emotion_annotation(emotion, self.emotion_analyzer.lexicon.score(text))
+        self.emotion_changed = emotion != self.current_emotion
         self.current_emotion = emotion
+        self.last_annotation = annotation
         
         # 感情履歴に追加
-        import datetime
-        self.emotion_history.append({
-            "emotion": emotion,
-            "text": text[:100],  # 最初の100文字のみ保存
-            "timestamp": datetime.datetime.now().isoformat()
-        })
-        
-        # 履歴は最新10件まで保持
-        if len(self.emotion_history) > 10:
-            self.emotion_history = self.emotion_history[-10:]
+        self._record(emotion, text, datetime.datetime.now().isoformat())
         
         return emotion
     
+    def start_stream(self) -> IncrementalEmotionAnalyzer:
+        """
+        ストリーミング応答の逐次分析を開始
+        
+        Returns:
+            IncrementalEmotionAnalyzer: チャンクを feed する分析器
+        """
+        return IncrementalEmotionAnalyzer(self.emotion_analyzer)
+    
+    def restore_history(self, messages: List[Dict]):
+        """
+        保存された会話から感情履歴と現在の感情を復元
+        
+        注釈（"emotion"）が保存されているメッセージはそれを使い、
+        注釈の無いメッセージだけをまとめて分析して注釈を書き込む。
+        
+        Args:
+            messages (List[Dict]): 会話履歴（role と content を持つ辞書）
+        """
+        chat_messages = [msg for msg in messages if msg.get("role") in ("user", "assistant")]
+        labels: List[Optional[Emotion]] = [None] * len(chat_messages)
+        missing: List[int] = []
+        for index, msg in enumerate(chat_messages):
+            stored = read_emotion_annotation(msg)
+            if stored is None:
+                missing.append(index)
+            else:
+                labels[index] = stored[0]
+        
+        if missing:
+            missing_labels, missing_scores = self.emotion_analyzer.analyze_batch(
+                [chat_messages[index].get("content", "") for index in missing]
+            )
+            for index, emotion, scores in zip(missing, missing_labels, missing_scores):
+                labels[index] = emotion
+                chat_messages[index]["emotion"] = make_emotion_annotation(emotion, scores)
+        
+        timestamp = datetime.datetime.now().isoformat()
+        self.reset()
+        for msg, emotion in zip(chat_messages, labels):
+            self._record(emotion, msg.get("content", ""), timestamp)
+        self.current_emotion = labels[-1] if labels else Emotion.NEUTRAL
+        if chat_messages:
+            self.last_annotation = chat_messages[-1]["emotion"]
+    
+    def get_conversation_statistics(self, messages: List[Dict]) -> Dict:
+        """
+        メッセージに保存された注釈から、会話全体の感情の統計を集計（再分析はしない）
+        
+        Args:
+            messages (List[Dict]): 会話履歴
+            
+        Returns:
+            Dict: 注釈のあるメッセージ数、感情ごとの件数・割合、スコアの平均
+        """
+        counts: Dict[Emotion, int] = {}
+        score_totals = [0.0] * len(Emotion)
+        annotated = 0
+        for msg in messages:
+            stored = read_emotion_annotation(msg)
+            if stored is None:
+                continue
+            emotion, scores = stored
+            annotated += 1
+            counts[emotion] = counts.get(emotion, 0) + 1
+            score_totals = [total + score for total, score in zip(score_totals, scores)]
+        if not annotated:
+            return {}
+        return {
+            "annotated": annotated,
+            "counts": counts,
+            "percentages": {emotion: count / annotated * 100 for emotion, count in counts.items()},
+            "mean_scores": {emotion: total / annotated for emotion, total in zip(Emotion, score_totals)},
+        }
+    
     def get_emotional_image_prompt(self, base_prompt: str, emotion: Emotion = None) -> str:
         """
         感情に応じた画像プロンプトを生成
@@ -251,28 +627,42 @@ class EmotionalCharacterManager:
     
     def get_emotion_statistics(self) -> Dict:
         """
-        感情統計を取得
+        感情統計を取得（逐次更新している件数から作るため、履歴の件数によらず一定時間）
         
         Returns:
             Dict: 感情統計
         """
         if not self.emotion_history:
             return {}
+        if self._statistics is not None:
+            return self._statistics
         
-        emotion_counts = {}
-        for entry in self.emotion_history:
-            emotion = entry["emotion"]
-            emotion_counts[emotion] = emotion_counts.get(emotion, 0) + 1
-        
+        emotion_counts = {emotion: count for emotion, count in self._emotion_counts.items() if count}
         total = len(self.emotion_history)
         emotion_percentages = {
             emotion: (count / total) * 100
             for emotion, count in emotion_counts.items()
         }
         
-        return {
+        self._statistics = {
             "counts": emotion_counts,
             "percentages": emotion_percentages,
             "total_messages": total,
-            "most_frequent": max(emotion_counts.items(), key=lambda x: x[1])[0] if emotion_counts else Emotion.NEUTRAL
+            "most_frequent": max(emotion_counts.items(), key=lambda x: x[1])[0] if emotion_counts else Emotion.NEUTRAL,
+            "long_term": self.get_long_term_tendency()
+        }
+        return self._statistics
+    
+    def get_long_term_tendency(self) -> Dict[Emotion, float]:
+        """
+        減衰させた累積値から、会話全体の感情の傾向を取得
+        
+        Returns:
+            Dict[Emotion, float]: 感情 -> 割合（0〜1。長期傾向が無効なら空）
+        """
+        if self.decay <= 0 or self._decayed_total <= 0:
+            return {}
+        return {
+            emotion: value / self._decayed_total
+            for emotion, value in self.decayed_scores.items() if value > 1e-6
         }
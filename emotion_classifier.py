@@ -0,0 +1,283 @@
+import os
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 学習済みモデルの既定の保存先（train_emotion_classifier.py が書き出す）
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models", "emotion_classifier.npz")
+
+DEFAULT_N_FEATURES = 2 ** 16
+DEFAULT_NGRAM_RANGE = (1, 3)
+
+
+def hash_features(text: str, n_features: int = DEFAULT_N_FEATURES,
+                  ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE) -> Dict[int, float]:
+    """
+    文字 n-gram をハッシュして疎な特徴量にする
+
+    語彙表を持たずに済むよう、n-gram を CRC32 で n_features 次元へ写像する。
+    衝突による偏りを打ち消すため、ハッシュの最上位ビットで符号を決める。
+
+    Args:
+        text (str): 入力テキスト
+        n_features (int): 特徴量の次元数
+        ngram_range (Tuple[int, int]): n-gram の最小長と最大長
+
+    Returns:
+        Dict[int, float]: 特徴量の添字 -> 値（L2 正規化済み）
+    """
+    features: Dict[int, float] = {}
+    padded = f"\x02{text}\x03"
+    min_n, max_n = ngram_range
+    for n in range(min_n, max_n + 1):
+        for start in range(len(padded) - n + 1):
+            digest = zlib.crc32(padded[start:start + n].encode("utf-8"))
+            index = digest % n_features
+            features[index] = features.get(index, 0.0) + (1.0 if digest & 0x80000000 else -1.0)
+    norm = sum(value * value for value in features.values()) ** 0.5
+    if norm:
+        for index in features:
+            features[index] /= norm
+    return features
+
+
+def batch_features(texts: Sequence[str], n_features: int = DEFAULT_N_FEATURES,
+                   ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    複数テキストの特徴量を (行, 列, 値) の疎な形式でまとめる
+
+    Args:
+        texts (Sequence[str]): 入力テキスト
+        n_features (int): 特徴量の次元数
+        ngram_range (Tuple[int, int]): n-gram の最小長と最大長
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: 行番号・特徴量の添字・値
+    """
+    rows: List[int] = []
+    columns: List[int] = []
+    values: List[float] = []
+    for row, text in enumerate(texts):
+        features = hash_features(text or "", n_features, ngram_range)
+        rows.extend([row] * len(features))
+        columns.extend(features.keys())
+        values.extend(features.values())
+    return (
+        np.asarray(rows, dtype=np.int64),
+        np.asarray(columns, dtype=np.int64),
+        np.asarray(values, dtype=np.float32),
+    )
+
+
+def softmax(logits: "np.ndarray") -> "np.ndarray":
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class HashingEmotionClassifier:
+    def __init__(self, weights: "np.ndarray", bias: "np.ndarray", labels: Sequence[str],
+                 ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE):
+        """
+        文字 n-gram ハッシュ特徴量の線形分類器（推論は NumPy のみ）
+
+        Args:
+            weights (np.ndarray): 重み（特徴量の次元数 × ラベル数）
+            bias (np.ndarray): バイアス（ラベル数）
+            labels (Sequence[str]): ラベル名（Emotion の値）
+            ngram_range (Tuple[int, int]): 学習時の n-gram の範囲
+        """
+        if np is None:
+            raise ImportError("numpy is not installed. Please install it using: pip install numpy")
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.labels = list(labels)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.n_features = self.weights.shape[0]
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH) -> "HashingEmotionClassifier":
+        """
+        学習済みモデルを読み込む
+
+        Args:
+            path (str): モデルファイル（.npz）のパス
+
+        Returns:
+            HashingEmotionClassifier: 分類器
+        """
+        if np is None:
+            raise ImportError("numpy is not installed. Please install it using: pip install numpy")
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["weights"],
+                data["bias"],
+                [str(label) for label in data["labels"]],
+                tuple(int(n) for n in data["ngram_range"]),
+            )
+
+    def save(self, path: str):
+        """
+        モデルを保存する
+
+        Args:
+            path (str): 保存先（.npz）
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            labels=np.asarray(self.labels),
+            ngram_range=np.asarray(self.ngram_range),
+        )
+
+    def predict_proba(self, texts: Sequence[str]) -> "np.ndarray":
+        """
+        ラベルごとの確率をまとめて計算
+
+        Args:
+            texts (Sequence[str]): 入力テキスト
+
+        Returns:
+            np.ndarray: 確率（テキスト数 × ラベル数）
+        """
+        rows, columns, values = batch_features(texts, self.n_features, self.ngram_range)
+        return softmax(self._logits(rows, columns, values, len(texts)))
+
+    def classify(self, texts: Sequence[str], budget_ms: float,
+                 min_confidence: float = 0.0) -> List[Optional[Tuple[str, float]]]:
+        """
+        1件あたりの時間予算内でラベルを推定
+
+        予算を超えそうな（長すぎる）テキストや、確信度が低いテキスト、
+        全体の予算を使い切った後のテキストは None を返すので、呼び出し元で別の方法に切り替える。
+
+        Args:
+            texts (Sequence[str]): 入力テキスト
+            budget_ms (float): 1件あたりの時間予算（ミリ秒）
+            min_confidence (float): 採用する最小の確率
+
+        Returns:
+            List[Optional[Tuple[str, float]]]: テキストごとの (ラベル, 確率) または None
+        """
+        results: List[Optional[Tuple[str, float]]] = [None] * len(texts)
+        if not texts:
+            return results
+        budget = budget_ms / 1000.0
+        deadline = time.perf_counter() + budget * len(texts)
+        # 特徴量の計算時間はほぼ文字数に比例するので、文字数から事前に見積もる
+        max_chars = max(1, int(budget / max(_seconds_per_char(self.ngram_range), 1e-9)))
+        accepted = [index for index, text in enumerate(texts) if len(text or "") <= max_chars]
+
+        started = time.perf_counter()
+        processed: List[int] = []
+        rows: List[int] = []
+        columns: List[int] = []
+        values: List[float] = []
+        for index in accepted:
+            if time.perf_counter() > deadline:
+                break
+            features = hash_features(texts[index] or "", self.n_features, self.ngram_range)
+            rows.extend([len(processed)] * len(features))
+            columns.extend(features.keys())
+            values.extend(features.values())
+            processed.append(index)
+        if not processed:
+            return results
+
+        probabilities = softmax(self._logits(
+            np.asarray(rows, dtype=np.int64),
+            np.asarray(columns, dtype=np.int64),
+            np.asarray(values, dtype=np.float32),
+            len(processed)
+        ))
+        elapsed = time.perf_counter() - started
+        _observe_cost(self.ngram_range, elapsed, sum(len(texts[index] or "") for index in processed))
+        # 1件のみの推論で予算を超えた場合は、結果を使わずに切り替える
+        if len(texts) == 1 and elapsed > budget:
+            return results
+
+        best_columns = probabilities.argmax(axis=1)
+        for position, index in enumerate(processed):
+            confidence = float(probabilities[position, best_columns[position]])
+            if confidence >= min_confidence:
+                results[index] = (self.labels[int(best_columns[position])], confidence)
+        return results
+
+    def _logits(self, rows: "np.ndarray", columns: "np.ndarray", values: "np.ndarray", count: int) -> "np.ndarray":
+        """疎な特徴量と重みの積（行ごとに集約）にバイアスを加える"""
+        logits = np.tile(self.bias, (count, 1))
+        if len(rows):
+            np.add.at(logits, rows, self.weights[columns] * values[:, None])
+        return logits
+
+
+# 1文字あたりの処理時間の移動平均（n-gram の範囲ごと）
+_cost_per_char: Dict[Tuple[int, int], float] = {}
+
+
+def _seconds_per_char(ngram_range: Tuple[int, int]) -> float:
+    # 実測が無いうちは n-gram 1種類あたり 0.5µs と仮定する
+    return _cost_per_char.get(ngram_range, 5e-7 * (ngram_range[1] - ngram_range[0] + 1))
+
+
+def _observe_cost(ngram_range: Tuple[int, int], elapsed: float, chars: int):
+    if chars <= 0:
+        return
+    previous = _seconds_per_char(ngram_range)
+    _cost_per_char[ngram_range] = previous * 0.8 + (elapsed / chars) * 0.2
+
+
+def train_classifier(texts: Sequence[str], labels: Sequence[str], label_names: Sequence[str],
+                     n_features: int = DEFAULT_N_FEATURES, ngram_range: Tuple[int, int] = DEFAULT_NGRAM_RANGE,
+                     epochs: int = 200, learning_rate: float = 0.5, l2: float = 1e-4,
+                     log_every: int = 0) -> HashingEmotionClassifier:
+    """
+    多クラスロジスティック回帰を NumPy の全バッチ勾配降下で学習する
+
+    Args:
+        texts (Sequence[str]): 学習用テキスト
+        labels (Sequence[str]): 正解ラベル（label_names のいずれか）
+        label_names (Sequence[str]): ラベル名（出力の列の順番）
+        n_features (int): 特徴量の次元数
+        ngram_range (Tuple[int, int]): n-gram の最小長と最大長
+        epochs (int): 反復回数
+        learning_rate (float): 学習率
+        l2 (float): L2 正則化の強さ
+        log_every (int): この反復ごとに損失を表示（0で表示しない）
+
+    Returns:
+        HashingEmotionClassifier: 学習済みの分類器
+    """
+    if np is None:
+        raise ImportError("numpy is not installed. Please install it using: pip install numpy")
+    label_index = {name: column for column, name in enumerate(label_names)}
+    targets = np.asarray([label_index[label] for label in labels], dtype=np.int64)
+    rows, columns, values = batch_features(texts, n_features, ngram_range)
+    sample_count = len(texts)
+    one_hot = np.zeros((sample_count, len(label_names)), dtype=np.float32)
+    one_hot[np.arange(sample_count), targets] = 1.0
+
+    weights = np.zeros((n_features, len(label_names)), dtype=np.float32)
+    bias = np.zeros(len(label_names), dtype=np.float32)
+    for epoch in range(1, epochs + 1):
+        logits = np.tile(bias, (sample_count, 1))
+        np.add.at(logits, rows, weights[columns] * values[:, None])
+        probabilities = softmax(logits)
+        gradient_logits = (probabilities - one_hot) / sample_count
+
+        gradient_weights = l2 * weights
+        np.add.at(gradient_weights, columns, gradient_logits[rows] * values[:, None])
+        weights -= learning_rate * gradient_weights
+        bias -= learning_rate * gradient_logits.sum(axis=0)
+
+        if log_every and epoch % log_every == 0:
+            loss = -np.log(probabilities[np.arange(sample_count), targets] + 1e-9).mean()
+            print(f"epoch {epoch}: loss {loss:.4f}")
+    return HashingEmotionClassifier(weights, bias, label_names, ngram_range)
@@ -0,0 +1,442 @@
+import bisect
+import glob
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from keyword_automaton import KeywordAutomaton
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 感情語・強調語・否定表現をまとめた辞書ファイルと、コンパイル結果の保存先
+DEFAULT_LEXICON_PATH = os.path.join(_BASE_DIR, "emotion_lexicon.json")
+DEFAULT_CACHE_DIR = os.path.join(_BASE_DIR, "cache")
+
+# コンパイル結果の形式を変えたら上げる（古いキャッシュを読まないようにする）
+COMPILED_FORMAT_VERSION = 1
+
+# 語の種類
+TERM_EMOTION = 0
+TERM_INTENSIFIER = 1
+TERM_NEGATION = 2
+
+# 同じプロセス内で読み込み済みの辞書（ファイルのハッシュ -> コンパイル結果）
+_loaded_lexicons: Dict[str, "CompiledLexicon"] = {}
+
+
+class CompiledLexicon:
+    def __init__(self, data: Dict):
+        """
+        コンパイル済みの感情辞書
+
+        すべての語（感情語・強調語・否定表現）を1つのオートマトンにまとめ、
+        感情語ごとに感情の重みベクトルを持つ。
+
+        Args:
+            data (Dict): compile() または to_dict() が返す辞書
+        """
+        self.source_hash: str = data["source_hash"]
+        self.emotion_names: List[str] = data["emotion_names"]
+        self.terms: List[str] = data["terms"]
+        self.kinds: List[int] = data["kinds"]
+        # 感情語の重み（否定されていない場合 / 否定された場合）。列は emotion_names の順
+        self.weights: List[List[float]] = data["weights"]
+        self.negated_weights: List[List[float]] = data["negated_weights"]
+        # 強調語の倍率（感情語・否定表現は 1.0）
+        self.multipliers: List[float] = data["multipliers"]
+        self.intensifier_window: int = data["intensifier_window"]
+        self.negation_window: int = data["negation_window"]
+        self.automaton = KeywordAutomaton.from_dict(data["automaton"])
+        self._lengths = [len(term) for term in self.terms]
+
+    @classmethod
+    def compile(cls, source: Dict, emotion_names: Sequence[str], source_hash: str = "") -> "CompiledLexicon":
+        """
+        辞書ファイルの内容をコンパイルする
+
+        Args:
+            source (Dict): 辞書ファイルの内容
+            emotion_names (Sequence[str]): 感情名（スコアの列の順番）
+            source_hash (str): 辞書ファイルのハッシュ
+
+        Returns:
+            CompiledLexicon: コンパイル結果
+        """
+        columns = {name: index for index, name in enumerate(emotion_names)}
+        negation = source.get("negation", {})
+        negation_weight = float(negation.get("weight", 0.0))
+        negation_targets = negation.get("targets", {})
+        intensifiers = source.get("intensifiers", {})
+
+        terms: List[str] = []
+        kinds: List[int] = []
+        weights: List[List[float]] = []
+        multipliers: List[float] = []
+        term_ids: Dict[Tuple[int, str], int] = {}
+
+        def add_term(term: str, kind: int) -> int:
+            term_id = term_ids.get((kind, term))
+            if term_id is None:
+                term_id = term_ids[(kind, term)] = len(terms)
+                terms.append(term)
+                kinds.append(kind)
+                weights.append([0.0] * len(columns))
+                multipliers.append(1.0)
+            return term_id
+
+        # 複数の感情に属する語（ドキドキなど）は1つの語として重みベクトルを合算する
+        for emotion_name, entries in source.get("emotions", {}).items():
+            if emotion_name not in columns:
+                print(f"感情辞書: 未知の感情 '{emotion_name}' を無視します")
+                continue
+            for term, weight in entries.items():
+                if term:
+                    weights[add_term(term, TERM_EMOTION)][columns[emotion_name]] += float(weight)
+
+        for term, factor in intensifiers.get("terms", {}).items():
+            if term:
+                multipliers[add_term(term, TERM_INTENSIFIER)] = float(factor)
+
+        for term in negation.get("suffixes", []):
+            if term:
+                add_term(term, TERM_NEGATION)
+
+        # 否定された感情語は、元の感情に negation.weight を掛け、targets の感情へ振り替える
+        negated_weights: List[List[float]] = []
+        for vector in weights:
+            negated = [value * negation_weight for value in vector]
+            for emotion_name, column in columns.items():
+                if not vector[column]:
+                    continue
+                for target_name, ratio in negation_targets.get(emotion_name, {}).items():
+                    if target_name in columns:
+                        negated[columns[target_name]] += vector[column] * float(ratio)
+            negated_weights.append(negated)
+
+        return cls({
+            "format_version": COMPILED_FORMAT_VERSION,
+            "source_hash": source_hash,
+            "emotion_names": list(emotion_names),
+            "terms": terms,
+            "kinds": kinds,
+            "weights": weights,
+            "negated_weights": negated_weights,
+            "multipliers": multipliers,
+            "intensifier_window": int(intensifiers.get("window", 2)),
+            "negation_window": int(negation.get("window", 2)),
+            "automaton": KeywordAutomaton(tuple(terms)).to_dict(),
+        })
+
+    def to_dict(self) -> Dict:
+        """コンパイル結果を JSON に保存できる形で返す"""
+        return {
+            "format_version": COMPILED_FORMAT_VERSION,
+            "source_hash": self.source_hash,
+            "emotion_names": self.emotion_names,
+            "terms": self.terms,
+            "kinds": self.kinds,
+            "weights": self.weights,
+            "negated_weights": self.negated_weights,
+            "multipliers": self.multipliers,
+            "intensifier_window": self.intensifier_window,
+            "negation_window": self.negation_window,
+            "automaton": self.automaton.to_dict(),
+        }
+
+    def get_emotion_terms(self) -> Dict[str, List[str]]:
+        """
+        感情ごとの語の一覧を取得
+
+        Returns:
+            Dict[str, List[str]]: 感情名 -> その感情に重みを持つ語
+        """
+        result: Dict[str, List[str]] = {name: [] for name in self.emotion_names}
+        for term, kind, vector in zip(self.terms, self.kinds, self.weights):
+            if kind != TERM_EMOTION:
+                continue
+            for name, value in zip(self.emotion_names, vector):
+                if value:
+                    result[name].append(term)
+        return result
+
+    def find_hits(self, text: str) -> List[Tuple[int, float, bool]]:
+        """
+        テキスト中の感情語を、強調・否定を反映して列挙する
+
+        長い感情語に含まれる短い感情語（「楽しみ」の中の「楽し」など）は数えない。
+        同じ語が何度出てきても1回として扱い、倍率は最も大きいものを採用する。
+
+        Args:
+            text (str): 分析するテキスト
+
+        Returns:
+            List[Tuple[int, float, bool]]: (語ID, 強調の倍率, 否定されているか)
+        """
+        emotion_hits: List[Tuple[int, int, int]] = []
+        intensifier_ends: List[Tuple[int, float]] = []
+        negation_starts: List[int] = []
+        kinds = self.kinds
+        lengths = self._lengths
+        matches, _ = self.automaton.find_matches(text)
+        for end, term_id in matches:
+            kind = kinds[term_id]
+            start = end - lengths[term_id]
+            if kind == TERM_EMOTION:
+                emotion_hits.append((start, end, term_id))
+            elif kind == TERM_INTENSIFIER:
+                intensifier_ends.append((end, self.multipliers[term_id]))
+            else:
+                negation_starts.append(start)
+        if not emotion_hits:
+            return []
+        negation_starts.sort()
+
+        best: Dict[Tuple[int, bool], float] = {}
+        emotion_hits.sort(key=lambda hit: (hit[0], -hit[1]))
+        covered_until = -1
+        for start, end, term_id in emotion_hits:
+            if end <= covered_until:
+                continue
+            covered_until = end
+
+            multiplier = 1.0
+            for intensifier_end, factor in reversed(intensifier_ends):
+                if intensifier_end > start:
+                    continue
+                if start - intensifier_end <= self.intensifier_window:
+                    multiplier = factor
+                break
+
+            index = bisect.bisect_left(negation_starts, end)
+            negated = index < len(negation_starts) and negation_starts[index] - end <= self.negation_window
+
+            key = (term_id, negated)
+            if multiplier > best.get(key, 0.0):
+                best[key] = multiplier
+        return [(term_id, multiplier, negated) for (term_id, negated), multiplier in best.items()]
+
+    def score(self, text: str) -> List[float]:
+        """
+        テキストの感情スコアを計算
+
+        Args:
+            text (str): 分析するテキスト
+
+        Returns:
+            List[float]: 感情ごとのスコア（emotion_names の順）
+        """
+        scores = [0.0] * len(self.emotion_names)
+        for term_id, multiplier, negated in self.find_hits(text):
+            vector = self.negated_weights[term_id] if negated else self.weights[term_id]
+            for column, value in enumerate(vector):
+                if value:
+                    scores[column] += value * multiplier
+        return scores
+
+
+class LexiconStream:
+    def __init__(self, lexicon: CompiledLexicon):
+        """
+        分割して届くテキストを逐次分析するためのスコア集計器
+
+        オートマトンの状態をチャンク間で引き継ぐため、境界をまたいだ語も検出できる。
+        感情語の確定は、後に続く否定表現や、それを含むより長い語が届かないと
+        判断できるまで保留する。全体を feed してから finish した結果は
+        CompiledLexicon.score(全文) と一致する。
+
+        Args:
+            lexicon (CompiledLexicon): コンパイル済みの辞書
+        """
+        self.lexicon = lexicon
+        emotion_lengths = [length for length, kind in zip(lexicon._lengths, lexicon.kinds) if kind == TERM_EMOTION]
+        negation_lengths = [length for length, kind in zip(lexicon._lengths, lexicon.kinds) if kind == TERM_NEGATION]
+        self._max_emotion_length = max(emotion_lengths, default=1)
+        # 感情語の終了位置から、この文字数だけ先まで読めば否定・包含の判定が確定する
+        self._horizon = max(
+            self._max_emotion_length,
+            lexicon.negation_window + max(negation_lengths, default=0)
+        )
+        self.reset()
+
+    def reset(self):
+        """状態を初期化する（新しいテキストの分析を始める）"""
+        self._state = 0
+        self.position = 0
+        # (開始位置, 終了位置, 語ID, 強調の倍率)
+        self._hits: List[Tuple[int, int, int, float]] = []
+        self._pending: List[Tuple[int, int, int, float]] = []
+        self._intensifiers: List[Tuple[int, float]] = []
+        self._negation_starts: List[int] = []
+        self._best: Dict[Tuple[int, bool], float] = {}
+        self.scores: List[float] = [0.0] * len(self.lexicon.emotion_names)
+
+    def feed(self, chunk: str) -> List[float]:
+        """
+        テキストの続きを追加する（処理量はチャンクの長さに比例）
+
+        Args:
+            chunk (str): 追加するテキスト
+
+        Returns:
+            List[float]: 保留中の語も含めた現時点のスコア
+        """
+        lexicon = self.lexicon
+        matches, self._state = lexicon.automaton.find_matches(chunk, self._state, self.position)
+        self.position += len(chunk)
+        for end, term_id in matches:
+            kind = lexicon.kinds[term_id]
+            start = end - lexicon._lengths[term_id]
+            if kind == TERM_EMOTION:
+                hit = (start, end, term_id, self._intensifier_for(start))
+                self._hits.append(hit)
+                self._pending.append(hit)
+            elif kind == TERM_INTENSIFIER:
+                self._intensifiers.append((end, lexicon.multipliers[term_id]))
+            else:
+                bisect.insort(self._negation_starts, start)
+
+        self._finalize(self.position - self._horizon)
+        self._trim()
+        return self.current_scores()
+
+    def finish(self) -> List[float]:
+        """
+        テキストの終わりとして保留中の語をすべて確定させる
+
+        Returns:
+            List[float]: 最終的なスコア
+        """
+        self._finalize(self.position)
+        return list(self.scores)
+
+    def current_scores(self) -> List[float]:
+        """
+        保留中の語を「これ以上テキストが続かない」とみなして加えた暫定スコアを返す
+
+        Returns:
+            List[float]: 感情ごとのスコア（emotion_names の順）
+        """
+        scores = list(self.scores)
+        best = dict(self._best)
+        for hit in self._pending:
+            self._apply(hit, best, scores)
+        return scores
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _intensifier_for(self, start: int) -> float:
+        for intensifier_end, factor in reversed(self._intensifiers):
+            if intensifier_end > start:
+                continue
+            if start - intensifier_end <= self.lexicon.intensifier_window:
+                return factor
+            break
+        return 1.0
+
+    def _finalize(self, until: int):
+        """終了位置が until 以下の保留中の語を確定させる"""
+        remaining = []
+        for hit in self._pending:
+            if hit[1] <= until:
+                self._apply(hit, self._best, self.scores)
+            else:
+                remaining.append(hit)
+        self._pending = remaining
+
+    def _apply(self, hit: Tuple[int, int, int, float], best: Dict[Tuple[int, bool], float], scores: List[float]):
+        start, end, term_id, multiplier = hit
+        # より長い感情語に含まれていれば数えない
+        for other_start, other_end, _, _ in self._hits:
+            if other_start <= start and other_end >= end and (other_start, other_end) != (start, end):
+                return
+        index = bisect.bisect_left(self._negation_starts, end)
+        negated = index < len(self._negation_starts) and self._negation_starts[index] - end <= self.lexicon.negation_window
+
+        key = (term_id, negated)
+        previous = best.get(key, 0.0)
+        if multiplier <= previous:
+            return
+        best[key] = multiplier
+        vector = self.lexicon.negated_weights[term_id] if negated else self.lexicon.weights[term_id]
+        for column, value in enumerate(vector):
+            if value:
+                scores[column] += value * (multiplier - previous)
+
+    def _trim(self):
+        """今後の判定に使わない古い出現を捨てる"""
+        oldest_pending = min((hit[1] for hit in self._pending), default=self.position)
+        keep_from = min(oldest_pending, self.position - self._horizon)
+        self._hits = [hit for hit in self._hits if hit[1] >= keep_from]
+        self._negation_starts = self._negation_starts[bisect.bisect_left(self._negation_starts, keep_from):]
+        lookback = self.position - self._max_emotion_length - self.lexicon.intensifier_window - 1
+        self._intensifiers = [item for item in self._intensifiers if item[0] >= lookback]
+
+
+def load_lexicon(path: str, emotion_names: Sequence[str], cache_dir: Optional[str] = DEFAULT_CACHE_DIR) -> CompiledLexicon:
+    """
+    感情辞書を読み込む
+
+    コンパイル結果は辞書ファイルのハッシュをキーに cache_dir へ保存し、
+    次回の起動時は保存済みの結果をそのまま使う。
+
+    Args:
+        path (str): 辞書ファイル（JSON）のパス
+        emotion_names (Sequence[str]): 感情名（スコアの列の順番）
+        cache_dir (str): コンパイル結果の保存先（None なら保存しない）
+
+    Returns:
+        CompiledLexicon: コンパイル済みの辞書
+    """
+    try:
+        with open(path, "rb") as fp:
+            raw = fp.read()
+    except Exception as e:
+        print(f"感情辞書の読み込みエラー: {e}")
+        raw = b"{}"
+
+    hasher = hashlib.sha1(raw)
+    hasher.update(f"\n{COMPILED_FORMAT_VERSION}\n{','.join(emotion_names)}".encode("utf-8"))
+    source_hash = hasher.hexdigest()
+    lexicon = _loaded_lexicons.get(source_hash)
+    if lexicon is not None:
+        return lexicon
+
+    cache_path = os.path.join(cache_dir, f"emotion_lexicon_{source_hash[:16]}.json") if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("source_hash") == source_hash and data.get("format_version") == COMPILED_FORMAT_VERSION:
+                lexicon = CompiledLexicon(data)
+        except Exception as e:
+            print(f"感情辞書キャッシュの読み込みエラー: {e}")
+
+    if lexicon is None:
+        try:
+            source = json.loads(raw.decode("utf-8"))
+        except Exception as e:
+            print(f"感情辞書の解析エラー: {e}")
+            source = {}
+        lexicon = CompiledLexicon.compile(source, emotion_names, source_hash)
+        if cache_path:
+            _save_compiled(lexicon, cache_path)
+
+    _loaded_lexicons[source_hash] = lexicon
+    return lexicon
+
+
+def _save_compiled(lexicon: CompiledLexicon, cache_path: str):
+    """コンパイル結果を保存し、古い辞書のキャッシュを削除する"""
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(lexicon.to_dict(), fp, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, cache_path)
+        for old_path in glob.glob(os.path.join(os.path.dirname(cache_path), "emotion_lexicon_*.json")):
+            if old_path != cache_path:
+                os.remove(old_path)
+    except Exception as e:
+        print(f"感情辞書キャッシュの保存エラー: {e}")
@@ -4,7 +4,9 @@ except ImportError:
     print("Warning: google-generativeai not available. Please install it.")
     genai = None
 
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
+
+from tag_extractor import LocalTagExtractor
 
 class GeminiChatbot:
     def __init__(self, api_key: str):
@@ -28,6 +30,11 @@ class GeminiChatbot:
         self.chat_session: Optional[genai.ChatSession] = None
         # UIと同期するための会話履歴（テキストのみ）
         self.conversation_history: List[Dict] = []
+        # 画像プロンプト要約の高速パス（辞書で十分にタグが取れれば LLM を呼ばない）
+        self.tag_extractor = LocalTagExtractor()
+        self.local_tags_enabled = True
+        self.local_tags_min_coverage = 0.5
+        self.image_summary_stats: Dict[str, int] = {"local": 0, "llm": 0}
         
     def set_character(self, character_data: Dict):
         """
@@ -50,6 +57,17 @@ class GeminiChatbot:
             self.user_persona = persona
             self.clear_conversation()
 
+    def set_tag_extraction(self, enabled: bool, min_coverage: float):
+        """
+        画像プロンプト要約でローカル辞書を優先するかを設定する。
+        
+        Args:
+            enabled (bool): ローカル辞書による抽出を使うか
+            min_coverage (float): LLM を呼ばずに済ませる最小カバー率（0.0〜1.0）
+        """
+        self.local_tags_enabled = enabled
+        self.local_tags_min_coverage = min_coverage
+
     def _initialize_chat(self):
         """
         キャラクターとユーザーペルソナに基づいてチャットセッションを初期化する。
@@ -100,6 +118,59 @@ class GeminiChatbot:
             self.conversation_history.append({"role": "assistant", "content": error_message})
             return error_message
     
+    def chat_stream(self, user_message: str) -> Iterator[str]:
+        """
+        ユーザーメッセージに対する応答を、届いた順にチャンクで返す
+        
+        最後まで読み切った時点で会話履歴に応答が追加される。
+        途中で閉じられた場合（Streamlit の再実行・停止など）は、それまでに届いた分を応答として追加する。
+        
+        Args:
+            user_message (str): ユーザーメッセージ
+            
+        Yields:
+            str: 応答テキストの断片
+        """
+        response = None
+        ai_response = ""
+        completed = False
+        try:
+            if self.chat_session is None:
+                self._initialize_chat()
+            
+            self.conversation_history.append({"role": "user", "content": user_message})
+
+            request_options = {"timeout": 30}
+            response = self.chat_session.send_message(user_message, stream=True, request_options=request_options) # type: ignore
+            for chunk in response:
+                text = chunk.text
+                if text:
+                    ai_response += text
+                    yield text
+            
+            self.conversation_history.append({"role": "assistant", "content": ai_response})
+            completed = True
+            
+        except Exception as e:
+            error_message = f"エラーが発生しました: {str(e)}"
+            if ai_response:
+                # 途中まで届いた応答は表示済みなので捨てず、その後ろにエラーを付け足す
+                error_message = "\n\n" + error_message
+            # エラー時も履歴に追加してUIで確認できるようにする
+            self.conversation_history.append({"role": "assistant", "content": ai_response + error_message})
+            completed = True
+            yield error_message
+        
+        finally:
+            if not completed and response is not None:
+                # 読みかけのストリームが残るとチャットセッションが次のメッセージを送れないため、最後まで読み切る
+                try:
+                    response.resolve()
+                except Exception as e:
+                    print(f"応答ストリームの終了処理エラー: {e}")
+                # ユーザーメッセージだけが履歴に残らないよう、表示済みの部分を応答として残す
+                self.conversation_history.append({"role": "assistant", "content": ai_response})
+    
     def get_conversation_starter(self) -> str:
         """
         キャラクターの会話開始メッセージを取得
@@ -195,6 +266,12 @@ class GeminiChatbot:
 
     def summarize_for_image(self, text: str) -> str:
         """与えられたテキストを画像生成用の短いプロンプトに要約する"""
+        # まず辞書引きでタグを抽出し、髪・服装・場所・雰囲気などが十分に揃えば LLM を省略
+        local_tags, coverage = self.tag_extractor.extract(text)
+        if self.local_tags_enabled and local_tags and coverage >= self.local_tags_min_coverage:
+            self.image_summary_stats["local"] += 1
+            return ", ".join(local_tags)
+
         text_to_summarize = text[:200]
         
         prompt = f"""以下の文章を、情景を英語のキーワードで描写する画像生成プロンプトに要約してください。
@@ -205,10 +282,14 @@ class GeminiChatbot:
 プロンプト(英語):
 """
         try:
+            self.image_summary_stats["llm"] += 1
             summarizer_model = genai.GenerativeModel('gemini-1.5-flash')
             request_options = {"timeout": 30}
             response = summarizer_model.generate_content(prompt, request_options=request_options) # type: ignore
             return response.text.strip()
         except Exception as e:
             print(f"Error during image summary: {e}")
+            # 辞書で拾えたタグがあれば、文章の断片よりそちらを優先する
+            if local_tags:
+                return ", ".join(local_tags)
             return " ".join(text.split()[:15])
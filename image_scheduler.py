@@ -0,0 +1,277 @@
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Set
+
+# 優先度（値が小さいほど先に処理する）
+PRIORITY_MANUAL = 0      # 「キャラクター画像生成」「再生成」などユーザー操作
+PRIORITY_AUTO = 1        # 応答後の自動生成
+PRIORITY_BACKGROUND = 2  # スプライトの事前生成など、他に待ちが無いときだけ実行する
+
+
+class ImageJob:
+    """スケジューラに投入された1件の画像生成ジョブ"""
+
+    def __init__(self, job_key: str, func: Callable, priority: int, turn: int, seq: int,
+                 checkpoint: Optional[str] = None):
+        """
+        Args:
+            job_key (str): ジョブの対象（同じキーの新しいジョブが古いジョブを置き換える）
+            func (Callable): 実行する生成処理（引数なし）
+            priority (int): 優先度
+            turn (int): 対象メッセージのターン番号（新しいほど大きい）
+            seq (int): 投入順の通し番号
+            checkpoint (str): 必要なチェックポイント（Noneなら何でもよい）
+        """
+        self.job_key = job_key
+        self.func = func
+        self.priority = priority
+        self.turn = turn
+        self.seq = seq
+        self.checkpoint = checkpoint or None
+        self.future: Future = Future()
+        self.submitted_at = time.time()
+        # 実行中に不要になった（置き換えられた）場合True
+        self.obsolete = False
+        # 実行中のワーカースレッドID（中断要求の宛先を特定する）
+        self.thread_id: Optional[int] = None
+
+    def sort_key(self):
+        # 手動 > 自動、同じ優先度なら新しいターン > 古いターン、最後に投入順
+        return (self.priority, -self.turn, self.seq)
+
+    def __lt__(self, other: "ImageJob") -> bool:
+        return self.sort_key() < other.sort_key()
+
+
+class ImageJobScheduler:
+    def __init__(self, sd_api, num_workers: Optional[int] = None, max_affinity_wait: float = 20.0):
+        """
+        画像生成ジョブの優先度付きスケジューラの初期化
+
+        Args:
+            sd_api (StableDiffusionAPI): 中断要求に使うAPI
+            num_workers (int): 同時に実行するジョブ数（省略時はバックエンド数）
+            max_affinity_wait (float): 読み込み済みモデルのジョブを優先する間、他のジョブを待たせる最大秒数
+        """
+        if num_workers is None:
+            num_workers = getattr(sd_api, "backend_count", 1)
+        self.sd_api = sd_api
+        self.max_affinity_wait = max_affinity_wait
+        self._queued: Dict[str, ImageJob] = {}
+        # 実行中のジョブ（ワーカースレッドID -> ジョブ）。ワーカーが複数あると同じキーのジョブが同時に実行されうる
+        self._running: Dict[int, ImageJob] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats: Dict[str, int] = {
+            "submitted": 0,
+            "completed": 0,
+            "superseded": 0,
+            "stale_dropped": 0,
+            "interrupted": 0,
+            "failed": 0,
+        }
+        self._workers = []
+        for index in range(max(1, num_workers)):
+            worker = threading.Thread(target=self._worker_loop, name=f"image-worker-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, job_key: str, func: Callable, priority: int = PRIORITY_AUTO, turn: int = 0,
+               checkpoint: Optional[str] = None) -> Future:
+        """
+        ジョブを投入
+
+        同じキーの待機中ジョブは置き換え、実行中ジョブは中断する。
+        自動生成ジョブの場合、より古いターンの自動生成ジョブも不要として破棄する。
+
+        Args:
+            job_key (str): ジョブの対象（例: "msg-12"）
+            func (Callable): 生成処理（PIL.Image などを返す）
+            priority (int): PRIORITY_MANUAL / PRIORITY_AUTO
+            turn (int): 対象メッセージのターン番号
+            checkpoint (str): ジョブが必要とするチェックポイント（同じモデルのジョブをまとめて処理する）
+
+        Returns:
+            Future: 生成結果。置き換えられた場合はキャンセル、中断された場合はNone
+        """
+        job = ImageJob(job_key, func, priority, turn, next(self._seq), checkpoint)
+        obsolete_jobs = []
+        with self._cond:
+            self.stats["submitted"] += 1
+
+            # 同じメッセージに対する古いジョブを置き換える
+            old_job = self._queued.pop(job_key, None)
+            if old_job is not None:
+                old_job.future.cancel()
+                self.stats["superseded"] += 1
+            for running in self._running.values():
+                if running.job_key == job_key and not running.obsolete:
+                    running.obsolete = True
+                    obsolete_jobs.append(running)
+
+            if priority == PRIORITY_AUTO:
+                # ユーザーが次のターンへ進んだので、古いターンの自動生成は見られない
+                for key, queued in list(self._queued.items()):
+                    if queued.priority == PRIORITY_AUTO and queued.turn < turn:
+                        del self._queued[key]
+                        queued.future.cancel()
+                        self.stats["stale_dropped"] += 1
+                for running_job in self._running.values():
+                    if running_job.priority == PRIORITY_AUTO and running_job.turn < turn and not running_job.obsolete:
+                        running_job.obsolete = True
+                        obsolete_jobs.append(running_job)
+
+            self._queued[job_key] = job
+            self._cond.notify()
+
+        if obsolete_jobs:
+            self._interrupt(obsolete_jobs)
+        return job.future
+
+    def cancel(self, job_key: str) -> bool:
+        """
+        指定キーのジョブを取り消す（実行中なら中断する）
+
+        Args:
+            job_key (str): ジョブの対象
+
+        Returns:
+            bool: 取り消すジョブがあった場合True
+        """
+        with self._cond:
+            queued = self._queued.pop(job_key, None)
+            if queued is not None:
+                queued.future.cancel()
+                self.stats["superseded"] += 1
+                return True
+            running_jobs = [job for job in self._running.values() if job.job_key == job_key and not job.obsolete]
+            if not running_jobs:
+                return False
+            for running in running_jobs:
+                running.obsolete = True
+        self._interrupt(running_jobs)
+        return True
+
+    def is_current_job_obsolete(self) -> bool:
+        """
+        呼び出したワーカースレッドで実行中のジョブが、置き換え・取り消しで不要になったか
+
+        ジョブの生成処理から呼び、複数段の生成で次の段へ進むかの判断に使う。
+
+        Returns:
+            bool: 不要になっていればTrue（ワーカースレッド以外から呼んだ場合はFalse）
+        """
+        thread_id = threading.get_ident()
+        with self._cond:
+            job = self._running.get(thread_id)
+            return job is not None and job.obsolete
+
+    def get_queue_position(self, future: Future) -> int:
+        """
+        ジョブの待ち順位を取得
+
+        Returns:
+            int: 0なら実行中（または完了）、1以上なら待ち順位
+        """
+        with self._cond:
+            ordered = sorted(self._queued.values())
+            for index, job in enumerate(ordered):
+                if job.future is future:
+                    return index + 1
+        return 0
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        スケジューラの統計を取得
+
+        Returns:
+            Dict[str, int]: 統計情報（待機数・実行数を含む）
+        """
+        with self._cond:
+            stats = dict(self.stats)
+            stats["queued"] = len(self._queued)
+            stats["running"] = len(self._running)
+        # モデルの切り替えは各バックエンドで実際に起きた回数を数える
+        pool = getattr(self.sd_api, "pool", None)
+        stats["checkpoint_swaps"] = sum(backend.checkpoint_swaps for backend in pool.backends) if pool else 0
+        return stats
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _interrupt(self, jobs: List[ImageJob]):
+        with self._cond:
+            # 既に終わったジョブは、次のジョブを巻き込まないよう中断しない
+            targets = [job for job in jobs if self._running.get(job.thread_id) is job]
+        if self.sd_api is None:
+            return
+        for job in targets:
+            if self.sd_api.interrupt(job.thread_id):
+                with self._cond:
+                    self.stats["interrupted"] += 1
+
+    def _loaded_checkpoints(self) -> Set[str]:
+        # 利用可能なバックエンドに読み込まれているチェックポイント
+        pool = getattr(self.sd_api, "pool", None)
+        if pool is None:
+            return set()
+        return {backend.current_checkpoint for backend in pool.backends
+                if backend.current_checkpoint and not backend.is_drained}
+
+    def _select_job(self) -> ImageJob:
+        """
+        次に実行するジョブを選ぶ（ロック取得済みで呼ぶこと）
+
+        最も優先度の高いジョブと同じ優先度のジョブだけを候補にする（モデルの都合で手動生成を待たせない）。
+        候補の中に待ち時間の上限を超えたジョブがあればそれを最優先し、
+        無ければいずれかのバックエンドに読み込み済みのモデルで実行できるジョブを選ぶ。
+        """
+        ordered = sorted(self._queued.values())
+        candidates = [job for job in ordered if job.priority == ordered[0].priority]
+        now = time.time()
+        overdue = [job for job in candidates if now - job.submitted_at > self.max_affinity_wait]
+        if overdue:
+            return overdue[0]
+        loaded = self._loaded_checkpoints()
+        for job in candidates:
+            if job.checkpoint is None or job.checkpoint in loaded:
+                return job
+        return candidates[0]
+
+    def _next_job(self) -> ImageJob:
+        with self._cond:
+            while True:
+                while self._queued:
+                    job = self._select_job()
+                    del self._queued[job.job_key]
+                    if not job.future.set_running_or_notify_cancel():
+                        continue
+                    job.thread_id = threading.get_ident()
+                    self._running[job.thread_id] = job
+                    return job
+                self._cond.wait()
+
+    def _worker_loop(self):
+        while True:
+            job = self._next_job()
+            try:
+                result = job.func()
+            except Exception as e:
+                print(f"画像生成ジョブエラー ({job.job_key}): {e}")
+                with self._cond:
+                    self.stats["failed"] += 1
+                    self._release(job)
+                job.future.set_exception(e)
+                continue
+
+            with self._cond:
+                self.stats["completed"] += 1
+                self._release(job)
+            # 中断されたジョブの途中結果は誰にも見られないので捨てる
+            job.future.set_result(None if job.obsolete else result)
+
+    def _release(self, job: ImageJob):
+        if self._running.get(job.thread_id) is job:
+            del self._running[job.thread_id]
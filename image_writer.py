@@ -0,0 +1,165 @@
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+# ConfigManager の "images" セクションが欠けている場合の既定値
+DEFAULT_WRITER_SETTINGS = {
+    "save_format": "png",          # "png" または "webp"
+    "png_compress_level": 6,       # 0（無圧縮・高速）〜 9（最小・低速）
+    "webp_lossless": True,
+    "webp_quality": 80,            # lossless の場合は圧縮の手間（大きいほど小さく・遅い）
+    "save_queue_size": 16,
+    "save_sharded": True,          # images/ab/ のようにサブディレクトリへ分散する
+}
+
+FORMAT_EXTENSIONS = {"png": "png", "webp": "webp"}
+
+# キューが満杯のとき、空きを待つ最大秒数（これを超えたら保存を諦める）
+SAVE_QUEUE_TIMEOUT = 0.5
+
+
+class SaveHandle:
+    """非同期保存の結果を受け取るためのハンドル"""
+
+    def __init__(self, path: str, image_id: str):
+        self.path = path
+        self.image_id = image_id
+        self.future: Future = Future()
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        保存完了を待つ
+
+        Args:
+            timeout (float): 待機する最大秒数
+
+        Returns:
+            Optional[str]: 保存されたファイルパス（失敗時はNone）
+        """
+        try:
+            return self.future.result(timeout)
+        except Exception as e:
+            print(f"画像保存エラー: {e}")
+            return None
+
+
+class ImageWriter:
+    def __init__(self, base_dir: str = "images", settings: Optional[Dict] = None):
+        """
+        画像をバックグラウンドでディスクへ書き出すクラスの初期化
+
+        Args:
+            base_dir (str): 保存先ディレクトリ
+            settings (Dict): ConfigManager の "images" セクション
+        """
+        self.base_dir = base_dir
+        self.settings = dict(DEFAULT_WRITER_SETTINGS)
+        self.update_settings(settings or {})
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(self.settings["save_queue_size"])))
+        self.stats: Dict[str, float] = {"queued": 0, "written": 0, "dropped": 0, "failed": 0, "bytes": 0}
+        self._worker = threading.Thread(target=self._worker_loop, name="image-writer", daemon=True)
+        self._worker.start()
+
+    def update_settings(self, settings: Dict):
+        """
+        保存形式などの設定を更新
+
+        Args:
+            settings (Dict): ConfigManager の "images" セクション
+        """
+        for key in DEFAULT_WRITER_SETTINGS:
+            if key in settings and settings[key] not in (None, ""):
+                self.settings[key] = settings[key]
+
+    def submit(self, image, character_name: str, timestamp: str) -> SaveHandle:
+        """
+        画像の保存を予約し、すぐにハンドルを返す
+
+        キューが満杯の場合は少しだけ空きを待ち、それでも空かなければ保存を諦める
+        （エンコードで呼び出し元を止めず、メモリも増やさない）。諦めた場合はハンドルが失敗になる。
+
+        Args:
+            image (PIL.Image): 保存する画像
+            character_name (str): キャラクター名
+            timestamp (str): タイムスタンプ
+
+        Returns:
+            SaveHandle: 保存先パスと完了待ち用の Future を持つハンドル
+        """
+        # 遅延読み込みの画像を表示側と同時にデコードしないよう、ここで読み込んでおく
+        image.load()
+        settings = dict(self.settings)
+        handle = self._make_handle(character_name, timestamp, settings)
+        try:
+            self._queue.put((image, handle, settings), timeout=SAVE_QUEUE_TIMEOUT)
+            self.stats["queued"] += 1
+        except queue.Full:
+            self.stats["dropped"] += 1
+            message = f"画像保存キューが満杯のため保存を見送りました: {handle.path}"
+            print(message)
+            handle.future.set_exception(RuntimeError(message))
+        return handle
+
+    def flush(self, timeout: Optional[float] = None):
+        """
+        キューに溜まった保存がすべて終わるまで待つ
+
+        Args:
+            timeout (float): 待機する最大秒数（省略時は無制限）
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.time() > deadline:
+                break
+            time.sleep(0.01)
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _make_handle(self, character_name: str, timestamp: str, settings: Dict) -> SaveHandle:
+        safe_name = re.sub(r'[\\/:*?"<>|]', "_", character_name)
+        # 同じ秒に複数保存しても衝突しないよう乱数IDを付与する
+        unique = uuid.uuid4().hex
+        image_id = f"{safe_name}_{timestamp}_{unique[:8]}"
+        extension = FORMAT_EXTENSIONS.get(str(settings["save_format"]).lower(), "png")
+        directory = self.base_dir
+        if settings["save_sharded"]:
+            directory = os.path.join(directory, unique[:2])
+        return SaveHandle(os.path.join(directory, f"{image_id}.{extension}"), image_id)
+
+    def _worker_loop(self):
+        while True:
+            image, handle, settings = self._queue.get()
+            try:
+                self._write(image, handle, settings)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image, handle: SaveHandle, settings: Dict):
+        try:
+            os.makedirs(os.path.dirname(handle.path), exist_ok=True)
+            tmp_path = f"{handle.path}.tmp"
+            if handle.path.endswith(".webp"):
+                image.save(
+                    tmp_path,
+                    format="WEBP",
+                    lossless=bool(settings["webp_lossless"]),
+                    quality=int(settings["webp_quality"]),
+                )
+            else:
+                image.save(tmp_path, format="PNG", compress_level=int(settings["png_compress_level"]))
+            os.replace(tmp_path, handle.path)
+            self.stats["written"] += 1
+            self.stats["bytes"] += os.path.getsize(handle.path)
+            handle.future.set_result(handle.path)
+        except Exception as e:
+            self.stats["failed"] += 1
+            handle.future.set_exception(e)
@@ -0,0 +1,136 @@
+from collections import deque
+from typing import Dict, List, Set, Tuple
+
+
+class KeywordAutomaton:
+    def __init__(self, keywords: Tuple[str, ...]):
+        """
+        Aho–Corasick 法による複数キーワード検索オートマトンの構築
+
+        テキストを1回走査するだけで、重なり合うものも含めて
+        出現したすべてのキーワードを検出できる。
+
+        Args:
+            keywords (Tuple[str, ...]): 検索するキーワード（添字がキーワードIDになる）
+        """
+        self.keywords = keywords
+        # 状態ごとの遷移表・失敗遷移先・その状態で出現が確定するキーワードID
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]
+
+        for keyword_id, keyword in enumerate(keywords):
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = next_state
+            self._output[state] += (keyword_id,)
+
+        # 幅優先で失敗遷移を張り、失敗先の出力を引き継ぐ
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self._goto[state].items():
+                pending.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fallback = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fallback if fallback != next_state else 0
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+        # 失敗遷移をたどる処理を走査時に繰り返さないよう、根以外への遷移を状態ごとに展開しておく
+        # （根への遷移は全状態で共通なので、見つからなければ根の遷移表を引く）
+        self._delta: List[Dict[str, int]] = [{} for _ in self._goto]
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            self._delta[state] = {**self._delta[self._fail[state]], **self._goto[state]}
+            pending.extend(self._goto[state].values())
+
+    def to_dict(self) -> Dict:
+        """構築済みの遷移表を JSON に保存できる形で返す"""
+        return {
+            "keywords": list(self.keywords),
+            "goto": self._goto,
+            "fail": self._fail,
+            "output": [list(ids) for ids in self._output],
+            "delta": self._delta,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "KeywordAutomaton":
+        """to_dict で保存した遷移表から、構築処理を省いて復元する"""
+        automaton = cls.__new__(cls)
+        automaton.keywords = tuple(data["keywords"])
+        automaton._goto = data["goto"]
+        automaton._fail = data["fail"]
+        automaton._output = [tuple(ids) for ids in data["output"]]
+        automaton._delta = data["delta"]
+        return automaton
+
+    @property
+    def state_count(self) -> int:
+        return len(self._goto)
+
+    def find_all(self, text: str) -> Set[int]:
+        """
+        テキストに含まれるキーワードIDの集合を返す（同じキーワードは1回だけ）
+
+        Args:
+            text (str): 検索対象のテキスト
+
+        Returns:
+            Set[int]: 出現したキーワードのID
+        """
+        found: Set[int] = set()
+        root = self._goto[0]
+        delta = self._delta
+        output = self._output
+        state = 0
+        for char in text:
+            next_state = delta[state].get(char)
+            if next_state is None:
+                next_state = root.get(char, 0)
+            state = next_state
+            if output[state]:
+                found.update(output[state])
+        return found
+
+    def find_matches(self, text: str, state: int = 0, offset: int = 0) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        テキスト中のキーワードの出現をすべて列挙する（重なりを含む）
+
+        前回の戻り値の状態と位置を渡せば、分割して届くテキストの続きとして走査できる
+        （チャンクの境界をまたぐキーワードも検出される）。
+
+        Args:
+            text (str): 検索対象のテキスト
+            state (int): 走査を再開する状態（先頭から走査する場合は0）
+            offset (int): text の先頭文字の、全体の中での位置
+
+        Returns:
+            Tuple[List[Tuple[int, int]], int]: 終了位置順の (終了位置（その文字を含まない）, キーワードID) と、
+                走査後の状態
+        """
+        root = self._goto[0]
+        delta = self._delta
+        output = self._output
+        matches: List[Tuple[int, int]] = []
+        for index, char in enumerate(text, offset + 1):
+            next_state = delta[state].get(char)
+            if next_state is None:
+                next_state = root.get(char, 0)
+            state = next_state
+            if output[state]:
+                for keyword_id in output[state]:
+                    matches.append((index, keyword_id))
+        return matches, state
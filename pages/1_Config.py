@@ -33,12 +33,86 @@ with st.expander("🧠 モデル設定", expanded=True):
 with st.expander("🎨 Stable Diffusion 設定", expanded=False):
     positive_prompt = st.text_area("ポジティブプロンプト", value=cfg.data["sd"].get("positive_prompt", ""))
     negative_prompt = st.text_area("ネガティブプロンプト", value=cfg.data["sd"].get("negative_prompt", ""))
+    backends_text = st.text_area(
+        "WebUI の URL（1行に1つ、複数指定で負荷分散）",
+        value="\n".join(cfg.data["sd"].get("backends", [])),
+        placeholder="http://127.0.0.1:7860"
+    )
     steps = st.number_input("ステップ数", min_value=5, max_value=150, value=int(cfg.data["sd"].get("steps", 30)))
+    col_w, col_h, col_sampler = st.columns(3)
+    with col_w:
+        width = st.number_input("幅", min_value=256, max_value=2048, step=64, value=int(cfg.data["sd"].get("width", 512)))
+    with col_h:
+        height = st.number_input("高さ", min_value=256, max_value=2048, step=64, value=int(cfg.data["sd"].get("height", 512)))
+    with col_sampler:
+        sampler = st.text_input("サンプラー", value=cfg.data["sd"].get("sampler", "DPM++ 2M Karras"))
+    progressive = st.checkbox("プログレッシブ生成（プレビュー → 高画質化）", value=bool(cfg.data["sd"].get("progressive", False)))
+    col_pv_steps, col_pv_w, col_pv_h, col_pv_sampler = st.columns(4)
+    with col_pv_steps:
+        preview_steps = st.number_input("プレビューのステップ数", min_value=1, max_value=50, value=int(cfg.data["sd"].get("preview_steps", 8)))
+    with col_pv_w:
+        preview_width = st.number_input("プレビュー幅", min_value=128, max_value=1024, step=64, value=int(cfg.data["sd"].get("preview_width", 384)))
+    with col_pv_h:
+        preview_height = st.number_input("プレビュー高さ", min_value=128, max_value=1024, step=64, value=int(cfg.data["sd"].get("preview_height", 384)))
+    with col_pv_sampler:
+        preview_sampler = st.text_input("プレビューのサンプラー", value=cfg.data["sd"].get("preview_sampler", "Euler a"))
+    refine_modes = ["img2img", "hires"]
+    refine_mode = st.selectbox(
+        "高画質化の方式",
+        refine_modes,
+        index=refine_modes.index(cfg.data["sd"].get("refine_mode", "img2img")) if cfg.data["sd"].get("refine_mode") in refine_modes else 0
+    )
+    refine_denoising_strength = st.slider("高画質化のノイズ除去強度", 0.0, 1.0, value=float(cfg.data["sd"].get("refine_denoising_strength", 0.45)), step=0.05)
+    continuity = st.checkbox("継続モード（シーンが同じなら前の画像を img2img で引き継ぐ）", value=bool(cfg.data["sd"].get("continuity", False)))
+    col_ct_threshold, col_ct_strength = st.columns(2)
+    with col_ct_threshold:
+        continuity_threshold = st.slider("シーン類似度のしきい値", 0.0, 1.0, value=float(cfg.data["sd"].get("continuity_threshold", 0.5)), step=0.05)
+    with col_ct_strength:
+        continuity_denoising_strength = st.slider("継続時のノイズ除去強度", 0.0, 1.0, value=float(cfg.data["sd"].get("continuity_denoising_strength", 0.35)), step=0.05)
+    col_skip, col_skip_threshold = st.columns(2)
+    with col_skip:
+        scene_skip = st.checkbox("シーンが変わらなければ画像生成を省略", value=bool(cfg.data["sd"].get("scene_skip", True)))
+    with col_skip_threshold:
+        scene_skip_threshold = st.slider("省略する類似度のしきい値", 0.0, 1.0, value=float(cfg.data["sd"].get("scene_skip_threshold", 0.8)), step=0.05)
+    col_local, col_local_coverage = st.columns(2)
+    with col_local:
+        local_tags = st.checkbox("辞書でシーンタグを抽出（足りない時だけ LLM で要約）", value=bool(cfg.data["sd"].get("local_tags", True)))
+    with col_local_coverage:
+        local_tags_min_coverage = st.slider("辞書タグで済ませる最小カバー率", 0.0, 1.0, value=float(cfg.data["sd"].get("local_tags_min_coverage", 0.5)), step=0.25)
+    col_chunks, col_break = st.columns(2)
+    with col_chunks:
+        prompt_max_chunks = st.number_input("プロンプトの最大チャンク数（75トークン単位）", min_value=1, max_value=8, value=int(cfg.data["sd"].get("prompt_max_chunks", 2)))
+    with col_break:
+        prompt_use_break = st.checkbox("チャンク境界に BREAK を挿入", value=bool(cfg.data["sd"].get("prompt_use_break", True)))
+    sprite_atlas = st.checkbox("感情スプライトを事前生成", value=bool(cfg.data["sd"].get("sprite_atlas", True)))
+    scene_generation = st.checkbox("応答ごとにシーン画像を生成", value=bool(cfg.data["sd"].get("scene_generation", True)))
     if st.button("💾 SD 設定を保存"):
         cfg.data["sd"].update({
             "positive_prompt": positive_prompt,
             "negative_prompt": negative_prompt,
+            "backends": [line.strip() for line in backends_text.splitlines() if line.strip()],
             "steps": steps,
+            "width": width,
+            "height": height,
+            "sampler": sampler,
+            "progressive": progressive,
+            "preview_steps": preview_steps,
+            "preview_width": preview_width,
+            "preview_height": preview_height,
+            "preview_sampler": preview_sampler,
+            "refine_mode": refine_mode,
+            "refine_denoising_strength": refine_denoising_strength,
+            "continuity": continuity,
+            "continuity_threshold": continuity_threshold,
+            "continuity_denoising_strength": continuity_denoising_strength,
+            "scene_skip": scene_skip,
+            "scene_skip_threshold": scene_skip_threshold,
+            "local_tags": local_tags,
+            "local_tags_min_coverage": local_tags_min_coverage,
+            "prompt_max_chunks": prompt_max_chunks,
+            "prompt_use_break": prompt_use_break,
+            "sprite_atlas": sprite_atlas,
+            "scene_generation": scene_generation,
         })
         cfg.save()
         st.success("Stable Diffusion 設定を保存しました")
@@ -69,6 +143,113 @@ with st.expander("🖼️ 背景／アイコン画像", expanded=False):
     if cfg.data["images"].get("icon"):
         st.image(cfg.data["images"]["icon"], caption="現在のアイコン画像", width=100)
 
+# -------------------------------------------
+# 生成画像の保存形式
+# -------------------------------------------
+with st.expander("💾 生成画像の保存形式", expanded=False):
+    save_formats = ["png", "webp"]
+    save_format = st.selectbox(
+        "保存形式",
+        save_formats,
+        index=save_formats.index(cfg.data["images"].get("save_format", "png")) if cfg.data["images"].get("save_format") in save_formats else 0
+    )
+    png_compress_level = st.slider("PNG 圧縮レベル（大きいほど小さく・遅い）", 0, 9, value=int(cfg.data["images"].get("png_compress_level", 6)))
+    webp_lossless = st.checkbox("WebP をロスレスで保存", value=bool(cfg.data["images"].get("webp_lossless", True)))
+    webp_quality = st.slider("WebP 品質（ロスレス時は圧縮の手間）", 0, 100, value=int(cfg.data["images"].get("webp_quality", 80)))
+    save_sharded = st.checkbox("サブディレクトリに分散して保存", value=bool(cfg.data["images"].get("save_sharded", True)))
+    if st.button("💾 保存形式を保存"):
+        cfg.data["images"].update({
+            "save_format": save_format,
+            "png_compress_level": png_compress_level,
+            "webp_lossless": webp_lossless,
+            "webp_quality": webp_quality,
+            "save_sharded": save_sharded,
+        })
+        cfg.save()
+        st.success("保存形式を保存しました")
+
+with st.expander("😊 感情分析", expanded=False):
+    history_size = st.number_input("統計に使う直近のメッセージ数", min_value=1, max_value=1000, value=int(cfg.data["emotion"].get("history_size", 10)))
+    decay = st.slider("長期傾向の減衰率（0で無効）", 0.0, 0.99, value=float(cfg.data["emotion"].get("decay", 0.9)), step=0.01)
+    classifier = st.checkbox("学習済みの感情分類器を使う（train_emotion_classifier.py で作成）", value=bool(cfg.data["emotion"].get("classifier", False)))
+    classifier_model = st.text_input("分類器モデルのパス", value=cfg.data["emotion"].get("classifier_model", "models/emotion_classifier.npz"))
+    col_budget, col_confidence = st.columns(2)
+    with col_budget:
+        classifier_budget_ms = st.number_input("1メッセージあたりの時間予算（ミリ秒）", min_value=0.5, max_value=100.0, step=0.5, value=float(cfg.data["emotion"].get("classifier_budget_ms", 5.0)))
+    with col_confidence:
+        classifier_min_confidence = st.slider("分類器を採用する最小の確率", 0.0, 1.0, value=float(cfg.data["emotion"].get("classifier_min_confidence", 0.5)), step=0.05)
+    if st.button("💾 感情分析の設定を保存"):
+        cfg.data["emotion"].update({
+            "history_size": history_size,
+            "decay": decay,
+            "classifier": classifier,
+            "classifier_model": classifier_model,
+            "classifier_budget_ms": classifier_budget_ms,
+            "classifier_min_confidence": classifier_min_confidence,
+        })
+        cfg.save()
+        st.success("感情分析の設定を保存しました")
+
+with st.expander("🔊 音声読み上げ", expanded=False):
+    queue_policies = ["drop_oldest", "replace_pending", "interrupt"]
+    queue_policy_labels = {
+        "drop_oldest": "古い読み上げ待ちを捨てる",
+        "replace_pending": "読み上げ待ちを新しい応答で置き換える",
+        "interrupt": "再生中の音声も中断して新しい応答を読む",
+    }
+    queue_size = st.number_input("読み上げ待ちの上限", min_value=1, max_value=50, value=int(cfg.data["voice"].get("queue_size", 4)))
+    queue_policy = st.selectbox(
+        "新しい応答が届いたときの扱い",
+        queue_policies,
+        index=queue_policies.index(cfg.data["voice"].get("queue_policy", "drop_oldest")) if cfg.data["voice"].get("queue_policy") in queue_policies else 0,
+        format_func=lambda policy: queue_policy_labels[policy]
+    )
+    cache_max_mb = st.number_input("音声キャッシュの上限（MB。0で無効）", min_value=0, max_value=10000, value=int(cfg.data["voice"].get("cache_max_mb", 200)))
+    prerender_starters = st.checkbox("キャラクター選択時に会話開始メッセージを事前に合成する", value=bool(cfg.data["voice"].get("prerender_starters", False)))
+    outputs = ["speaker", "browser"]
+    output_labels = {"speaker": "サーバーのスピーカー", "browser": "ブラウザ（リモート利用向け）"}
+    output = st.selectbox(
+        "音声の出力先",
+        outputs,
+        index=outputs.index(cfg.data["voice"].get("output", "speaker")) if cfg.data["voice"].get("output") in outputs else 0,
+        format_func=lambda value: output_labels[value]
+    )
+    browser_engines = ["gtts", "pyttsx3"]
+    browser_formats = ["ogg", "mp3"]
+    col_engine, col_format, col_processes = st.columns(3)
+    with col_engine:
+        browser_engine = st.selectbox(
+            "ブラウザ再生の合成エンジン",
+            browser_engines,
+            index=browser_engines.index(cfg.data["voice"].get("browser_engine", "gtts")) if cfg.data["voice"].get("browser_engine") in browser_engines else 0
+        )
+    with col_format:
+        browser_format = st.selectbox(
+            "圧縮形式（ffmpeg が必要）",
+            browser_formats,
+            index=browser_formats.index(cfg.data["voice"].get("browser_format", "ogg")) if cfg.data["voice"].get("browser_format") in browser_formats else 0
+        )
+    with col_processes:
+        render_processes = st.number_input("合成プロセス数", min_value=1, max_value=8, value=int(cfg.data["voice"].get("render_processes", 2)))
+    interrupt_on_new_message = st.checkbox(
+        "新しいメッセージを送ったら前の応答の読み上げを止める",
+        value=bool(cfg.data["voice"].get("interrupt_on_new_message", True))
+    )
+    if st.button("💾 音声読み上げの設定を保存"):
+        cfg.data["voice"].update({
+            "queue_size": queue_size,
+            "queue_policy": queue_policy,
+            "cache_max_mb": cache_max_mb,
+            "prerender_starters": prerender_starters,
+            "output": output,
+            "browser_engine": browser_engine,
+            "browser_format": browser_format,
+            "render_processes": render_processes,
+            "interrupt_on_new_message": interrupt_on_new_message,
+        })
+        cfg.save()
+        st.success("音声読み上げの設定を保存しました")
+
 # -------------------------------------------
 # その他
 # -------------------------------------------
@@ -0,0 +1,212 @@
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# CLIP テキストエンコーダが一度に扱えるトークン数（WebUI はこれを超えると次のチャンクに分割する）
+CLIP_CHUNK_TOKENS = 75
+
+# <lora:name:weight> / <lyco:...> / <hypernet:...> などの追加ネットワーク指定
+EXTRA_NETWORK_PATTERN = re.compile(r"<(\w+):([^:>]+)(?::([^>]*))?>")
+
+# トークン数の見積もり用（WebUI はエンコード前に強調の括弧と重みを取り除く）
+_WEIGHT_SYNTAX_PATTERN = re.compile(r":\s*-?[\d.]+\s*(?=[)\]])|[()\[\]]")
+_TOKEN_PATTERN = re.compile(r"[a-z]+|[0-9]|[^\sa-z0-9]")
+
+
+def estimate_clip_tokens(tag: str) -> int:
+    """
+    タグが消費する CLIP トークン数を見積もる
+
+    トークナイザを読み込まずに済むよう、英単語は8文字ごとに1トークン、
+    数字・記号・日本語は1文字1トークンとして数える（実際より少し多めになる）。
+
+    Args:
+        tag (str): 1つのタグ（カンマを含まない）
+
+    Returns:
+        int: 見積もりトークン数
+    """
+    text = _WEIGHT_SYNTAX_PATTERN.sub(" ", tag.lower())
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        if piece[0].isalpha() and piece.isascii():
+            count += (len(piece) + 7) // 8
+        else:
+            count += 1
+    return count
+
+
+def split_oversized_tag(tag: str, limit: int = CLIP_CHUNK_TOKENS) -> List[str]:
+    """
+    1チャンクに収まらない長いタグ（日本語の文をそのまま渡した場合など）を limit トークン以下に分割する
+
+    空白・句読点の位置で区切って詰め、それでも長い部分は文字単位で切る。
+
+    Args:
+        tag (str): 1つのタグ
+        limit (int): 1つあたりの最大トークン数
+
+    Returns:
+        List[str]: 分割したタグ（収まる場合は元のタグだけ）
+    """
+    if estimate_clip_tokens(tag) <= limit:
+        return [tag]
+    pieces: List[str] = []
+    current = ""
+    for word in re.findall(r"[^\s。、．！？!?]+[。、．！？!?]*", tag):
+        candidate = f"{current} {word}" if current else word
+        if estimate_clip_tokens(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        current = ""
+        for char in word:
+            if estimate_clip_tokens(current + char) > limit and current:
+                pieces.append(current)
+                current = ""
+            current += char
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _tag_key(tag: str) -> str:
+    """重複判定用に強調・重み・表記ゆれを取り除いたキー"""
+    text = _WEIGHT_SYNTAX_PATTERN.sub(" ", tag.lower()).replace("_", " ")
+    return " ".join(text.split())
+
+
+class PromptCompiler:
+    def __init__(self, max_chunks: int = 2, use_break: bool = True, cache_size: int = 256):
+        """
+        画像生成プロンプトを組み立てるクラスの初期化
+
+        キャラクターの外見 > 感情 > シーン の優先順でタグを並べて重複を除き、
+        75トークンの CLIP チャンク境界をまたがないように詰める。
+        LoRA などの追加ネットワーク指定は末尾に1回だけ出力する。
+
+        Args:
+            max_chunks (int): 使用するチャンク数の上限（超えた分は優先度の低いタグから捨てる）
+            use_break (bool): チャンクの区切りに BREAK を挿入するか
+            cache_size (int): 組み立て結果を覚えておく件数
+        """
+        self.max_chunks = max_chunks
+        self.use_break = use_break
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple, str]" = OrderedDict()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "dropped_tags": 0, "chunks": 0}
+
+    def update_settings(self, settings: Dict):
+        """
+        チャンク数などの設定を更新（変わった場合はキャッシュを破棄）
+
+        Args:
+            settings (Dict): ConfigManager の "sd" セクション
+        """
+        max_chunks = max(1, int(settings.get("prompt_max_chunks", self.max_chunks)))
+        use_break = bool(settings.get("prompt_use_break", self.use_break))
+        if (max_chunks, use_break) != (self.max_chunks, self.use_break):
+            self.max_chunks = max_chunks
+            self.use_break = use_break
+            self._cache.clear()
+
+    def compile(self, identity: str, emotion: str = "", scene: str = "",
+                loras: Optional[Dict[str, float]] = None) -> str:
+        """
+        プロンプトを組み立てる（同じ入力は前回の結果を返す）
+
+        Args:
+            identity (str): キャラクターの外見プロンプト（image_prompt）
+            emotion (str): 感情の修飾タグ
+            scene (str): シーンのタグ（会話の要約など）
+            loras (Dict[str, float]): 適用する LoRA 名と強度（プロンプト内の指定より優先）
+
+        Returns:
+            str: WebUI に渡すプロンプト
+        """
+        lora_items = tuple(sorted((loras or {}).items()))
+        key = (identity or "", emotion or "", scene or "", lora_items)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return cached
+
+        self.stats["misses"] += 1
+        prompt = self._compile(key[0], key[1], key[2], dict(lora_items))
+        self._cache[key] = prompt
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return prompt
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        キャッシュの統計を取得
+
+        Returns:
+            Dict[str, int]: ヒット数・ミス数・捨てたタグ数・使用チャンク数の累計
+        """
+        stats = dict(self.stats)
+        stats["cached"] = len(self._cache)
+        return stats
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _compile(self, identity: str, emotion: str, scene: str, loras: Dict[str, float]) -> str:
+        networks: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        seen = set()
+        tiers: List[List[str]] = []
+        for part in (identity, emotion, scene):
+            tags = []
+            for tag in self._split_tags(part, networks):
+                key = _tag_key(tag)
+                if key and key not in seen:
+                    seen.add(key)
+                    tags.append(tag)
+            tiers.append(tags)
+
+        # 画面で選んだ LoRA の強度はプロンプト内の指定を上書きする
+        for name, weight in loras.items():
+            if weight > 0:
+                networks[("lora", name)] = f"<lora:{name}:{round(float(weight), 2):g}>"
+            else:
+                networks.pop(("lora", name), None)
+
+        chunks: List[List[str]] = [[]]
+        used = 0
+        for tags in tiers:
+            # 1チャンクより長いタグはチャンクからはみ出すので、先に分割しておく
+            for tag in [piece for original in tags for piece in split_oversized_tag(original)]:
+                cost = estimate_clip_tokens(tag)
+                # 2つ目以降のタグはカンマの分も数える
+                needed = cost + (1 if chunks[-1] else 0)
+                if used + needed > CLIP_CHUNK_TOKENS and chunks[-1]:
+                    if len(chunks) >= self.max_chunks:
+                        self.stats["dropped_tags"] += 1
+                        continue
+                    chunks.append([])
+                    used = 0
+                    needed = cost
+                chunks[-1].append(tag)
+                used += needed
+
+        chunks = [chunk for chunk in chunks if chunk]
+        self.stats["chunks"] += len(chunks)
+        separator = " BREAK " if self.use_break else ", "
+        prompt = separator.join(", ".join(chunk) for chunk in chunks)
+        if networks:
+            prompt = f"{prompt} {' '.join(networks.values())}".strip()
+        return prompt
+
+    @staticmethod
+    def _split_tags(text: str, networks: "OrderedDict[Tuple[str, str], str]") -> List[str]:
+        """カンマ・改行・BREAK で区切ってタグに分け、追加ネットワーク指定は networks に移す"""
+        def collect(match):
+            networks.setdefault((match.group(1).lower(), match.group(2)), match.group(0))
+            return ","
+
+        text = EXTRA_NETWORK_PATTERN.sub(collect, text or "")
+        text = re.sub(r"\bBREAK\b", ",", text)
+        return [tag.strip() for tag in re.split(r"[,\n]", text) if tag.strip()]
@@ -0,0 +1,73 @@
+from typing import Dict, Optional
+
+from emotion_analyzer import Emotion
+from stable_diffusion_api import tag_similarity
+
+
+class SceneChangeDetector:
+    def __init__(self, threshold: float = 0.8):
+        """
+        シーン変化検出クラスの初期化
+
+        直前に画像を生成したときのシーンタグ・感情と比較し、
+        ほとんど変わっていなければ画像生成を省略して前の画像を使い回す。
+
+        Args:
+            threshold (float): この類似度以上なら「変化なし」とみなす（1.0超で常に生成）
+        """
+        self.threshold = threshold
+        self._previous_scene: Optional[str] = None
+        self._previous_emotion: Optional[Emotion] = None
+        self.stats: Dict[str, float] = {
+            "checked": 0,
+            "generated": 0,
+            "skipped": 0,
+            "last_similarity": 0.0,
+        }
+
+    def should_generate(self, scene_tags: str, emotion: Optional[Emotion] = None,
+                        has_previous_image: bool = True) -> bool:
+        """
+        新しい画像を生成すべきか判定
+
+        生成すべきと判定した場合は、そのシーンを次回の比較対象として記録する。
+
+        Args:
+            scene_tags (str): summarize_for_image が返したシーンタグ
+            emotion (Emotion): 現在の感情
+            has_previous_image (bool): 使い回せる前の画像があるか（無ければ似ていても生成する）
+
+        Returns:
+            bool: 生成すべきならTrue、前の画像を使い回せるならFalse
+        """
+        self.stats["checked"] += 1
+
+        if self._previous_scene is not None and emotion == self._previous_emotion:
+            similarity = tag_similarity(scene_tags, self._previous_scene)
+            self.stats["last_similarity"] = similarity
+            if similarity >= self.threshold and has_previous_image:
+                self.stats["skipped"] += 1
+                return False
+        else:
+            self.stats["last_similarity"] = 0.0
+
+        self._previous_scene = scene_tags
+        self._previous_emotion = emotion
+        self.stats["generated"] += 1
+        return True
+
+    def reset(self):
+        """比較対象をクリアする（会話リセットやキャラクター変更時）。"""
+        self._previous_scene = None
+        self._previous_emotion = None
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        省略の統計を取得
+
+        Returns:
+            Dict[str, float]: 判定回数・生成回数・省略回数・省略率・直近の類似度
+        """
+        stats = dict(self.stats)
+        stats["skip_rate"] = stats["skipped"] / stats["checked"] if stats["checked"] else 0.0
+        return stats
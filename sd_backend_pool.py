@@ -0,0 +1,243 @@
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+import requests
+
+# プロンプト中の <lora:名前:強度> を抽出する
+LORA_TAG_PATTERN = re.compile(r"<lora:([^:>]+)(?::[^>]*)?>")
+
+
+def extract_lora_names(prompt: str) -> Set[str]:
+    """
+    プロンプトから参照されている LoRA 名を取り出す
+
+    Args:
+        prompt (str): 画像生成プロンプト
+
+    Returns:
+        Set[str]: LoRA 名の集合
+    """
+    return set(LORA_TAG_PATTERN.findall(prompt or ""))
+
+
+class SDBackend:
+    """1台の Stable Diffusion WebUI の状態"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        # 成功率の指数移動平均（ルーティングの重み）
+        self.health = 1.0
+        self.drained_until = 0.0
+        self.loras: Set[str] = set()
+        self.checkpoints: Set[str] = set()
+        self.current_checkpoint = ""
+        # このバックエンドで別のチェックポイントへ切り替えた回数
+        self.checkpoint_swaps = 0
+        self.inventory_updated_at = 0.0
+        # 直近の死活確認の時刻と結果（再描画のたびに全台へ問い合わせないよう使い回す）
+        self.probed_at = 0.0
+        self.probe_ok = False
+
+    @property
+    def is_drained(self) -> bool:
+        return time.time() < self.drained_until
+
+    def has_inventory(self, loras: Iterable[str], checkpoint: Optional[str] = None) -> bool:
+        if not set(loras).issubset(self.loras):
+            return False
+        return not checkpoint or checkpoint in self.checkpoints
+
+    def to_dict(self) -> Dict:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "health": round(self.health, 3),
+            "drained": self.is_drained,
+            "consecutive_failures": self.consecutive_failures,
+            "loras": len(self.loras),
+            "checkpoints": len(self.checkpoints),
+            "current_checkpoint": self.current_checkpoint,
+            "checkpoint_swaps": self.checkpoint_swaps,
+        }
+
+
+class SDBackendPool:
+    def __init__(self, urls: List[str], failure_threshold: int = 3, cooldown: float = 30.0,
+                 inventory_ttl: float = 60.0, probe_ttl: float = 5.0):
+        """
+        複数の Stable Diffusion WebUI への振り分けを管理するプールの初期化
+
+        Args:
+            urls (List[str]): WebUI の URL リスト
+            failure_threshold (int): 連続失敗で切り離すまでの回数
+            cooldown (float): 切り離したバックエンドを再確認するまでの秒数
+            inventory_ttl (float): LoRA / チェックポイント一覧の再取得間隔（秒）
+            probe_ttl (float): probe_all で死活確認の結果を使い回す秒数
+        """
+        self.backends = [SDBackend(url) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.inventory_ttl = inventory_ttl
+        self.probe_ttl = probe_ttl
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self) -> List[str]:
+        return [backend.url for backend in self.backends]
+
+    def probe(self, backend: SDBackend) -> bool:
+        """
+        バックエンドの死活確認を行い、必要なら在庫（LoRA / チェックポイント）を更新
+
+        Args:
+            backend (SDBackend): 確認対象
+
+        Returns:
+            bool: 応答があればTrue
+        """
+        try:
+            response = requests.get(f"{backend.url}/sdapi/v1/options", timeout=2)
+            ok = response.status_code == 200
+            if ok:
+                backend.current_checkpoint = response.json().get("sd_model_checkpoint", "") or ""
+        except Exception:
+            ok = False
+
+        with self._lock:
+            if ok:
+                backend.drained_until = 0.0
+                backend.consecutive_failures = 0
+            else:
+                self._record_failure(backend)
+            backend.probed_at = time.time()
+            backend.probe_ok = ok
+
+        if ok and time.time() - backend.inventory_updated_at > self.inventory_ttl:
+            self.refresh_inventory(backend)
+        return ok
+
+    def probe_all(self) -> bool:
+        """
+        切り離し中（クールダウン中）以外の全バックエンドを確認
+
+        probe_ttl 秒以内に確認（またはジョブが成功）したバックエンドは問い合わせずに前回の結果を使う。
+
+        Returns:
+            bool: 1台でも利用可能ならTrue
+        """
+        available = False
+        now = time.time()
+        for backend in self.backends:
+            if backend.is_drained:
+                continue
+            if now - backend.probed_at < self.probe_ttl:
+                ok = backend.probe_ok
+            else:
+                ok = self.probe(backend)
+            if ok:
+                available = True
+        return available
+
+    def refresh_inventory(self, backend: SDBackend):
+        """LoRA とチェックポイントの一覧を取得し直す。"""
+        try:
+            response = requests.get(f"{backend.url}/sdapi/v1/loras", timeout=10)
+            if response.status_code == 200:
+                backend.loras = {lora['name'] for lora in response.json()}
+            response = requests.get(f"{backend.url}/sdapi/v1/sd-models", timeout=10)
+            if response.status_code == 200:
+                checkpoints = set()
+                for model in response.json():
+                    checkpoints.update(filter(None, [model.get('title'), model.get('model_name')]))
+                backend.checkpoints = checkpoints
+            backend.inventory_updated_at = time.time()
+        except Exception as e:
+            print(f"バックエンド在庫取得エラー ({backend.url}): {e}")
+
+    def get_all_loras(self) -> List[str]:
+        """
+        利用可能なバックエンドの LoRA を統合したリストを取得
+
+        Returns:
+            List[str]: LoRA 名（ソート済み）
+        """
+        names: Set[str] = set()
+        for backend in self.backends:
+            if not backend.is_drained:
+                names.update(backend.loras)
+        return sorted(names)
+
+    def acquire(self, loras: Iterable[str] = (), checkpoint: Optional[str] = None,
+                exclude: Iterable[SDBackend] = ()) -> Optional[SDBackend]:
+        """
+        ジョブを実行するバックエンドを選ぶ（未処理ジョブ数 / 健全度 が最小のもの）
+
+        Args:
+            loras (Iterable[str]): プロンプトが参照する LoRA
+            checkpoint (str): 希望するチェックポイント
+            exclude (Iterable[SDBackend]): 今回のリトライで除外するバックエンド
+
+        Returns:
+            Optional[SDBackend]: 選ばれたバックエンド（利用可能なものが無ければNone）
+        """
+        loras = set(loras)
+        excluded = set(id(backend) for backend in exclude)
+        with self._lock:
+            candidates = [
+                backend for backend in self.backends
+                if not backend.is_drained and id(backend) not in excluded
+            ]
+            if not candidates:
+                return None
+            eligible = [backend for backend in candidates if backend.has_inventory(loras, checkpoint)]
+            if not eligible:
+                # チェックポイント指定は諦めても LoRA が揃うバックエンドを優先する
+                eligible = [backend for backend in candidates if backend.has_inventory(loras)]
+            if not eligible:
+                print(f"必要なLoRAを持つバックエンドがありません: {sorted(loras)}")
+                eligible = candidates
+            backend = min(
+                eligible,
+                key=lambda b: ((b.outstanding + 1) / max(b.health, 0.05), b.current_checkpoint != checkpoint)
+            )
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend: SDBackend, success: bool):
+        """
+        ジョブ完了を記録する
+
+        Args:
+            backend (SDBackend): acquire で得たバックエンド
+            success (bool): 成功したか
+        """
+        with self._lock:
+            backend.outstanding = max(0, backend.outstanding - 1)
+            if success:
+                backend.consecutive_failures = 0
+                backend.health = backend.health * 0.8 + 0.2
+                # 生成に成功したので、死活確認を済ませたものとして扱う
+                backend.probed_at = time.time()
+                backend.probe_ok = True
+            else:
+                self._record_failure(backend)
+
+    def get_status(self) -> List[Dict]:
+        """各バックエンドの状態一覧を取得する。"""
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
+
+    def _record_failure(self, backend: SDBackend):
+        # ロック取得済みで呼ぶこと
+        backend.consecutive_failures += 1
+        backend.health = backend.health * 0.8
+        # 失敗した直後は前回の確認結果を信用せず、次の probe_all で問い合わせ直す
+        backend.probed_at = 0.0
+        if backend.consecutive_failures >= self.failure_threshold:
+            # 新規ジョブを送らないよう切り離し、クールダウン後に再確認する
+            backend.drained_until = time.time() + self.cooldown
+            print(f"バックエンドを一時的に切り離しました: {backend.url}")
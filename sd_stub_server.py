@@ -0,0 +1,331 @@
+"""
+Stable Diffusion WebUI の代替スタブサーバー
+
+GPU マシンが無い環境でも画像生成パスの結合テストやベンチマークができるよう、
+StableDiffusionAPI が利用する API を標準ライブラリだけで模倣する。
+
+使い方::
+
+    python sd_stub_server.py --port 7860 --latency 0.5 --failure-rate 0.1
+
+テストやベンチマークからは StubSDServer を直接起動できる::
+
+    server = StubSDServer(latency=0.2).start()
+    sd_api = StableDiffusionAPI(api_url=server.url)
+    ...
+    server.stop()
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+def make_png(width: int, height: int, rgb) -> bytes:
+    """
+    単色の PNG バイト列を生成する（Pillow 不要）
+
+    Args:
+        width (int): 画像幅
+        height (int): 画像高さ
+        rgb (tuple): (R, G, B)
+
+    Returns:
+        bytes: PNG データ
+    """
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    row = b"\x00" + bytes(rgb) * width
+    raw = row * height
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+class StubSDServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 latency_per_step: float = 0.0, failure_rate: float = 0.0, queue_depth: int = 0,
+                 loras: Optional[List[str]] = None, checkpoints: Optional[List[str]] = None,
+                 swap_latency: float = 0.0, seed: Optional[int] = None):
+        """
+        スタブサーバーの初期化
+
+        Args:
+            host (str): 待ち受けホスト
+            port (int): 待ち受けポート（0なら空きポートを自動選択）
+            latency (float): 1ジョブあたりの固定遅延（秒）
+            latency_per_step (float): ステップ数に比例する遅延（秒/step）
+            failure_rate (float): 生成リクエストを 500 で失敗させる確率
+            queue_depth (int): 常に先行していることにする仮想ジョブ数
+            loras (List[str]): /loras で返す LoRA 名
+            checkpoints (List[str]): /sd-models で返すチェックポイント名
+            swap_latency (float): チェックポイント切り替えにかかる遅延（秒）
+            seed (int): 失敗注入用乱数のシード
+        """
+        self.latency = latency
+        self.latency_per_step = latency_per_step
+        self.failure_rate = failure_rate
+        self.queue_depth = queue_depth
+        self.loras = loras if loras is not None else ["stub_lora"]
+        self.checkpoints = checkpoints if checkpoints is not None else ["stub_model.safetensors"]
+        self.swap_latency = swap_latency
+        self.current_checkpoint = self.checkpoints[0] if self.checkpoints else ""
+        self.random = random.Random(seed)
+
+        # 実 WebUI と同様に GPU は1つとみなし、生成は直列に処理する
+        self._gpu_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._interrupted = threading.Event()
+        self._job_count = 0
+        self._progress = 0.0
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "generated": 0,
+            "failed": 0,
+            "interrupted": 0,
+            "checkpoint_swaps": 0,
+        }
+
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubSDServer":
+        """バックグラウンドスレッドで待ち受けを開始する。"""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """待ち受けを停止する。"""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    # ------------------------------------------------------------------
+    # API 実装
+    # ------------------------------------------------------------------
+    def generate(self, payload: Dict, mode: str):
+        """
+        txt2img / img2img を模倣する
+
+        Returns:
+            Tuple[int, Dict]: ステータスコードとレスポンス本文
+        """
+        with self._state_lock:
+            self.stats["requests"] += 1
+            self._job_count += 1
+        try:
+            if self.random.random() < self.failure_rate:
+                with self._state_lock:
+                    self.stats["failed"] += 1
+                return 500, {"error": "InjectedFailure", "detail": "stub failure injection"}
+
+            # 先行する仮想ジョブぶん待たせる
+            steps = int(payload.get("steps", 20))
+            job_time = self.latency + self.latency_per_step * steps
+            if self.queue_depth:
+                time.sleep(job_time * self.queue_depth)
+
+            with self._gpu_lock:
+                self._interrupted.clear()
+                checkpoint = (payload.get("override_settings") or {}).get("sd_model_checkpoint")
+                if checkpoint:
+                    self._load_checkpoint(checkpoint)
+                interrupted = self._run_job(job_time)
+
+            width = int(payload.get("width", 512))
+            height = int(payload.get("height", 512))
+            if payload.get("enable_hr"):
+                hr_scale = float(payload.get("hr_scale", 2))
+                width, height = int(width * hr_scale), int(height * hr_scale)
+            seed = int(payload.get("seed", -1))
+            if seed == -1:
+                seed = self.random.randint(0, 2 ** 32 - 1)
+            digest = hashlib.md5(f"{payload.get('prompt', '')}|{seed}".encode("utf-8")).digest()
+            png = make_png(width, height, digest[:3])
+
+            with self._state_lock:
+                self.stats["generated"] += 1
+                if interrupted:
+                    self.stats["interrupted"] += 1
+            info = {
+                "prompt": payload.get("prompt", ""),
+                "negative_prompt": payload.get("negative_prompt", ""),
+                "seed": seed,
+                "steps": steps,
+                "width": width,
+                "height": height,
+                "sampler_name": payload.get("sampler_name", ""),
+                "sd_model_name": self.current_checkpoint,
+                "mode": mode,
+                "interrupted": interrupted,
+            }
+            return 200, {
+                "images": [base64.b64encode(png).decode()],
+                "parameters": payload,
+                "info": json.dumps(info),
+            }
+        finally:
+            with self._state_lock:
+                self._job_count -= 1
+
+    def _run_job(self, job_time: float) -> bool:
+        """生成時間ぶん待ちながら進捗を更新する。中断されたら True。"""
+        started = time.time()
+        while True:
+            elapsed = time.time() - started
+            self._progress = min(1.0, elapsed / job_time) if job_time > 0 else 1.0
+            if self._progress >= 1.0:
+                break
+            if self._interrupted.wait(min(0.05, job_time - elapsed)):
+                break
+        self._progress = 0.0
+        return self._interrupted.is_set()
+
+    def _load_checkpoint(self, checkpoint: str):
+        if checkpoint != self.current_checkpoint:
+            time.sleep(self.swap_latency)
+            self.current_checkpoint = checkpoint
+            with self._state_lock:
+                self.stats["checkpoint_swaps"] += 1
+
+    def progress(self) -> Dict:
+        with self._state_lock:
+            job_count = self._job_count + self.queue_depth
+        return {
+            "progress": self._progress,
+            "eta_relative": 0.0,
+            "state": {
+                "job_count": job_count,
+                "interrupted": self._interrupted.is_set(),
+                "sampling_step": 0,
+                "sampling_steps": 0,
+            },
+            "current_image": None,
+            "textinfo": None,
+        }
+
+    def options(self) -> Dict:
+        return {"sd_model_checkpoint": self.current_checkpoint}
+
+    def set_options(self, payload: Dict):
+        checkpoint = payload.get("sd_model_checkpoint")
+        if checkpoint:
+            with self._gpu_lock:
+                self._load_checkpoint(checkpoint)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                # ベンチマーク時にログで遅くならないよう出力しない
+                pass
+
+            def _send_json(self, status: int, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _read_json(self) -> Dict:
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                if not length:
+                    return {}
+                try:
+                    return json.loads(self.rfile.read(length).decode("utf-8"))
+                except ValueError:
+                    return {}
+
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                if path == "/sdapi/v1/options":
+                    self._send_json(200, server.options())
+                elif path == "/sdapi/v1/loras":
+                    self._send_json(200, [{"name": name, "alias": name, "path": f"{name}.safetensors"} for name in server.loras])
+                elif path == "/sdapi/v1/sd-models":
+                    self._send_json(200, [{"title": name, "model_name": name.rsplit(".", 1)[0]} for name in server.checkpoints])
+                elif path == "/sdapi/v1/progress":
+                    self._send_json(200, server.progress())
+                elif path == "/stub/stats":
+                    self._send_json(200, dict(server.stats))
+                else:
+                    self._send_json(404, {"detail": "Not Found"})
+
+            def do_POST(self):
+                path = self.path.split("?", 1)[0]
+                payload = self._read_json()
+                if path == "/sdapi/v1/txt2img":
+                    self._send_json(*server.generate(payload, "txt2img"))
+                elif path == "/sdapi/v1/img2img":
+                    self._send_json(*server.generate(payload, "img2img"))
+                elif path == "/sdapi/v1/interrupt":
+                    server._interrupted.set()
+                    self._send_json(200, {})
+                elif path == "/sdapi/v1/options":
+                    server.set_options(payload)
+                    self._send_json(200, {})
+                else:
+                    self._send_json(404, {"detail": "Not Found"})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stable Diffusion WebUI スタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--latency", type=float, default=0.5, help="1ジョブあたりの固定遅延（秒）")
+    parser.add_argument("--latency-per-step", type=float, default=0.0, help="ステップ数比例の遅延（秒/step）")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="生成失敗の確率 (0-1)")
+    parser.add_argument("--queue-depth", type=int, default=0, help="先行している仮想ジョブ数")
+    parser.add_argument("--loras", default="stub_lora", help="カンマ区切りの LoRA 名")
+    parser.add_argument("--checkpoints", default="stub_model.safetensors", help="カンマ区切りのチェックポイント名")
+    parser.add_argument("--swap-latency", type=float, default=0.0, help="チェックポイント切り替え遅延（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = StubSDServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        latency_per_step=args.latency_per_step,
+        failure_rate=args.failure_rate,
+        queue_depth=args.queue_depth,
+        loras=[name for name in args.loras.split(",") if name],
+        checkpoints=[name for name in args.checkpoints.split(",") if name],
+        swap_latency=args.swap_latency,
+        seed=args.seed,
+    )
+    print(f"SD スタブサーバーを起動しました: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nスタブサーバーを終了します...")
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import CancelledError
+from typing import Dict, List, Optional
+
+from emotion_analyzer import Emotion, EmotionAnalyzer
+from image_scheduler import PRIORITY_BACKGROUND
+
+
+class EmotionSpriteCache:
+    """
+    キャラクターごとの感情別ポートレート（スプライト）をディスクにキャッシュするクラス
+
+    ディレクトリ構造::
+
+        sprites/キャラクター名/happy.png
+        sprites/キャラクター名/atlas.json  (生成に使ったプロンプトのハッシュ)
+    """
+
+    # スプライト用にプロンプトへ付け足す構図指定
+    PORTRAIT_PROMPT = "portrait, upper body, looking at viewer, simple background"
+
+    def __init__(self, sd_api, emotion_analyzer: Optional[EmotionAnalyzer] = None, sprites_dir: str = "sprites",
+                 scheduler=None):
+        """
+        スプライトキャッシュの初期化
+
+        Args:
+            sd_api (StableDiffusionAPI): 画像生成に使うAPI
+            emotion_analyzer (EmotionAnalyzer): 感情プロンプトの生成に使う解析器
+            sprites_dir (str): スプライト保存ディレクトリ
+            scheduler (ImageJobScheduler): 生成ジョブを投入するスケジューラ（最低優先度で投入し、
+                ユーザーが待っている生成を先に処理させる。省略時は直接生成する）
+        """
+        self.sd_api = sd_api
+        self.scheduler = scheduler
+        self.emotion_analyzer = emotion_analyzer or EmotionAnalyzer()
+        self.sprites_dir = sprites_dir
+        self._lock = threading.Lock()
+        # 生成中のキャラクター名 -> スレッド
+        self._workers: Dict[str, threading.Thread] = {}
+
+    def get_sprite(self, character_name: str, emotion: Emotion) -> Optional[str]:
+        """
+        生成済みのスプライトを取得
+
+        Args:
+            character_name (str): キャラクター名
+            emotion (Emotion): 感情
+
+        Returns:
+            Optional[str]: スプライトのファイルパス（未生成ならNone）
+        """
+        filepath = self._sprite_path(character_name, emotion)
+        if os.path.exists(filepath):
+            return filepath
+        # 感情別がまだ無ければ中立の顔で代用する
+        fallback = self._sprite_path(character_name, Emotion.NEUTRAL)
+        if emotion != Emotion.NEUTRAL and os.path.exists(fallback):
+            return fallback
+        return None
+
+    def get_missing_emotions(self, character_data: Dict) -> List[Emotion]:
+        """
+        未生成（またはプロンプト変更で古くなった）感情のリストを取得
+
+        Args:
+            character_data (Dict): キャラクターデータ
+
+        Returns:
+            List[Emotion]: 生成が必要な感情
+        """
+        character_name = character_data.get('name', 'character')
+        if self._load_atlas_hash(character_name) != self._prompt_hash(character_data):
+            return list(Emotion)
+        return [
+            emotion for emotion in Emotion
+            if not os.path.exists(self._sprite_path(character_name, emotion))
+        ]
+
+    def is_generating(self, character_name: str) -> bool:
+        """
+        バックグラウンド生成中かチェック
+
+        Args:
+            character_name (str): キャラクター名
+
+        Returns:
+            bool: 生成中ならTrue
+        """
+        with self._lock:
+            worker = self._workers.get(character_name)
+            return worker is not None and worker.is_alive()
+
+    def pregenerate(self, character_data: Dict) -> bool:
+        """
+        不足しているスプライトをバックグラウンドで生成開始
+
+        Args:
+            character_data (Dict): キャラクターデータ
+
+        Returns:
+            bool: 生成スレッドを開始した場合True
+        """
+        character_name = character_data.get('name', 'character')
+        if not character_data.get('image_prompt'):
+            return False
+
+        missing = self.get_missing_emotions(character_data)
+        if not missing:
+            return False
+
+        with self._lock:
+            worker = self._workers.get(character_name)
+            if worker is not None and worker.is_alive():
+                return False
+            worker = threading.Thread(
+                target=self._generate_all,
+                args=(dict(character_data), missing),
+                daemon=True
+            )
+            self._workers[character_name] = worker
+        worker.start()
+        return True
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _generate_all(self, character_data: Dict, emotions: List[Emotion]):
+        """感情ごとのスプライトを順番に生成して保存する（ワーカースレッド）。"""
+        character_name = character_data.get('name', 'character')
+        base_prompt = f"{character_data.get('image_prompt', '')}, {self.PORTRAIT_PROMPT}".strip(", ")
+        negative_prompt = character_data.get('image_negative_prompt', '')
+
+        char_dir = self._character_dir(character_name)
+        os.makedirs(char_dir, exist_ok=True)
+        # プロンプトが変わった場合は古いスプライトを破棄してからハッシュを更新
+        prompt_hash = self._prompt_hash(character_data)
+        if self._load_atlas_hash(character_name) != prompt_hash:
+            for emotion in Emotion:
+                old_path = self._sprite_path(character_name, emotion)
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+            self._save_atlas_hash(character_name, prompt_hash)
+
+        for emotion in emotions:
+            try:
+                prompt = self.emotion_analyzer.get_emotion_prompt(emotion, base_prompt)
+                image = self._generate(character_name, emotion, prompt, negative_prompt,
+                                       character_data.get('image_checkpoint') or None)
+                if image is None:
+                    # SD未接続などで失敗した場合は次回に持ち越す
+                    print(f"スプライト生成を中断しました ({character_name}: {emotion.value})")
+                    return
+                filepath = self._sprite_path(character_name, emotion)
+                tmp_path = f"{filepath}.tmp"
+                image.save(tmp_path, format="PNG")
+                os.replace(tmp_path, filepath)
+            except Exception as e:
+                print(f"スプライト生成エラー ({character_name}: {emotion.value}): {e}")
+                return
+
+    def _generate(self, character_name: str, emotion: Emotion, prompt: str, negative_prompt: str,
+                  checkpoint: Optional[str]):
+        def job():
+            return self.sd_api.generate_character_image(prompt, negative_prompt, checkpoint=checkpoint)
+
+        if self.scheduler is None:
+            return job()
+        future = self.scheduler.submit(
+            f"sprite-{character_name}-{emotion.value}", job, priority=PRIORITY_BACKGROUND, checkpoint=checkpoint
+        )
+        if future.cancelled():
+            return None
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+
+    def _character_dir(self, character_name: str) -> str:
+        safe_name = re.sub(r'[\\/:*?"<>|]', "_", character_name)
+        return os.path.join(self.sprites_dir, safe_name)
+
+    def _sprite_path(self, character_name: str, emotion: Emotion) -> str:
+        return os.path.join(self._character_dir(character_name), f"{emotion.value}.png")
+
+    def _prompt_hash(self, character_data: Dict) -> str:
+        source = "\n".join([
+            character_data.get('image_prompt', ''),
+            character_data.get('image_negative_prompt', ''),
+            character_data.get('image_checkpoint', ''),
+            self.PORTRAIT_PROMPT,
+        ])
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def _load_atlas_hash(self, character_name: str) -> Optional[str]:
+        atlas_path = os.path.join(self._character_dir(character_name), "atlas.json")
+        try:
+            with open(atlas_path, "r", encoding="utf-8") as fp:
+                return json.load(fp).get("prompt_hash")
+        except Exception:
+            return None
+
+    def _save_atlas_hash(self, character_name: str, prompt_hash: str):
+        atlas_path = os.path.join(self._character_dir(character_name), "atlas.json")
+        with open(atlas_path, "w", encoding="utf-8") as fp:
+            json.dump({"prompt_hash": prompt_hash}, fp, ensure_ascii=False, indent=2)
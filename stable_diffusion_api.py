@@ -1,64 +1,196 @@
 import requests
 import base64
 import io
+import json
+import re
+import threading
 from PIL import Image
-import os
-from typing import List
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from image_writer import ImageWriter, SaveHandle
+from sd_backend_pool import SDBackendPool, extract_lora_names
+
+# ConfigManager の "sd" セクションが欠けている場合の既定値
+DEFAULT_SD_SETTINGS = {
+    "steps": 20,
+    "width": 512,
+    "height": 512,
+    "sampler": "DPM++ 2M Karras",
+    "cfg_scale": 7,
+    "progressive": False,
+    "preview_steps": 8,
+    "preview_width": 384,
+    "preview_height": 384,
+    "preview_sampler": "Euler a",
+    "refine_mode": "img2img",
+    "refine_denoising_strength": 0.45,
+    "continuity": False,
+    "continuity_threshold": 0.5,
+    "continuity_denoising_strength": 0.35,
+}
+
+# 類似度の計算で無視する語
+PROMPT_STOPWORDS = {"a", "an", "the", "and", "with", "of", "in", "on", "at", "to", "is", "her", "his"}
+
+
+def prompt_tokens(prompt: str) -> Set[str]:
+    """
+    プロンプトを比較用の単語集合に変換する（LoRAタグ・強調の重みは除く）
+
+    Args:
+        prompt (str): 画像生成プロンプト
+
+    Returns:
+        Set[str]: 小文字化した単語の集合
+    """
+    text = re.sub(r"<[^>]*>", " ", prompt or "")
+    text = re.sub(r":\s*[\d.]+\s*\)", ")", text)
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return {word for word in words if word not in PROMPT_STOPWORDS}
+
+
+def tag_similarity(prompt_a: str, prompt_b: str) -> float:
+    """
+    2つのプロンプトの単語集合の Jaccard 類似度を計算する
+
+    Args:
+        prompt_a (str): プロンプトA
+        prompt_b (str): プロンプトB
+
+    Returns:
+        float: 0.0（無関係）〜 1.0（同一）
+    """
+    tokens_a = prompt_tokens(prompt_a)
+    tokens_b = prompt_tokens(prompt_b)
+    if not tokens_a and not tokens_b:
+        return 1.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
 
 class StableDiffusionAPI:
-    def __init__(self, api_url="http://127.0.0.1:7860"):
+    def __init__(self, api_url: Union[str, List[str]] = "http://127.0.0.1:7860", settings: Optional[Dict] = None,
+                 image_writer: Optional[ImageWriter] = None):
         """
         Stable Diffusion WebUI APIの初期化
         
         Args:
-            api_url (str): Stable Diffusion WebUIのAPI URL
+            api_url (str or List[str]): Stable Diffusion WebUIのAPI URL（複数指定で負荷分散）
+            settings (Dict): ConfigManager の "sd" セクション（"backends" があれば api_url より優先）
+            image_writer (ImageWriter): 画像のバックグラウンド保存に使うライター
         """
-        self.api_url = api_url
-        self.txt2img_url = f"{api_url}/sdapi/v1/txt2img"
-        self.loras_url = f"{api_url}/sdapi/v1/loras"
+        self.image_writer = image_writer or ImageWriter()
+        urls = [api_url] if isinstance(api_url, str) else list(api_url)
+        self.default_urls = urls
+        self.pool = SDBackendPool(urls)
+        self.api_url = self.pool.urls[0]
+        # ワーカースレッドごとに実行中のバックエンドを記録（中断要求の宛先）
+        self._active_backends: Dict[int, object] = {}
+        self._active_lock = threading.Lock()
+        self.settings = dict(DEFAULT_SD_SETTINGS)
+        self.update_settings(settings or {})
+
+    @property
+    def backend_count(self) -> int:
+        return len(self.pool.backends)
+
+    def update_settings(self, settings: Dict):
+        """
+        生成設定を更新（設定ページでの変更を反映するため毎回呼ばれる）
+        
+        Args:
+            settings (Dict): ConfigManager の "sd" セクション
+        """
+        for key in DEFAULT_SD_SETTINGS:
+            if key in settings and settings[key] not in (None, ""):
+                self.settings[key] = settings[key]
+
+        urls = [url for url in settings.get("backends", []) if url] or self.default_urls
+        if [url.rstrip("/") for url in urls] != self.pool.urls:
+            self.pool = SDBackendPool(urls)
+            self.api_url = self.pool.urls[0]
         
     def check_connection(self):
         """
         Stable Diffusion WebUIとの接続をチェック
         
         Returns:
-            bool: 接続成功ならTrue
+            bool: 1台でも接続成功ならTrue
         """
-        try:
-            response = requests.get(f"{self.api_url}/sdapi/v1/options", timeout=2)
-            return response.status_code == 200
-        except:
-            return False
+        return self.pool.probe_all()
     
     def get_loras(self) -> List[str]:
         """
         利用可能なLoRAのリストを取得
         
         Returns:
-            List[str]: LoRAファイル名のリスト
+            List[str]: LoRAファイル名のリスト（全バックエンドの和集合）
         """
         if not self.check_connection():
             return []
+        return self.pool.get_all_loras()
+
+    def get_backend_status(self) -> List[Dict]:
+        """
+        各バックエンドの状態を取得
         
+        Returns:
+            List[Dict]: URL・未処理ジョブ数・健全度など
+        """
+        return self.pool.get_status()
+    
+    def get_progress(self) -> Dict:
+        """
+        現在のジョブの進捗を取得
+        
+        Returns:
+            Dict: WebUIの進捗情報（取得失敗時は空）
+        """
         try:
-            response = requests.get(self.loras_url, timeout=10)
+            response = requests.get(f"{self.api_url}/sdapi/v1/progress", params={"skip_current_image": "true"}, timeout=2)
             if response.status_code == 200:
-                loras = response.json()
-                return [lora['name'] for lora in loras]
+                return response.json()
         except Exception as e:
-            print(f"LoRAリスト取得エラー: {e}")
+            print(f"進捗取得エラー: {e}")
+        return {}
+
+    def interrupt(self, thread_id: Optional[int] = None) -> bool:
+        """
+        実行中の生成ジョブを中断
         
-        return []
-    
-    def generate_character_image(self, prompt, negative_prompt="", width=512, height=512):
+        Args:
+            thread_id (int): 中断したいジョブを実行中のスレッドID（省略時は全バックエンド）
+        
+        Returns:
+            bool: 中断要求が受け付けられたらTrue
+        """
+        with self._active_lock:
+            if thread_id is not None:
+                backend = self._active_backends.get(thread_id)
+                backends = [backend] if backend is not None else []
+            else:
+                backends = [backend for backend in self.pool.backends if backend.outstanding > 0]
+        interrupted = False
+        for backend in backends:
+            try:
+                response = requests.post(f"{backend.url}/sdapi/v1/interrupt", timeout=2)
+                interrupted = interrupted or response.status_code == 200
+            except Exception as e:
+                print(f"生成中断エラー ({backend.url}): {e}")
+        return interrupted
+
+    def generate_character_image(self, prompt, negative_prompt="", width=None, height=None,
+                                 steps=None, sampler_name=None, seed=-1, checkpoint=None):
         """
         キャラクター画像を生成
         
         Args:
             prompt (str): 画像生成プロンプト
             negative_prompt (str): ネガティブプロンプト
-            width (int): 画像幅
-            height (int): 画像高さ
+            width (int): 画像幅（省略時は設定値）
+            height (int): 画像高さ（省略時は設定値）
+            steps (int): ステップ数（省略時は設定値）
+            sampler_name (str): サンプラー名（省略時は設定値）
+            seed (int): シード（-1でランダム）
+            checkpoint (str): 使用するチェックポイント（省略時は読み込み済みのモデル）
             
         Returns:
             PIL.Image or None: 生成された画像またはNone
@@ -66,36 +198,208 @@ class StableDiffusionAPI:
         if not self.check_connection():
             return None
             
+        payload = self._build_payload(prompt, negative_prompt, width, height, steps, sampler_name, seed, checkpoint)
+        image, _ = self._txt2img(payload)
+        return image
+
+    def generate_progressive_image(self, prompt, negative_prompt="",
+                                   on_preview: Optional[Callable[[Image.Image], None]] = None,
+                                   checkpoint=None, is_cancelled: Optional[Callable[[], bool]] = None):
+        """
+        低ステップ・低解像度のプレビューを先に生成し、同じシードで高画質化する
+        
+        Args:
+            prompt (str): 画像生成プロンプト
+            negative_prompt (str): ネガティブプロンプト
+            on_preview (Callable): プレビュー完成時に呼ばれるコールバック
+            checkpoint (str): 使用するチェックポイント（省略時は読み込み済みのモデル）
+            is_cancelled (Callable): Trueを返したら高画質化を行わない（不要になったジョブ用）
+            
+        Returns:
+            PIL.Image or None: 高画質化した画像（失敗時はプレビュー画像）
+        """
+        if not self.check_connection():
+            return None
+
+        settings = self.settings
+        preview_payload = self._build_payload(
+            prompt, negative_prompt,
+            settings["preview_width"], settings["preview_height"],
+            settings["preview_steps"], settings["preview_sampler"], -1, checkpoint
+        )
+        preview, info = self._txt2img(preview_payload)
+        if preview is None:
+            return None
+        # 中断されたのはプレビューの生成だけなので、高画質化は自分で打ち切る
+        if is_cancelled and is_cancelled():
+            return preview
+
+        if on_preview:
+            try:
+                on_preview(preview)
+            except Exception as e:
+                print(f"プレビュー表示エラー: {e}")
+
+        seed = info.get("seed", -1)
+        denoising_strength = settings["refine_denoising_strength"]
+        if settings["refine_mode"] == "hires":
+            # 1パス目はプレビューと同条件なので同じ構図のまま拡大・描き込みされる
+            refine_payload = dict(preview_payload)
+            refine_payload.update({
+                "seed": seed,
+                "enable_hr": True,
+                "hr_scale": settings["width"] / max(1, settings["preview_width"]),
+                "hr_upscaler": "Latent",
+                "hr_second_pass_steps": settings["steps"],
+                "denoising_strength": denoising_strength,
+            })
+            refined, _ = self._txt2img(refine_payload)
+        else:
+            refine_payload = self._build_payload(prompt, negative_prompt, seed=seed, checkpoint=checkpoint)
+            refine_payload.update({
+                "init_images": [self._encode_image(preview)],
+                "denoising_strength": denoising_strength,
+            })
+            refined, _ = self._img2img(refine_payload)
+
+        return refined or preview
+
+    def generate_continuous_image(self, prompt, negative_prompt="", previous_image=None, previous_prompt=None,
+                                  on_preview: Optional[Callable[[Image.Image], None]] = None,
+                                  checkpoint=None, is_cancelled: Optional[Callable[[], bool]] = None):
+        """
+        前ターンの画像を引き継いで生成する（継続モード）
+        
+        シーンがあまり変わっていなければ前の画像を低いノイズ除去強度で img2img し、
+        シーンが変わった場合は通常の txt2img（プログレッシブ設定なら段階生成）に戻る。
+        
+        Args:
+            prompt (str): 画像生成プロンプト
+            negative_prompt (str): ネガティブプロンプト
+            previous_image (PIL.Image): 前のメッセージの画像
+            previous_prompt (str): 前の画像を生成したプロンプト
+            on_preview (Callable): プログレッシブ生成時のプレビューコールバック
+            checkpoint (str): 使用するチェックポイント
+            is_cancelled (Callable): Trueを返したら以降の生成を行わない（不要になったジョブ用）
+            
+        Returns:
+            PIL.Image or None: 生成された画像またはNone
+        """
+        settings = self.settings
+        if (
+            settings["continuity"]
+            and previous_image is not None
+            and previous_prompt is not None
+            and tag_similarity(prompt, previous_prompt) >= float(settings["continuity_threshold"])
+            and self.check_connection()
+        ):
+            # img2img の実効ステップ数は steps × denoising_strength なので低コスト
+            payload = self._build_payload(prompt, negative_prompt, checkpoint=checkpoint)
+            payload.update({
+                "init_images": [self._encode_image(previous_image)],
+                "denoising_strength": settings["continuity_denoising_strength"],
+            })
+            image, _ = self._img2img(payload)
+            if image is not None or (is_cancelled and is_cancelled()):
+                return image
+
+        if settings["progressive"]:
+            return self.generate_progressive_image(
+                prompt, negative_prompt, on_preview=on_preview, checkpoint=checkpoint, is_cancelled=is_cancelled
+            )
+        return self.generate_character_image(prompt, negative_prompt, checkpoint=checkpoint)
+
+    def _build_payload(self, prompt, negative_prompt="", width=None, height=None,
+                       steps=None, sampler_name=None, seed=-1, checkpoint=None) -> Dict:
+        """設定値で補完した txt2img / img2img 共通のペイロードを作成する。"""
+        settings = self.settings
         payload = {
             "prompt": prompt,
             "negative_prompt": negative_prompt,
-            "width": width,
-            "height": height,
-            "steps": 20,
-            "cfg_scale": 7,
-            "sampler_name": "DPM++ 2M Karras",
-            "seed": -1,
+            "width": int(width or settings["width"]),
+            "height": int(height or settings["height"]),
+            "steps": int(steps or settings["steps"]),
+            "cfg_scale": settings["cfg_scale"],
+            "sampler_name": sampler_name or settings["sampler"],
+            "seed": seed,
             "batch_size": 1,
             "n_iter": 1
         }
+        if checkpoint:
+            # 生成後に元のモデルへ戻すと切り替えが2回発生するため、読み込んだままにする
+            payload["override_settings"] = {"sd_model_checkpoint": checkpoint}
+            payload["override_settings_restore_afterwards"] = False
+        return payload
+
+    def _txt2img(self, payload: Dict) -> Tuple[Optional[Image.Image], Dict]:
+        return self._post_image("/sdapi/v1/txt2img", payload)
+
+    def _img2img(self, payload: Dict) -> Tuple[Optional[Image.Image], Dict]:
+        return self._post_image("/sdapi/v1/img2img", payload)
+
+    def _post_image(self, path: str, payload: Dict) -> Tuple[Optional[Image.Image], Dict]:
+        """
+        画像生成APIを呼び出す（必要なLoRAを持つ空いたバックエンドへ振り分け、失敗時は別のバックエンドで再試行）
         
-        try:
-            response = requests.post(self.txt2img_url, json=payload, timeout=30)
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('images'):
-                    # Base64デコードして画像に変換
-                    image_data = base64.b64decode(result['images'][0])
-                    image = Image.open(io.BytesIO(image_data))
-                    return image
-        except Exception as e:
-            print(f"画像生成エラー: {e}")
+        Returns:
+            Tuple[PIL.Image or None, Dict]: 生成画像と生成情報（seed など）
+        """
+        loras = extract_lora_names(payload.get("prompt", ""))
+        checkpoint = (payload.get("override_settings") or {}).get("sd_model_checkpoint")
+        tried = []
+        thread_id = threading.get_ident()
+
+        while len(tried) < len(self.pool.backends):
+            backend = self.pool.acquire(loras, checkpoint, exclude=tried)
+            if backend is None:
+                break
+            tried.append(backend)
+            with self._active_lock:
+                self._active_backends[thread_id] = backend
+            success = False
+            try:
+                response = requests.post(f"{backend.url}{path}", json=payload, timeout=30)
+                if response.status_code == 200:
+                    result = response.json()
+                    if result.get('images'):
+                        # Base64デコードして画像に変換
+                        image_data = base64.b64decode(result['images'][0])
+                        image = Image.open(io.BytesIO(image_data))
+                        success = True
+                        if checkpoint:
+                            if backend.current_checkpoint and backend.current_checkpoint != checkpoint:
+                                backend.checkpoint_swaps += 1
+                            backend.current_checkpoint = checkpoint
+                        return image, self._parse_info(result.get('info'))
+                print(f"画像生成エラー ({backend.url}): HTTP {response.status_code}")
+            except Exception as e:
+                print(f"画像生成エラー ({backend.url}): {e}")
+            finally:
+                with self._active_lock:
+                    self._active_backends.pop(thread_id, None)
+                self.pool.release(backend, success)
             
-        return None
+        return None, {}
+
+    @staticmethod
+    def _parse_info(info) -> Dict:
+        """WebUIが返す info（JSON文字列）を辞書に変換する。"""
+        if isinstance(info, dict):
+            return info
+        try:
+            return json.loads(info) if info else {}
+        except (TypeError, ValueError):
+            return {}
+
+    @staticmethod
+    def _encode_image(image: Image.Image) -> str:
+        buffered = io.BytesIO()
+        image.save(buffered, format="PNG")
+        return base64.b64encode(buffered.getvalue()).decode()
     
-    def save_character_image(self, image, character_name, timestamp):
+    def save_character_image(self, image, character_name, timestamp) -> Optional[SaveHandle]:
         """
-        キャラクター画像を保存
+        キャラクター画像の保存を予約（書き込みはバックグラウンドで行う）
         
         Args:
             image (PIL.Image): 保存する画像
@@ -103,16 +407,8 @@ class StableDiffusionAPI:
             timestamp (str): タイムスタンプ
             
         Returns:
-            str: 保存されたファイルパス
+            SaveHandle or None: 保存先パス（handle.path）と完了待ち（handle.result()）を持つハンドル
         """
         if image is None:
             return None
-            
-        images_dir = "images"
-        os.makedirs(images_dir, exist_ok=True)
-        
-        filename = f"{character_name}_{timestamp}.png"
-        filepath = os.path.join(images_dir, filename)
-        
-        image.save(filepath)
-        return filepath
+        return self.image_writer.submit(image, character_name, timestamp)
@@ -0,0 +1,108 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+# 辞書ファイルの既定パス（highlight.html と同じ「日本語 → 英語タグ」の対応をカテゴリ別に記述）
+DEFAULT_DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tag_dictionary.json")
+
+# カバー率を計算する観点と、それぞれに該当する辞書カテゴリ
+COVERAGE_GROUPS: Dict[str, Tuple[str, ...]] = {
+    "appearance": ("hair", "eyes", "clothing"),
+    "place": ("place", "time"),
+    "mood": ("mood",),
+    "action": ("action",),
+}
+
+# トライ木の終端ノードを示すキー（1文字のキーとは衝突しない）
+_TERMINAL = ""
+
+
+class LocalTagExtractor:
+    def __init__(self, dictionary_path: str = DEFAULT_DICTIONARY_PATH):
+        """
+        日本語の文章から画像生成用の英語タグを辞書引きで抽出するクラスの初期化
+
+        LLM で要約する前の高速パスとして使う。辞書はトライ木に変換しておき、
+        文章を先頭から一度走査するだけで最長一致の語を拾う。
+
+        Args:
+            dictionary_path (str): カテゴリ別の対応表（JSON）のパス
+        """
+        self.dictionary_path = dictionary_path
+        self._trie: Dict = {}
+        self.term_count = 0
+        self.load_dictionary(dictionary_path)
+
+    def load_dictionary(self, dictionary_path: str):
+        """
+        対応表を読み込み、トライ木を構築し直す
+
+        Args:
+            dictionary_path (str): カテゴリ別の対応表（JSON）のパス
+        """
+        trie: Dict = {}
+        term_count = 0
+        try:
+            with open(dictionary_path, "r", encoding="utf-8") as fp:
+                dictionary = json.load(fp)
+            for category, pairs in dictionary.items():
+                for term, tag in pairs.items():
+                    term = term.strip()
+                    if not term or not tag:
+                        continue
+                    node = trie
+                    for char in term:
+                        node = node.setdefault(char, {})
+                    node[_TERMINAL] = (tag.strip(), category)
+                    term_count += 1
+        except Exception as e:
+            print(f"タグ辞書の読み込みエラー: {e}")
+        self._trie = trie
+        self.term_count = term_count
+        self.dictionary_path = dictionary_path
+
+    def extract(self, text: str) -> Tuple[List[str], float]:
+        """
+        文章からタグを抽出する
+
+        Args:
+            text (str): 解析する文章
+
+        Returns:
+            Tuple[List[str], float]: 出現順・重複なしのタグと、観点のカバー率（0.0〜1.0）
+        """
+        tags: List[str] = []
+        seen = set()
+        categories = set()
+        trie = self._trie
+        length = len(text)
+        position = 0
+        while position < length:
+            node = trie
+            match: Optional[Tuple[str, str]] = None
+            match_end = position
+            index = position
+            # この位置から始まる最長の語を探す
+            while index < length:
+                node = node.get(text[index])
+                if node is None:
+                    break
+                index += 1
+                if _TERMINAL in node:
+                    match = node[_TERMINAL]
+                    match_end = index
+            if match is None:
+                position += 1
+                continue
+            tag, category = match
+            categories.add(category)
+            if tag not in seen:
+                seen.add(tag)
+                tags.append(tag)
+            position = match_end
+
+        covered = sum(
+            1 for group in COVERAGE_GROUPS.values()
+            if any(category in categories for category in group)
+        )
+        return tags, covered / len(COVERAGE_GROUPS)
@@ -0,0 +1,99 @@
+"""
+感情分類器（文字 n-gram ハッシュ + 線形モデル）の学習スクリプト
+
+ラベル付きコーパスは1行1件の JSON Lines 形式::
+
+    {"text": "今日は本当に楽しかった！", "emotion": "happy"}
+
+emotion には Emotion の値（happy / sad / angry / surprised / neutral / excited / worried / shy）を使う。
+
+使い方::
+
+    python train_emotion_classifier.py corpus.jsonl --output models/emotion_classifier.npz
+
+学習したモデルは設定ページの「感情分析」で分類器を有効にすると使われる。
+"""
+import argparse
+import json
+import random
+import time
+from typing import List, Tuple
+
+from emotion_analyzer import Emotion
+from emotion_classifier import DEFAULT_MODEL_PATH, DEFAULT_N_FEATURES, train_classifier
+
+
+def load_corpus(path: str) -> List[Tuple[str, str]]:
+    """
+    ラベル付きコーパスを読み込む
+
+    Args:
+        path (str): JSON Lines ファイルのパス
+
+    Returns:
+        List[Tuple[str, str]]: (テキスト, 感情の値)
+    """
+    valid_labels = {emotion.value for emotion in Emotion}
+    samples = []
+    with open(path, "r", encoding="utf-8") as fp:
+        for line_number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            label = record.get("emotion")
+            if label not in valid_labels:
+                print(f"{path}:{line_number}: 不明な感情 '{label}' をスキップします")
+                continue
+            samples.append((record.get("text", ""), label))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="感情分類器の学習")
+    parser.add_argument("corpus", help="ラベル付きコーパス（JSON Lines）")
+    parser.add_argument("--output", default=DEFAULT_MODEL_PATH, help="モデルの保存先（.npz）")
+    parser.add_argument("--features", type=int, default=DEFAULT_N_FEATURES, help="ハッシュ特徴量の次元数")
+    parser.add_argument("--ngram-min", type=int, default=1)
+    parser.add_argument("--ngram-max", type=int, default=3)
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--learning-rate", type=float, default=0.5)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--holdout", type=float, default=0.2, help="評価用に取り分ける割合（0で全件学習）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus)
+    if not samples:
+        parser.error("学習データがありません")
+    random.Random(args.seed).shuffle(samples)
+    holdout_count = int(len(samples) * args.holdout)
+    evaluation, training = samples[:holdout_count], samples[holdout_count:]
+
+    label_names = [emotion.value for emotion in Emotion]
+    started = time.time()
+    classifier = train_classifier(
+        [text for text, _ in training],
+        [label for _, label in training],
+        label_names,
+        n_features=args.features,
+        ngram_range=(args.ngram_min, args.ngram_max),
+        epochs=args.epochs,
+        learning_rate=args.learning_rate,
+        l2=args.l2,
+        log_every=max(1, args.epochs // 10),
+    )
+    print(f"学習完了: {len(training)}件, {time.time() - started:.1f}秒")
+
+    if evaluation:
+        probabilities = classifier.predict_proba([text for text, _ in evaluation])
+        predicted = [label_names[column] for column in probabilities.argmax(axis=1)]
+        correct = sum(1 for (_, label), guess in zip(evaluation, predicted) if label == guess)
+        print(f"評価: {correct}/{len(evaluation)} 正解 ({correct / len(evaluation) * 100:.1f}%)")
+
+    classifier.save(args.output)
+    print(f"保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tts")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def audio_cache_key(text: str, voice_id: Optional[str], rate: float, volume: float, engine: str) -> str:
+    """
+    合成結果を決める条件から、キャッシュのキーを作る
+
+    Args:
+        text (str): 読み上げるテキスト
+        voice_id (str): 音声のID（既定の音声なら None）
+        rate (float): 話速
+        volume (float): 音量
+        engine (str): 合成に使うエンジン名
+
+    Returns:
+        str: キー（SHA-1 の16進文字列）
+    """
+    payload = json.dumps(
+        [text, voice_id or "", round(float(rate), 3), round(float(volume), 3), engine],
+        ensure_ascii=False
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        合成済み音声ファイルのディスクキャッシュの初期化
+
+        合計サイズが max_bytes を超えたら、最後に使われたのが古いものから削除する。
+        使用順はファイルの更新時刻で保存するので、再起動後も引き継がれる。
+
+        Args:
+            cache_dir (str): キャッシュディレクトリ
+            max_bytes (int): キャッシュの合計サイズの上限（0で無効）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        # キー -> (パス, サイズ)。先頭ほど最後に使われたのが古い
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._total_bytes = 0
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+        self._scan()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def set_max_bytes(self, max_bytes: int):
+        """
+        上限サイズを変更（超えている分はすぐに削除する）
+
+        Args:
+            max_bytes (int): キャッシュの合計サイズの上限（0で無効）
+        """
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            self._evict()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        キャッシュ済みの音声ファイルを取得
+
+        Args:
+            key (str): audio_cache_key のキー
+
+        Returns:
+            Optional[str]: ファイルのパス（無ければ None）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry[0]):
+                if entry is not None:
+                    self._remove_entry(key)
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+
+    def put(self, key: str, source_path: str) -> str:
+        """
+        合成した音声ファイルをキャッシュへ移す
+
+        Args:
+            key (str): audio_cache_key のキー
+            source_path (str): 合成したファイル（キャッシュへ移動する）
+
+        Returns:
+            str: キャッシュ内のパス（キャッシュが無効なら source_path のまま）
+        """
+        if not self.enabled:
+            return source_path
+        extension = os.path.splitext(source_path)[1] or ".wav"
+        path = os.path.join(self.cache_dir, key[:2], f"{key}{extension}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][1]
+            self._entries[key] = (path, size)
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self.stats["stored"] += 1
+            self._evict(keep=key)
+        return path
+
+    def contains(self, path: str) -> bool:
+        """パスがキャッシュ内のファイルかどうか（再生後に削除してよいかの判定用）"""
+        return os.path.abspath(path).startswith(os.path.abspath(self.cache_dir) + os.sep)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        ヒット数・件数・合計サイズを取得
+
+        Returns:
+            Dict[str, int]: 統計
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._total_bytes
+        return stats
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _scan(self):
+        # 既存のファイルを更新時刻の古い順に読み込む
+        files = []
+        if os.path.isdir(self.cache_dir):
+            for root, _, names in os.walk(self.cache_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        for _, key, path, size in sorted(files):
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _evict(self, keep: Optional[str] = None):
+        # self._lock を保持した状態で呼ぶ
+        while self._entries and self._total_bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            path = self._entries[key][0]
+            self._remove_entry(key)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.stats["evicted"] += 1
+
+    def _remove_entry(self, key: str):
+        path, size = self._entries.pop(key)
+        self._total_bytes -= size
@@ -0,0 +1,452 @@
+import base64
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from tts_cache import AudioCache, audio_cache_key
+from tts_worker import SentenceStream
+
+# ブラウザへ送る音声の出力先（ProcessPoolExecutor の子プロセスが書き出す）
+BROWSER_RENDER_DIR = os.path.join(tempfile.gettempdir(), "ai_chatbot_tts_browser")
+# キャッシュに移されなかった（キャッシュ無効時など）音声ファイルを消すまでの秒数
+BROWSER_RENDER_MAX_AGE = 600
+
+BROWSER_ENGINES = ("gtts", "pyttsx3")
+AUDIO_FORMATS = ("ogg", "mp3")
+AUDIO_MIME_TYPES = {".ogg": "audio/ogg", ".mp3": "audio/mpeg", ".wav": "audio/wav"}
+
+
+def encode_audio(source_path: str, audio_format: str) -> str:
+    """
+    ffmpeg で Opus（OGG）または MP3 に変換する（ffmpeg が無い場合は元のファイルのまま）
+
+    Args:
+        source_path (str): 変換元のファイル
+        audio_format (str): "ogg" または "mp3"
+
+    Returns:
+        str: 変換後のファイルのパス（変換できなければ source_path）
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None or source_path.endswith(f".{audio_format}"):
+        return source_path
+    target_path = f"{os.path.splitext(source_path)[0]}.{audio_format}"
+    codec = ["-c:a", "libopus", "-b:a", "32k"] if audio_format == "ogg" else ["-c:a", "libmp3lame", "-q:a", "6"]
+    try:
+        subprocess.run(
+            [ffmpeg, "-y", "-loglevel", "error", "-i", source_path, *codec, target_path],
+            check=True, timeout=60
+        )
+    except Exception as e:
+        print(f"音声の変換エラー（元の形式で送ります）: {e}")
+        return source_path
+    os.remove(source_path)
+    return target_path
+
+
+def render_to_file(text: str, settings: Dict, engine: str, audio_format: str) -> Optional[str]:
+    """
+    1文を音声ファイルに合成して圧縮する（子プロセスで実行される）
+
+    Args:
+        text (str): 合成するテキスト
+        settings (Dict): 音声設定（rate / volume / voice_id）
+        engine (str): "gtts"（Google のオンライン合成、MP3）または "pyttsx3"（ローカル合成、WAV）
+        audio_format (str): 圧縮形式（"ogg" / "mp3"）
+
+    Returns:
+        Optional[str]: 書き出したファイルのパス（合成できなければ None）
+    """
+    os.makedirs(BROWSER_RENDER_DIR, exist_ok=True)
+    if engine == "gtts":
+        from gtts import gTTS
+        fd, path = tempfile.mkstemp(suffix=".mp3", dir=BROWSER_RENDER_DIR)
+        os.close(fd)
+        # gTTS は話速を「遅い」かどうかしか選べない
+        gTTS(text=text, lang="ja", slow=settings.get("rate", 150) < 120).save(path)
+    else:
+        import pyttsx3
+        fd, path = tempfile.mkstemp(suffix=".wav", dir=BROWSER_RENDER_DIR)
+        os.close(fd)
+        tts_engine = pyttsx3.init()
+        tts_engine.setProperty("rate", settings.get("rate", 150))
+        tts_engine.setProperty("volume", settings.get("volume", 0.9))
+        if settings.get("voice_id"):
+            tts_engine.setProperty("voice", settings["voice_id"])
+        tts_engine.save_to_file(text, path)
+        tts_engine.runAndWait()
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    return encode_audio(path, audio_format)
+
+
+def prune_render_dir(max_age: float = BROWSER_RENDER_MAX_AGE):
+    """
+    BROWSER_RENDER_DIR に残った古い音声ファイルを消す
+
+    Args:
+        max_age (float): この秒数より前に書き出したファイルを消す
+    """
+    cutoff = time.time() - max_age
+    try:
+        for name in os.listdir(BROWSER_RENDER_DIR):
+            path = os.path.join(BROWSER_RENDER_DIR, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    except OSError:
+        pass
+
+
+def audio_data_url(path: str) -> str:
+    """
+    音声ファイルを HTML の audio 要素で再生できる data URL にする
+
+    Args:
+        path (str): 音声ファイルのパス
+
+    Returns:
+        str: data URL
+    """
+    mime_type = AUDIO_MIME_TYPES.get(os.path.splitext(path)[1].lower(), "audio/wav")
+    with open(path, "rb") as fp:
+        return f"data:{mime_type};base64,{base64.b64encode(fp.read()).decode()}"
+
+
+def browser_playlist_html(paths: List[str]) -> str:
+    """
+    音声をページ全体で共有する再生待ちの列に加える HTML（components.html 用）
+
+    要素ごとに再生を始めると重なってしまうため、親ウィンドウに1つの列を作り、順番に再生する。
+    再実行で要素が消えても、列に入った音声は最後まで再生される。
+
+    Args:
+        paths (List[str]): 再生する音声ファイル（この順番で再生する）
+
+    Returns:
+        str: HTML
+    """
+    sources = ",".join(f'"{audio_data_url(path)}"' for path in paths)
+    return f"""
+<script>
+(function() {{
+  const host = window.parent || window;
+  if (!host.__ttsPlaylist) {{
+    host.__ttsPlaylist = {{queue: [], audio: null}};
+    host.__ttsPlaylist.next = function() {{
+      const playlist = host.__ttsPlaylist;
+      if (playlist.audio || playlist.queue.length === 0) return;
+      playlist.audio = new host.Audio(playlist.queue.shift());
+      playlist.audio.onended = playlist.audio.onerror = function() {{
+        playlist.audio = null;
+        playlist.next();
+      }};
+      // 自動再生の制限などで再生できなかった文は飛ばす（残すと次の応答のときに古い文が再生される）
+      playlist.audio.play().catch(function() {{
+        playlist.audio = null;
+        playlist.next();
+      }});
+    }};
+  }}
+  host.__ttsPlaylist.queue.push({sources});
+  host.__ttsPlaylist.next();
+}})();
+</script>
+"""
+
+
+def browser_stop_html() -> str:
+    """
+    browser_playlist_html の再生待ちの列を空にし、再生中の音声を止める HTML（components.html 用）
+
+    Returns:
+        str: HTML
+    """
+    return """
+<script>
+(function() {
+  const host = window.parent || window;
+  const playlist = host.__ttsPlaylist;
+  if (!playlist) return;
+  playlist.queue.length = 0;
+  if (playlist.audio) {
+    playlist.audio.onended = playlist.audio.onerror = null;
+    playlist.audio.pause();
+    playlist.audio = null;
+  }
+})();
+</script>
+"""
+
+
+class BrowserSpeech:
+    def __init__(self, renderer: "BrowserSpeechRenderer", settings: Dict):
+        """
+        ストリーミングで届く応答を文ごとに合成し、合成できた順に取り出すクラスの初期化
+
+        Args:
+            renderer (BrowserSpeechRenderer): 合成に使うレンダラー
+            settings (Dict): 投入時点の音声設定
+        """
+        self.renderer = renderer
+        self.settings = dict(settings)
+        self._sentences = SentenceStream()
+        self._futures: List[Future] = []
+        self._delivered = 0
+        self._finished = False
+        self.cancelled = False
+        # 取り出し済みの音声ファイル（会話履歴に残して再生ボタンを出す）
+        self.audio_paths: List[str] = []
+
+    def feed(self, chunk: str):
+        """
+        応答の続きを追加（文末まで揃った文から合成を始める）
+
+        Args:
+            chunk (str): 新しく届いたテキスト
+        """
+        for sentence in self._sentences.feed(chunk):
+            self._submit(sentence)
+
+    def finish(self):
+        """
+        応答の終わりとして、残りのテキストも合成に回す
+        """
+        for sentence in self._sentences.flush():
+            self._submit(sentence)
+        self._finished = True
+
+    @property
+    def done(self) -> bool:
+        """応答の終わりまで音声を取り出し終えた（または取り消された）場合True"""
+        return self.cancelled or (self._finished and self._delivered >= len(self._futures))
+
+    def cancel(self) -> int:
+        """
+        この応答の読み上げを取り消す（まだ始まっていない合成は行わず、以降に届く文も合成しない）
+
+        Returns:
+            int: 取り消した文の数
+        """
+        self.cancelled = True
+        return sum(1 for future in self._futures[self._delivered:] if future.cancel())
+
+    def _submit(self, sentence: str):
+        if not self.cancelled:
+            self._futures.append(self.renderer.submit(sentence, self.settings))
+
+    def ready_audio(self) -> List[str]:
+        """
+        合成が終わった音声を、応答中の順番を崩さない範囲で取り出す（待たない）
+
+        Returns:
+            List[str]: 新たに取り出せた音声ファイル
+        """
+        ready: List[str] = []
+        while not self.cancelled and self._delivered < len(self._futures) and self._futures[self._delivered].done():
+            ready.extend(self._take(self._futures[self._delivered]))
+            self._delivered += 1
+        return ready
+
+    def wait_audio(self, timeout: float = 30.0) -> Iterator[List[str]]:
+        """
+        残りの音声を、合成が終わるたびに順番に取り出す
+
+        Args:
+            timeout (float): 1文あたりの最大待ち時間（秒）
+
+        Yields:
+            List[str]: 取り出せた音声ファイル（合成に失敗した文は空）
+        """
+        while not self.cancelled and self._delivered < len(self._futures):
+            future = self._futures[self._delivered]
+            try:
+                future.result(timeout=timeout)
+            except FutureTimeoutError:
+                print("音声の合成が時間内に終わりませんでした")
+                future.cancel()
+            except Exception:
+                pass
+            self._delivered += 1
+            yield self._take(future)
+
+    def _take(self, future: Future) -> List[str]:
+        if future.cancelled():
+            return []
+        try:
+            path = future.result(timeout=0)
+        except Exception as e:
+            print(f"音声の合成エラー: {e}")
+            return []
+        if not path:
+            return []
+        self.audio_paths.append(path)
+        return [path]
+
+
+class BrowserSpeechRenderer:
+    def __init__(self, audio_cache: AudioCache, engine: str = "gtts", audio_format: str = "ogg",
+                 processes: int = 2):
+        """
+        ブラウザで再生する音声を、別プロセスで合成・圧縮するクラスの初期化
+
+        Streamlit のプロセスは音声の合成・再生で止まらず、サーバーに音声デバイスが無くても使える。
+        合成済みの文は音声キャッシュから返す。
+
+        Args:
+            audio_cache (AudioCache): 音声キャッシュ
+            engine (str): 合成エンジン（BROWSER_ENGINES のいずれか）
+            audio_format (str): 圧縮形式（AUDIO_FORMATS のいずれか）
+            processes (int): 合成に使うプロセス数
+        """
+        self.audio_cache = audio_cache
+        self.engine = engine if engine in BROWSER_ENGINES else "gtts"
+        self.audio_format = audio_format if audio_format in AUDIO_FORMATS else "ogg"
+        self.processes = max(1, int(processes))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        # 合成中の応答（cancel_all で取り消す）
+        self._speeches: "weakref.WeakSet[BrowserSpeech]" = weakref.WeakSet()
+        # 事前合成の待ち行列（プロセスを1つだけ使い、1件ずつ合成する）と合成中の1件
+        self._prerender_queue: Deque[Tuple[str, Dict]] = deque()
+        self._prerendering: Optional[Future] = None
+
+    def configure(self, engine: Optional[str] = None, audio_format: Optional[str] = None,
+                  processes: Optional[int] = None):
+        """
+        合成エンジン・圧縮形式・プロセス数を変更（プロセス数が変わったらプールを作り直す）
+        """
+        if engine in BROWSER_ENGINES:
+            self.engine = engine
+        if audio_format in AUDIO_FORMATS:
+            self.audio_format = audio_format
+        if processes is not None and max(1, int(processes)) != self.processes:
+            with self._lock:
+                self.processes = max(1, int(processes))
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False, cancel_futures=True)
+                    self._pool = None
+
+    def is_available(self) -> bool:
+        """選択中の合成エンジンのパッケージがインストールされているか"""
+        import importlib.util
+        return importlib.util.find_spec(self.engine) is not None
+
+    def start_speech(self, settings: Dict) -> BrowserSpeech:
+        """
+        応答1件分の合成を開始
+
+        Args:
+            settings (Dict): 音声設定
+
+        Returns:
+            BrowserSpeech: feed / finish でテキストを渡し、ready_audio / wait_audio で音声を受け取る
+        """
+        prune_render_dir()
+        speech = BrowserSpeech(self, settings)
+        with self._lock:
+            self._speeches.add(speech)
+        return speech
+
+    def cancel_all(self) -> int:
+        """
+        合成中のすべての応答と、残りの事前合成を取り消す
+
+        Returns:
+            int: 取り消した文の数（事前合成は数えない）
+        """
+        with self._lock:
+            speeches = list(self._speeches)
+            self._speeches.clear()
+            self._prerender_queue.clear()
+            prerendering = self._prerendering
+        if prerendering is not None:
+            prerendering.cancel()
+        return sum(speech.cancel() for speech in speeches)
+
+    def prerender(self, text: str, settings: Dict):
+        """
+        1文をキャッシュへ事前に合成する（応答の合成にプロセスを空けておくため、1件ずつ順に合成する）
+
+        Args:
+            text (str): 合成するテキスト
+            settings (Dict): 音声設定
+        """
+        with self._lock:
+            self._prerender_queue.append((text, dict(settings)))
+        self._next_prerender()
+
+    def _next_prerender(self, _: Optional[Future] = None):
+        with self._lock:
+            if (self._prerendering is not None and not self._prerendering.done()) or not self._prerender_queue:
+                return
+            text, settings = self._prerender_queue.popleft()
+            # submit は self._lock を使うので、投入までは仮の Future で合成中にしておく
+            placeholder: Future = Future()
+            self._prerendering = placeholder
+        future = self.submit(text, settings)
+        with self._lock:
+            if placeholder.cancelled():
+                # 投入している間に cancel_all で取り消された
+                future.cancel()
+            elif self._prerendering is placeholder:
+                self._prerendering = future
+        future.add_done_callback(self._next_prerender)
+
+    def submit(self, text: str, settings: Dict) -> Future:
+        """
+        1文の合成を予約（キャッシュにあればすぐに完了する）
+
+        Args:
+            text (str): 合成するテキスト
+            settings (Dict): 音声設定
+
+        Returns:
+            Future: 音声ファイルのパス（合成できなければ None）
+        """
+        key = audio_cache_key(
+            text, settings.get("voice_id"), settings.get("rate", 150), settings.get("volume", 0.9),
+            f"{self.engine}.{self.audio_format}"
+        )
+        cached = self.audio_cache.get(key)
+        if cached:
+            future: Future = Future()
+            future.set_result(cached)
+            return future
+
+        with self._lock:
+            if self._pool is None:
+                # スレッドを多数抱えた Streamlit のプロセスを fork すると子プロセスが固まることがあるため spawn で起動する
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")
+                )
+            rendered = self._pool.submit(render_to_file, text, dict(settings), self.engine, self.audio_format)
+
+        result: Future = Future()
+
+        def store(done: Future):
+            # 待つのをやめた（キャンセルされた）文も、合成できていればキャッシュには入れておく
+            if done.cancelled():
+                result.cancel()
+                return
+            try:
+                path = done.result()
+                stored = self.audio_cache.put(key, path) if path else None
+            except Exception as e:
+                if result.set_running_or_notify_cancel():
+                    result.set_exception(e)
+                return
+            if result.set_running_or_notify_cancel():
+                result.set_result(stored)
+
+        rendered.add_done_callback(store)
+        # 結果を待つ側が取り消したら、まだ始まっていない合成も取り消す
+        result.add_done_callback(lambda done: rendered.cancel() if done.cancelled() else None)
+        return result
@@ -0,0 +1,478 @@
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# キューが満杯・新しい発話が来たときの扱い
+POLICY_DROP_OLDEST = "drop_oldest"          # 満杯なら最も古い待機中の発話を捨てる
+POLICY_REPLACE_PENDING = "replace_pending"  # 待機中の発話をすべて新しい発話で置き換える（再生中はそのまま）
+POLICY_INTERRUPT = "interrupt"              # 待機中の発話を捨て、再生中の発話も中断する
+QUEUE_POLICIES = (POLICY_DROP_OLDEST, POLICY_REPLACE_PENDING, POLICY_INTERRUPT)
+
+# 文の区切り（この文字の並びの後に閉じ括弧が続けば、それも含めて1文とする）
+SENTENCE_TERMINATORS = "。．！？!?\n"
+SENTENCE_CLOSERS = "」』）)】"
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    テキストを読み上げ単位の文に分割
+
+    Args:
+        text (str): 分割するテキスト
+
+    Returns:
+        List[str]: 文のリスト（空白だけの文は除く）
+    """
+    stream = SentenceStream()
+    return stream.feed(text) + stream.flush()
+
+
+class SentenceStream:
+    def __init__(self):
+        """
+        少しずつ届くテキストから、文末まで揃った文を順に取り出すクラスの初期化
+        """
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        テキストの続きを追加
+
+        文末記号の直後は、続く文字（閉じ括弧や連続する記号）が届くまで確定しない。
+
+        Args:
+            chunk (str): 新しく届いたテキスト
+
+        Returns:
+            List[str]: 新たに確定した文
+        """
+        self._buffer += chunk
+        sentences: List[str] = []
+        start = 0
+        index = 0
+        length = len(self._buffer)
+        while index < length:
+            if self._buffer[index] not in SENTENCE_TERMINATORS:
+                index += 1
+                continue
+            end = index + 1
+            while end < length and self._buffer[end] in SENTENCE_TERMINATORS + SENTENCE_CLOSERS:
+                end += 1
+            if end == length:
+                # 文末記号の続きがまだ届いていない
+                break
+            sentence = self._buffer[start:end].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = index = end
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        """
+        残っているテキストを最後の文として取り出す
+
+        Returns:
+            List[str]: 残りの文（無ければ空）
+        """
+        sentence = self._buffer.strip()
+        self._buffer = ""
+        return [sentence] if sentence else []
+
+
+class Utterance:
+    """読み上げキューに投入された1件の発話"""
+
+    def __init__(self, text: str, settings: Dict, seq: int, group: int, group_started_at: Optional[float] = None):
+        """
+        Args:
+            text (str): 読み上げるテキスト
+            settings (Dict): 投入時点の音声設定（rate / volume / voice_id など）
+            seq (int): 投入順の通し番号
+            group (int): 同じ応答の文をまとめる番号（キュー方針は応答単位で適用する）
+            group_started_at (float): 応答の最初の文を投入した時刻（省略時はこの発話が応答の最初の文）
+        """
+        self.text = text
+        self.settings = settings
+        self.seq = seq
+        self.group = group
+        self.submitted_at = time.time()
+        self.first_in_group = group_started_at is None
+        self.group_started_at = self.submitted_at if group_started_at is None else group_started_at
+        # 先読みで合成した音声（render の戻り値。合成しない場合は None）
+        self.audio: Any = None
+        self._rendered: Optional[Future] = None
+        # 読み上げ結果（最後まで読み上げたら True、中断されたら False。開始前に捨てられたらキャンセル）
+        self.future: Future = Future()
+        # 中断要求（読み上げ処理は待機中にこれを確認して早めに切り上げる）
+        self.cancelled = threading.Event()
+        self.started_at: Optional[float] = None
+
+
+class TTSWorker:
+    def __init__(self, speak: Callable[[Utterance], None], stop: Optional[Callable[[], None]] = None,
+                 max_queue: int = 4, policy: str = POLICY_DROP_OLDEST,
+                 render: Optional[Callable[[Utterance], Any]] = None):
+        """
+        音声エンジンを専有する1本の読み上げスレッドと、上限付きの発話キューの初期化
+
+        スレッドは最初の発話の投入時に起動し、以降は同じスレッドですべての発話を順に読み上げる。
+        render を渡すと、発話 N を再生している間に合成用のスレッドで発話 N+1 を先に合成しておく。
+
+        Args:
+            speak (Callable[[Utterance], None]): 1件を読み上げる処理（読み上げスレッドで呼ばれる。合成済みなら utterance.audio を再生する）
+            stop (Callable[[], None]): 再生中の読み上げを止める処理（中断時に呼ばれる）
+            max_queue (int): 待機できる応答の最大数（同じ応答の文は1件と数える）
+            policy (str): 既定のキュー方針（QUEUE_POLICIES のいずれか）
+            render (Callable[[Utterance], Any]): 1件を音声データに合成する処理（合成用のスレッドで呼ばれる）
+        """
+        self._speak = speak
+        self._stop = stop
+        self._render = render
+        self._render_executor: Optional[ThreadPoolExecutor] = None
+        # 合成用のスレッドに投入済みで終わっていない合成の数と、空いたときだけ合成する事前合成の待ち行列
+        self._render_inflight = 0
+        self._background: Deque[Utterance] = deque()
+        # 読み上げる発話を先に合成するか（合成したファイルを再生できない環境では止める）
+        self.prefetch = render is not None
+        # 応答の番号は1から順に払い出し、_superseded_before より小さい番号の応答は読み上げない
+        self._next_group = 1
+        self._superseded_before = 0
+        self._last_group: Optional[int] = None
+        self._last_group_started_at = 0.0
+        self.max_queue = max(1, int(max_queue))
+        self.policy = policy if policy in QUEUE_POLICIES else POLICY_DROP_OLDEST
+        self._pending: Deque[Utterance] = deque()
+        self._current: Optional[Utterance] = None
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, float] = {
+            "submitted": 0,
+            "spoken": 0,
+            "dropped": 0,
+            "replaced": 0,
+            "interrupted": 0,
+            "failed": 0,
+            "superseded": 0,
+            # 投入から読み上げ開始までの待ち時間と、1件の読み上げ（合成＋再生）にかかった時間
+            "last_wait_ms": 0.0,
+            "total_wait_ms": 0.0,
+            "last_speak_ms": 0.0,
+            "total_speak_ms": 0.0,
+            # 応答の最初の文を投入してから、その音声が鳴り始めるまでの時間
+            "last_first_audio_ms": 0.0,
+        }
+
+    def configure(self, max_queue: Optional[int] = None, policy: Optional[str] = None,
+                  prefetch: Optional[bool] = None):
+        """
+        キューの上限と既定の方針を変更
+
+        Args:
+            max_queue (int): 待機できる発話の最大数
+            policy (str): 既定のキュー方針
+            prefetch (bool): 読み上げる発話を合成用のスレッドで先に合成するか（render() には影響しない）
+        """
+        with self._cond:
+            if prefetch is not None:
+                self.prefetch = bool(prefetch) and self._render is not None
+            if max_queue is not None:
+                self.max_queue = max(1, int(max_queue))
+                pending_groups = list(dict.fromkeys(pending.group for pending in self._pending))
+                while len(pending_groups) > self.max_queue:
+                    self._discard_group(pending_groups.pop(0), "dropped")
+            if policy in QUEUE_POLICIES:
+                self.policy = policy
+
+    def new_group(self) -> int:
+        """
+        応答1件分の番号を払い出す（同じ番号で投入した文は1つの応答として扱う）
+
+        Returns:
+            int: 応答の番号
+        """
+        with self._cond:
+            group = self._next_group
+            self._next_group += 1
+        return group
+
+    def supersede(self) -> int:
+        """
+        これまでに払い出したすべての応答を古いものとし、以降に届く文も読み上げないようにする
+
+        待機中の発話を捨て、再生中の発話も中断する。
+
+        Returns:
+            int: 捨てた・中断した発話の数
+        """
+        return self.cancel_all(interrupt=True)
+
+    def is_superseded(self, group: int) -> bool:
+        """応答が新しい応答や停止操作で古くなっている場合True"""
+        with self._cond:
+            return group < self._superseded_before
+
+    def submit(self, text: str, settings: Optional[Dict] = None, policy: Optional[str] = None,
+               group: Optional[int] = None) -> Future:
+        """
+        発話をキューに投入
+
+        直前に投入した発話と同じ group の場合は応答の続きとして末尾に加え、キュー方針は適用しない。
+
+        Args:
+            text (str): 読み上げるテキスト
+            settings (Dict): 音声設定（投入時点の値を読み上げに使う）
+            policy (str): この発話に使うキュー方針（省略時は既定の方針）
+            group (int): 応答の番号（new_group で取得。省略時は1件で1つの応答）
+
+        Returns:
+            Future: 読み上げ結果（開始前に捨てられた場合はキャンセル）
+        """
+        if group is None:
+            group = self.new_group()
+        policy = policy if policy in QUEUE_POLICIES else self.policy
+        interrupted = False
+        with self._cond:
+            self.stats["submitted"] += 1
+            if group < self._superseded_before:
+                # 古くなった応答の続きは合成も再生もしない
+                self.stats["superseded"] += 1
+                future: Future = Future()
+                future.cancel()
+                return future
+            first_in_group = group != self._last_group
+            if first_in_group:
+                if policy == POLICY_DROP_OLDEST:
+                    pending_groups = list(dict.fromkeys(pending.group for pending in self._pending))
+                    while len(pending_groups) >= self.max_queue:
+                        self._discard_group(pending_groups.pop(0), "dropped")
+                else:
+                    # 置き換えられた応答は、まだ届いていない文も含めて読み上げない
+                    self._superseded_before = max(self._superseded_before, group)
+                    while self._pending:
+                        self._discard(self._pending.popleft(), "replaced")
+                    if policy == POLICY_INTERRUPT and self._current is not None and not self._current.cancelled.is_set():
+                        self._current.cancelled.set()
+                        self.stats["interrupted"] += 1
+                        interrupted = True
+            utterance = Utterance(
+                text, dict(settings or {}), next(self._seq), group,
+                None if first_in_group else self._last_group_started_at
+            )
+            self._last_group = group
+            self._last_group_started_at = utterance.group_started_at
+            self._pending.append(utterance)
+            # 再生中に次の発話が届いた場合は、すぐに先読みの合成を始める
+            if self.prefetch and self._current is not None and self._pending[0] is utterance:
+                self._start_render(utterance)
+            self._ensure_thread()
+            self._cond.notify()
+        if interrupted:
+            self._request_stop()
+        return utterance.future
+
+    def render(self, text: str, settings: Optional[Dict] = None, background: bool = False) -> Future:
+        """
+        読み上げずに合成だけを合成用のスレッドで行う（事前合成やファイル保存用）
+
+        Args:
+            text (str): 合成するテキスト
+            settings (Dict): 音声設定
+            background (bool): 読み上げ用の合成が無いときだけ1件ずつ合成する場合True（事前合成用）。
+                cancel_all(interrupt=True) で取り消される
+
+        Returns:
+            Future: render の戻り値（合成処理が無い場合は None）
+        """
+        if self._render is None:
+            future: Future = Future()
+            future.set_result(None)
+            return future
+        utterance = Utterance(text, dict(settings or {}), next(self._seq), 0)
+        with self._cond:
+            if not background:
+                return self._start_render(utterance)
+            self._background.append(utterance)
+            self._pump_background()
+            return utterance.future
+
+    def cancel_all(self, interrupt: bool = True) -> int:
+        """
+        待機中の発話を捨てる
+
+        Args:
+            interrupt (bool): 再生中の発話も中断し、これまでの応答の続きも読み上げないようにする場合True
+
+        Returns:
+            int: 捨てた・中断した発話の数
+        """
+        interrupted = False
+        with self._cond:
+            if interrupt:
+                self._superseded_before = self._next_group
+                while self._background:
+                    self._background.popleft().future.cancel()
+            count = len(self._pending)
+            while self._pending:
+                self._discard(self._pending.popleft(), "dropped")
+            if interrupt and self._current is not None and not self._current.cancelled.is_set():
+                self._current.cancelled.set()
+                self.stats["interrupted"] += 1
+                interrupted = True
+                count += 1
+        if interrupted:
+            self._request_stop()
+        return count
+
+    @property
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def is_busy(self) -> bool:
+        """読み上げ中、または待機中の発話がある場合True"""
+        with self._cond:
+            return self._current is not None or bool(self._pending)
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        キューの深さと待ち時間・読み上げ時間の統計を取得
+
+        Returns:
+            Dict[str, float]: 件数と、平均・直近の時間（ミリ秒）
+        """
+        with self._cond:
+            stats = dict(self.stats)
+            stats["queue_depth"] = len(self._pending)
+            stats["speaking"] = self._current is not None
+        started = stats["spoken"] + stats["failed"]
+        stats["avg_wait_ms"] = stats["total_wait_ms"] / started if started else 0.0
+        stats["avg_speak_ms"] = stats["total_speak_ms"] / started if started else 0.0
+        return stats
+
+    # ------------------------------------------------------------------
+    # internal helpers
+    # ------------------------------------------------------------------
+    def _ensure_thread(self):
+        # self._cond を保持した状態で呼ぶ
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker_loop, name="tts-worker", daemon=True)
+            self._thread.start()
+
+    def _discard(self, utterance: Utterance, reason: str):
+        utterance.cancelled.set()
+        utterance.future.cancel()
+        if utterance._rendered is not None:
+            utterance._rendered.cancel()
+        self.stats[reason] += 1
+
+    def _discard_group(self, group: int, reason: str):
+        # self._cond を保持した状態で呼ぶ
+        kept: Deque[Utterance] = deque()
+        for utterance in self._pending:
+            if utterance.group == group:
+                self._discard(utterance, reason)
+            else:
+                kept.append(utterance)
+        self._pending = kept
+
+    def _start_render(self, utterance: Utterance) -> Optional[Future]:
+        # 合成用のスレッドで合成を始める（開始済みなら何もしない）
+        if self._render is None:
+            return None
+        if utterance._rendered is None:
+            if self._render_executor is None:
+                self._render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-render")
+            self._render_inflight += 1
+            utterance._rendered = self._render_executor.submit(self._render, utterance)
+            utterance._rendered.add_done_callback(self._render_done)
+        return utterance._rendered
+
+    def _render_done(self, _: Future):
+        with self._cond:
+            self._render_inflight -= 1
+            self._pump_background()
+
+    def _pump_background(self):
+        # self._cond を保持した状態で呼ぶ。合成用のスレッドが空いていれば事前合成を1件だけ投入する
+        while self._render_inflight == 0 and self._background:
+            utterance = self._background.popleft()
+            if not utterance.future.set_running_or_notify_cancel():
+                continue
+            self._start_render(utterance).add_done_callback(
+                lambda done, result=utterance.future: self._resolve_background(done, result)
+            )
+
+    @staticmethod
+    def _resolve_background(done: Future, result: Future):
+        if done.cancelled():
+            result.set_result(None)
+        elif done.exception() is not None:
+            result.set_exception(done.exception())
+        else:
+            result.set_result(done.result())
+
+    def _request_stop(self):
+        if self._stop is None:
+            return
+        try:
+            self._stop()
+        except Exception as e:
+            print(f"音声停止エラー（無視）: {e}")
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                utterance = self._pending.popleft()
+                if utterance.group < self._superseded_before:
+                    self._discard(utterance, "superseded")
+                    continue
+                self._current = utterance
+                rendered = self._start_render(utterance) if self.prefetch else None
+                # 再生している間に次の発話を合成しておく
+                if self.prefetch and self._pending:
+                    self._start_render(self._pending[0])
+            if not utterance.future.set_running_or_notify_cancel():
+                with self._cond:
+                    self._current = None
+                continue
+
+            failed = False
+            if rendered is not None:
+                try:
+                    utterance.audio = rendered.result()
+                except Exception as e:
+                    # 合成に失敗した場合は speak 側で直接読み上げる
+                    print(f"音声合成エラー: {e}")
+            if utterance.cancelled.is_set():
+                # 合成中に中断・取り消しされた（cancel_all / submit で interrupted として数え済み）。
+                # 読み上げていないので、読み上げ件数や待ち時間・読み上げ時間の統計には含めない
+                with self._cond:
+                    self._current = None
+                utterance.future.set_result(False)
+                continue
+            utterance.started_at = time.time()
+            wait_ms = (utterance.started_at - utterance.submitted_at) * 1000.0
+            try:
+                self._speak(utterance)
+            except Exception as e:
+                failed = True
+                print(f"音声読み上げエラー（安全に無視）: {e}")
+            speak_ms = (time.time() - utterance.started_at) * 1000.0
+
+            with self._cond:
+                self._current = None
+                self.stats["failed" if failed else "spoken"] += 1
+                self.stats["last_wait_ms"] = wait_ms
+                self.stats["total_wait_ms"] += wait_ms
+                self.stats["last_speak_ms"] = speak_ms
+                self.stats["total_speak_ms"] += speak_ms
+                if utterance.first_in_group:
+                    self.stats["last_first_audio_ms"] = (utterance.started_at - utterance.group_started_at) * 1000.0
+            utterance.future.set_result(not failed and not utterance.cancelled.is_set())
@@ -1,25 +1,210 @@
-import pyttsx3
 import threading
 import tempfile
 import os
-from typing import Dict, Optional
+from concurrent.futures import Future
+from typing import Dict, Iterator, List, Optional, Union
 import streamlit as st
 import time
 import requests
-import pygame
+import shutil
+import wave
+
+from tts_cache import AudioCache, audio_cache_key
+from tts_renderer import BrowserSpeech, BrowserSpeechRenderer, browser_stop_html
+from tts_worker import POLICY_DROP_OLDEST, SentenceStream, TTSWorker, Utterance, split_sentences
+
+# 先読みで合成した音声ファイルの置き場所と、再生されずに残ったファイルを消すまでの秒数
+RENDER_DIR = os.path.join(tempfile.gettempdir(), "ai_chatbot_tts")
+RENDER_MAX_AGE = 600
+
+# SpVoice.Speak のフラグ（SVSFlagsAsync / SVSFPurgeBeforeSpeak）
+SAPI_FLAGS_ASYNC = 1
+SAPI_FLAGS_PURGE_BEFORE_SPEAK = 2
+
+
+class SpeechStream:
+    def __init__(self, voice_manager: "VoiceManager", policy: Optional[str] = None):
+        """
+        ストリーミングで届く応答を、文が揃うたびに読み上げキューへ送るクラスの初期化
+        
+        Args:
+            voice_manager (VoiceManager): 読み上げに使う音声管理
+            policy (str): 応答の最初の文に使うキュー方針（省略時は設定値）
+        """
+        self.voice_manager = voice_manager
+        self.policy = policy
+        self.group = voice_manager._worker.new_group()
+        self._sentences = SentenceStream()
+        self.futures = []
+    
+    def feed(self, chunk: str):
+        """
+        応答の続きを追加（文末まで揃った文から読み上げを始める）
+        
+        Args:
+            chunk (str): 新しく届いたテキスト
+        """
+        for sentence in self._sentences.feed(chunk):
+            self._submit(sentence)
+    
+    def finish(self):
+        """
+        応答の終わりとして、残りのテキストも読み上げる
+        """
+        for sentence in self._sentences.flush():
+            self._submit(sentence)
+    
+    def _submit(self, sentence: str):
+        future = self.voice_manager._worker.submit(
+            sentence, self.voice_manager.voice_settings, self.policy, self.group
+        )
+        self.futures.append(future)
+    
+    # ブラウザ再生（BrowserSpeech）と同じ呼び出し方にそろえるためのメソッド（サーバー再生では渡す音声が無い）
+    def ready_audio(self) -> List[str]:
+        return []
+    
+    def wait_audio(self, timeout: float = 30.0) -> Iterator[List[str]]:
+        return iter(())
+    
+    @property
+    def audio_paths(self) -> List[str]:
+        return []
+    
+    @property
+    def done(self) -> bool:
+        return True
 
 class VoiceManager:
-    def __init__(self):
+    def __init__(self, discover: bool = False):
         """
         音声管理クラスの初期化（複数エンジン対応）
+        
+        音声エンジンの検出（SAPI の確認や pyttsx3 の初期化）は時間がかかり、
+        音声を使わない場合は不要なので、初回の有効化時（ensure_ready）か
+        start_discovery でバックグラウンドに回すまで行わない。
+        
+        Args:
+            discover (bool): True ならすぐにバックグラウンドで検出を始める
         """
         self.engine = None
-        self.voice_settings = {}
-        self.is_speaking = False  # 音声再生中フラグを追加
+        # 読み上げに使う音声設定（エンジンは読み上げスレッドだけが触り、発話ごとにこの値を適用する）
+        self.voice_settings = {"rate": 150, "volume": 0.9, "voice_id": None}
         self.windows_sapi_available = False  # Windows SAPI利用可能フラグ
         self.gemini_api_key = None  # Gemini APIキー
         self.available_engines = []  # 利用可能なエンジンリスト
-        self.initialize_engine()
+        self.available_voices = []
+        # エンジン検出の完了を通知する Future（結果は利用可能かどうか）
+        self.ready: Future = Future()
+        self._discovery_lock = threading.Lock()
+        self._discovery_thread: Optional[threading.Thread] = None
+        # 検出前に指定されたキャラクターの音声設定（検出後に適用する）
+        self._pending_character: Optional[Dict] = None
+        # 音声エンジンを専有する読み上げスレッド（最初の発話で起動する）
+        # 文単位に分けた発話を、再生中に次の文を合成しながら順に読み上げる
+        # 中断は読み上げスレッドが発話の cancelled を見て自分で止める（他のスレッドからエンジンに触らない）
+        self._worker = TTSWorker(
+            self._speak_utterance, max_queue=4, policy=POLICY_DROP_OLDEST,
+            render=self._render_utterance
+        )
+        # 読み上げ・合成スレッド内で作る Windows SAPI のオブジェクト（COM はスレッドに紐づくため）
+        self._sapi_speaker = None
+        self._sapi_renderer = None
+        # 合成スレッド専用の pyttsx3 エンジン（self.engine は読み上げスレッドだけが使う）
+        self._render_engine = None
+        self._mixer = None
+        self._mixer_init_tried = False
+        # 合成済みファイルを再生できるか（None: 未確認。再生できないと分かったら先読みの合成をやめる）
+        self._file_playback_available: Optional[bool] = None
+        # 合成済み音声のキャッシュ（テキスト・音声・話速・音量・エンジンが同じなら再合成しない）
+        self.audio_cache = AudioCache()
+        # 出力先: "speaker"（サーバーの音声デバイス）または "browser"（別プロセスで合成してブラウザで再生）
+        self.output_mode = "speaker"
+        self.browser_renderer = BrowserSpeechRenderer(self.audio_cache)
+        if discover:
+            self.start_discovery()
+    
+    def start_discovery(self) -> Future:
+        """
+        音声エンジンの検出をバックグラウンドで開始（2回目以降は何もしない）
+        
+        Returns:
+            Future: 検出の完了を待つための Future（結果は is_available() の値）
+        """
+        with self._discovery_lock:
+            if self._discovery_thread is None:
+                self._discovery_thread = threading.Thread(
+                    target=self._discover, name="voice-discovery", daemon=True
+                )
+                self._discovery_thread.start()
+        return self.ready
+    
+    def _discover(self):
+        try:
+            self.initialize_engine()
+        except Exception as e:
+            print(f"音声エンジンの検出エラー: {e}")
+        # 完了の通知と保留中のキャラクターの取り出しを同じロックで行い、
+        # set_character_voice が間に入って設定が取り残されないようにする
+        with self._discovery_lock:
+            self.ready.set_result(self.is_available())
+            pending, self._pending_character = self._pending_character, None
+        if pending is not None:
+            self.set_character_voice(pending)
+    
+    def ensure_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        音声エンジンの検出を（未開始なら開始して）完了まで待つ
+        
+        Args:
+            timeout (float): 待つ最大秒数（None なら完了まで待つ）
+            
+        Returns:
+            bool: 音声機能が利用可能かどうか（時間内に終わらなければ False）
+        """
+        future = self.start_discovery()
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return False
+    
+    def is_ready(self) -> bool:
+        """
+        音声エンジンの検出が完了しているかチェック
+        
+        Returns:
+            bool: 検出済みかどうか
+        """
+        return self.ready.done()
+    
+    def apply_config(self, settings: Dict):
+        """
+        ConfigManager の "voice" セクションから読み上げキューと音声キャッシュの設定を反映
+        
+        Args:
+            settings (Dict): "queue_size" / "queue_policy" / "cache_max_mb" などを含む設定
+        """
+        self._worker.configure(settings.get("queue_size"), settings.get("queue_policy"))
+        self.output_mode = "browser" if settings.get("output") == "browser" else "speaker"
+        self.browser_renderer.configure(
+            settings.get("browser_engine"), settings.get("browser_format"), settings.get("render_processes")
+        )
+        if settings.get("cache_max_mb") is not None:
+            self.audio_cache.set_max_bytes(float(settings["cache_max_mb"]) * 1024 * 1024)
+    
+    @property
+    def is_speaking(self) -> bool:
+        """読み上げ中、または読み上げ待ちの発話がある場合True"""
+        return self._worker.is_busy()
+    
+    def get_queue_stats(self) -> Dict:
+        """
+        読み上げキューの深さと待ち時間・読み上げ時間の統計を取得
+        
+        Returns:
+            Dict: TTSWorker.get_stats の結果
+        """
+        return self._worker.get_stats()
     
     def set_gemini_api_key(self, api_key: str):
         """
@@ -52,6 +237,17 @@ class VoiceManager:
                 self.windows_sapi_available = False
             
             # pyttsx3エンジンの初期化（設定管理用）
+            try:
+                import pyttsx3
+            except ImportError as import_error:
+                # パッケージが無い場合は再試行しても変わらないので、すぐに諦める
+                print(f"pyttsx3 を読み込めません: {import_error}")
+                self.engine = None
+                self.available_voices = []
+                if not self.windows_sapi_available:
+                    print("音声機能は無効になります（チャット機能は正常に動作します）")
+                return
+            
             for attempt in range(3):
                 try:
                     self.engine = pyttsx3.init()
@@ -106,20 +302,25 @@ class VoiceManager:
         Args:
             character_data (Dict): キャラクターデータ
         """
-        if not self.engine:
-            return
-            
         try:
             # キャラクターの音声設定を取得
             voice_settings = character_data.get('voice_settings', {})
             
             # 音声速度設定（安全な範囲に制限）
             rate = max(100, min(300, voice_settings.get('rate', 150)))
-            self.engine.setProperty('rate', rate)
+            self.voice_settings['rate'] = rate
             
             # 音量設定（安全な範囲に制限）
             volume = max(0.0, min(1.0, voice_settings.get('volume', 0.9)))
-            self.engine.setProperty('volume', volume)
+            self.voice_settings['volume'] = volume
+            
+            with self._discovery_lock:
+                if not self.is_ready():
+                    # 音声の種類は検出が終わったら適用する
+                    self._pending_character = character_data
+                    return
+            if not self.engine:
+                return
             
             # 音声の性別/種類設定（エラーハンドリング強化）
             voice_type = voice_settings.get('voice_type', 'female')
@@ -143,102 +344,332 @@ class VoiceManager:
             for voice in self.available_voices:
                 voice_name = voice.name.lower()
                 if voice_type == 'female' and any(keyword in voice_name for keyword in ['female', 'woman', 'zira', 'hazel']):
-                    self.engine.setProperty('voice', voice.id)
+                    self.voice_settings['voice_id'] = voice.id
                     break
                 elif voice_type == 'male' and any(keyword in voice_name for keyword in ['male', 'man', 'david', 'mark']):
-                    self.engine.setProperty('voice', voice.id)
+                    self.voice_settings['voice_id'] = voice.id
                     break
         except Exception as e:
             print(f"音声タイプ設定エラー: {e}")
     
-    def speak_text(self, text: str):
+    def speak_text(self, text: str, policy: Optional[str] = None) -> Optional[Union[SpeechStream, BrowserSpeech]]:
         """
         テキストを音声で読み上げ（Windows SAPI優先・確実動作）
         
+        文ごとに分けて読み上げスレッドのキューに投入し、すぐに戻る。
+        1文目を再生している間に2文目を合成するので、長い応答も最後まで待たずに読み上げが始まる。
+        
         Args:
             text (str): 読み上げるテキスト
+            policy (str): キュー方針（"drop_oldest" / "replace_pending" / "interrupt"。省略時は設定値）
+            
+        Returns:
+            Optional[Union[SpeechStream, BrowserSpeech]]: 投入した応答（ブラウザ再生では wait_audio で音声を受け取る。
+                音声機能が使えない場合は None）
+        """
+        if not split_sentences(text):
+            return None
+        speech = self.start_speech(policy)
+        if speech is None:
+            return None
+        speech.feed(text)
+        speech.finish()
+        return speech
+    
+    def start_speech(self, policy: Optional[str] = None) -> Optional[Union[SpeechStream, BrowserSpeech]]:
+        """
+        ストリーミングで届く応答の読み上げを開始（届いた文から順に読み上げる）
+        
+        ブラウザ再生の場合は文ごとに別プロセスで合成し、ready_audio で（待たずに）
+        合成できた音声ファイルを受け取って browser_playlist_html でブラウザへ送る。
+        
+        Args:
+            policy (str): キュー方針（省略時は設定値。ブラウザ再生では使わない）
+            
+        Returns:
+            Optional[Union[SpeechStream, BrowserSpeech]]: feed / finish でテキストを渡す。音声機能が使えない場合は None
         """
+        if self.output_mode == "browser":
+            if not self.browser_renderer.is_available():
+                return None
+            return self.browser_renderer.start_speech(self.voice_settings)
         if not self.engine:
-            return
+            return None
+        return SpeechStream(self, policy)
+    
+    def prerender_character(self, character_data: Dict) -> int:
+        """
+        キャラクターの会話開始メッセージをバックグラウンドで合成してキャッシュしておく
+        
+        読み上げ用の合成が無いときだけ1文ずつ合成するので、応答の読み上げを遅らせない。
+        新しいメッセージで読み上げを止めたとき（stop_speaking）は、残りの事前合成も取り消す。
+        ブラウザ再生の場合はブラウザ用のエンジン・形式で合成する（キャッシュのキーが異なるため）。
+        音声エンジンの検出が済んでいない場合は何もしない（検出を始めるのは音声を有効にしたときだけ）。
+        
+        Args:
+            character_data (Dict): キャラクターデータ
             
-        # 既に音声再生中の場合はスキップ
-        if self.is_speaking:
-            print("音声再生中のため、新しい音声をスキップしました")
-            return
+        Returns:
+            int: 合成を予約した文の数
+        """
+        if not self.audio_cache.enabled:
+            return 0
+        if self.output_mode == "browser":
+            if not self.browser_renderer.is_available():
+                return 0
+            prerender = self.browser_renderer.prerender
+        elif self.is_ready() and self.is_available():
+            prerender = lambda sentence, settings: self._worker.render(sentence, settings, background=True)
+        else:
+            return 0
+        count = 0
+        for starter in character_data.get('conversation_starters', []):
+            # 読み上げ時と同じ単位で合成しておく
+            for sentence in split_sentences(starter):
+                prerender(sentence, self.voice_settings)
+                count += 1
+        return count
+    
+    def _engine_name(self) -> str:
+        return "sapi" if self.windows_sapi_available else "pyttsx3"
+    
+    def _render_utterance(self, utterance: Utterance) -> Optional[str]:
+        """
+        1件の発話を音声ファイルに合成する（合成スレッドで呼ばれる）
+        
+        同じ条件で合成済みならキャッシュのファイルをそのまま返す。
+        
+        Args:
+            utterance (Utterance): 発話
             
-        def speak():
+        Returns:
+            Optional[str]: WAV ファイルのパス（ファイルへ合成できない場合は None）
+        """
+        if utterance.cancelled.is_set():
+            return None
+        settings = utterance.settings
+        engine_name = self._engine_name()
+        cached = self.audio_cache.get(self._cache_key(utterance.text, settings, engine_name))
+        if cached:
+            return cached
+        
+        os.makedirs(RENDER_DIR, exist_ok=True)
+        self._prune_rendered_files()
+        fd, path = tempfile.mkstemp(suffix=".wav", dir=RENDER_DIR)
+        os.close(fd)
+        
+        # 方法1: Windows SAPI でファイルへ出力
+        if engine_name == "sapi":
             try:
-                self.is_speaking = True
-                print("音声再生を開始します...")
-                
-                # 長いテキストは短縮
-                if len(text) > 200:
-                    short_text = text[:200] + "..."
-                else:
-                    short_text = text
-                
-                # 空のテキストは処理しない
-                if not short_text.strip():
-                    return
-                
-                # 方法1: Windows SAPI（最も確実）
+                import win32com.client
+                if self._sapi_renderer is None:
+                    try:
+                        import pythoncom
+                        pythoncom.CoInitialize()
+                    except ImportError:
+                        pass
+                    self._sapi_renderer = win32com.client.Dispatch("SAPI.SpVoice")
+                renderer = self._sapi_renderer
+                renderer.Rate = max(-10, min(10, (settings.get('rate', 150) - 200) // 20))
+                renderer.Volume = int(settings.get('volume', 0.9) * 100)
+                stream = win32com.client.Dispatch("SAPI.SpFileStream")
+                stream.Open(path, 3)  # SSFMCreateForWrite
+                renderer.AudioOutputStream = stream
                 try:
-                    import win32com.client
-                    speaker = win32com.client.Dispatch("SAPI.SpVoice")
-                    
-                    # 音声速度と音量を設定
-                    speaker.Rate = max(-10, min(10, (self.engine.getProperty('rate') - 200) // 20))
-                    speaker.Volume = int(self.engine.getProperty('volume') * 100)
-                    
-                    speaker.Speak(short_text)
-                    print("音声再生が完了しました（Windows SAPI使用）")
+                    renderer.Speak(utterance.text)
+                finally:
+                    stream.Close()
+                    renderer.AudioOutputStream = None
+                return self.audio_cache.put(self._cache_key(utterance.text, settings, "sapi"), path)
+            except Exception as sapi_error:
+                print(f"Windows SAPI 合成エラー: {sapi_error}")
+        
+        # 方法2: pyttsx3 でファイルへ出力
+        try:
+            if self._render_engine is None:
+                import pyttsx3
+                # pyttsx3.init() は同じドライバーのエンジンを共有してしまうため、別のインスタンスを作る
+                self._render_engine = pyttsx3.Engine()
+            engine = self._render_engine
+            engine.setProperty('rate', settings.get('rate', 150))
+            engine.setProperty('volume', settings.get('volume', 0.9))
+            if settings.get('voice_id'):
+                engine.setProperty('voice', settings['voice_id'])
+            engine.save_to_file(utterance.text, path)
+            engine.runAndWait()
+            if os.path.getsize(path) > 0:
+                return self.audio_cache.put(self._cache_key(utterance.text, settings, "pyttsx3"), path)
+        except Exception as engine_error:
+            print(f"pyttsx3 合成エラー: {engine_error}")
+        
+        self._remove_file(path)
+        return None
+    
+    @staticmethod
+    def _cache_key(text: str, settings: Dict, engine_name: str) -> str:
+        return audio_cache_key(
+            text, settings.get('voice_id'), settings.get('rate', 150), settings.get('volume', 0.9), engine_name
+        )
+    
+    def _play_file(self, path: str, utterance: Utterance) -> bool:
+        """
+        合成済みの音声ファイルを再生する（中断されたらすぐ止める）
+        
+        Args:
+            path (str): WAV ファイルのパス
+            utterance (Utterance): 発話（中断要求の確認に使う）
+            
+        Returns:
+            bool: 再生できた場合True
+        """
+        # 方法1: pygame.mixer（再生の完了・中断を確実に扱える）
+        if not self._mixer_init_tried:
+            self._mixer_init_tried = True
+            try:
+                import pygame
+                pygame.mixer.init()
+                self._mixer = pygame.mixer
+            except Exception as mixer_error:
+                # 音声デバイスの無いサーバーなど。再試行しても変わらないので以降は使わない
+                print(f"pygame.mixer を初期化できません: {mixer_error}")
+        if self._mixer is not None:
+            try:
+                channel = self._mixer.Sound(path).play()
+                while channel.get_busy():
+                    if utterance.cancelled.wait(0.05):
+                        channel.stop()
+                        break
+                self._file_playback_available = True
+                return True
+            except Exception as mixer_error:
+                print(f"pygame 再生エラー: {mixer_error}")
+        
+        # 方法2: winsound（Windows 標準）
+        try:
+            import winsound
+        except ImportError:
+            winsound = None
+        if winsound is not None:
+            try:
+                with wave.open(path, "rb") as wav:
+                    duration = wav.getnframes() / float(wav.getframerate() or 1)
+                winsound.PlaySound(path, winsound.SND_FILENAME | winsound.SND_ASYNC)
+                if utterance.cancelled.wait(duration):
+                    winsound.PlaySound(None, 0)
+                self._file_playback_available = True
+                return True
+            except Exception as winsound_error:
+                print(f"winsound 再生エラー: {winsound_error}")
+        
+        if self._mixer is None and winsound is None and self._file_playback_available is not False:
+            # ファイルを再生する手段が無いので、以降は合成せずに直接読み上げる
+            print("合成済みファイルを再生できないため、先読みの合成を停止します")
+            self._file_playback_available = False
+            self._worker.configure(prefetch=False)
+        return False
+    
+    def _prune_rendered_files(self):
+        # 中断などで再生されずに残った古いファイルを消す
+        cutoff = time.time() - RENDER_MAX_AGE
+        try:
+            for name in os.listdir(RENDER_DIR):
+                path = os.path.join(RENDER_DIR, name)
+                if os.path.getmtime(path) < cutoff:
+                    self._remove_file(path)
+        except OSError:
+            pass
+    
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _speak_utterance(self, utterance: Utterance):
+        """
+        1件の発話を読み上げる（読み上げスレッドで呼ばれる）
+        
+        Args:
+            utterance (Utterance): 発話
+        """
+        text = utterance.text
+        settings = utterance.settings
+        print("音声再生を開始します...")
+        
+        # 合成済みのファイルがあれば再生するだけ
+        if utterance.audio:
+            try:
+                if self._play_file(utterance.audio, utterance):
+                    print("音声再生が完了しました（合成済みファイル）")
                     return
-                    
-                except Exception as sapi_error:
-                    print(f"Windows SAPI エラー: {sapi_error}")
-                
-                # 方法2: メインエンジンで非同期再生（runAndWaitなし）
+            finally:
+                # キャッシュに入ったファイルは残す
+                if not self.audio_cache.contains(utterance.audio):
+                    self._remove_file(utterance.audio)
+        
+        # 方法1: Windows SAPI（最も確実）
+        try:
+            if self._sapi_speaker is None:
+                import win32com.client
                 try:
-                    print("メインエンジンで非同期音声再生を試行します...")
-                    self.engine.say(short_text)
-                    # runAndWait()を呼ばない（これがエラーの原因）
-                    
-                    # 代わりに短時間待機
-                    import time
-                    estimated_duration = len(short_text) * 0.1  # 文字数に応じた推定時間
-                    time.sleep(min(estimated_duration, 10))  # 最大10秒
-                    
-                    print("音声再生が完了しました（非同期モード）")
+                    import pythoncom
+                    pythoncom.CoInitialize()
+                except ImportError:
+                    pass
+                self._sapi_speaker = win32com.client.Dispatch("SAPI.SpVoice")
+            speaker = self._sapi_speaker
+            
+            # 音声速度と音量を設定
+            speaker.Rate = max(-10, min(10, (settings.get('rate', 150) - 200) // 20))
+            speaker.Volume = int(settings.get('volume', 0.9) * 100)
+            
+            # 非同期で読み上げ、中断されたら読み上げ中の文を破棄して止める
+            speaker.Speak(text, SAPI_FLAGS_ASYNC)
+            while not speaker.WaitUntilDone(50):
+                if utterance.cancelled.is_set():
+                    speaker.Speak("", SAPI_FLAGS_ASYNC | SAPI_FLAGS_PURGE_BEFORE_SPEAK)
+                    print("音声再生を中断しました（Windows SAPI使用）")
                     return
-                    
-                except Exception as engine_error:
-                    print(f"メインエンジンエラー: {engine_error}")
-                
-                # 方法3: システムビープ音（最後の手段）
-                try:
-                    import winsound
-                    # 音声再生の代わりにビープ音で通知
-                    winsound.Beep(800, 200)  # 800Hz、200ms
-                    print("音声読み上げの代わりにビープ音で通知しました")
-                    
-                except Exception as beep_error:
-                    print(f"ビープ音エラー: {beep_error}")
-                    print("すべての音声機能が利用できません")
-                
-            except Exception as e:
-                print(f"音声読み上げエラー（安全に無視）: {e}")
-            finally:
-                self.is_speaking = False
-                print("音声再生フラグをリセットしました")
+            print("音声再生が完了しました（Windows SAPI使用）")
+            return
+            
+        except Exception as sapi_error:
+            print(f"Windows SAPI エラー: {sapi_error}")
         
-        # 別スレッドで音声再生（完全非同期）
+        # 方法2: メインエンジンで非同期再生（runAndWaitなし）
         try:
-            thread = threading.Thread(target=speak, daemon=True)
-            thread.start()
-            print("音声再生スレッドを開始しました")
-        except Exception as e:
-            print(f"音声スレッド作成エラー（無視）: {e}")
-            self.is_speaking = False
+            print("メインエンジンで非同期音声再生を試行します...")
+            self.engine.setProperty('rate', settings.get('rate', 150))
+            self.engine.setProperty('volume', settings.get('volume', 0.9))
+            if settings.get('voice_id'):
+                self.engine.setProperty('voice', settings['voice_id'])
+            self.engine.say(text)
+            # runAndWait()を呼ばない（これがエラーの原因）
+            
+            # 代わりに文字数に応じた推定時間だけ待機（中断されたらすぐ戻る）
+            estimated_duration = len(text) * 0.1
+            if utterance.cancelled.wait(min(estimated_duration, 10)):  # 最大10秒
+                self.engine.stop()
+                print("音声再生を中断しました（非同期モード）")
+                return
+            
+            print("音声再生が完了しました（非同期モード）")
+            return
+            
+        except Exception as engine_error:
+            print(f"メインエンジンエラー: {engine_error}")
+        
+        # 方法3: システムビープ音（最後の手段）
+        try:
+            import winsound
+            # 音声再生の代わりにビープ音で通知
+            winsound.Beep(800, 200)  # 800Hz、200ms
+            print("音声読み上げの代わりにビープ音で通知しました")
+            
+        except Exception as beep_error:
+            print(f"ビープ音エラー: {beep_error}")
+            print("すべての音声機能が利用できません")
     
     def save_audio_file(self, text: str, filename: str) -> Optional[str]:
         """
@@ -262,9 +693,14 @@ class VoiceManager:
             # ファイルパスの作成
             file_path = os.path.join(audio_dir, f"{filename}.wav")
             
-            # 音声ファイルとして保存
-            self.engine.save_to_file(text, file_path)
-            self.engine.runAndWait()
+            # 合成スレッドで合成（キャッシュにあれば再合成しない）してからコピー
+            rendered = self._worker.render(text, self.voice_settings).result()
+            if not rendered:
+                return None
+            if self.audio_cache.contains(rendered):
+                shutil.copyfile(rendered, file_path)
+            else:
+                shutil.move(rendered, file_path)
             
             return file_path
             
@@ -283,6 +719,26 @@ class VoiceManager:
             st.write("**音声読み上げ機能**")
             st.caption("AIの応答を自動で音声読み上げします")
             
+            enable_voice = st.checkbox(
+                "🎙️ 音声読み上げを有効化",
+                value=st.session_state.get("enable_voice", False),
+                key="enable_voice",
+                help="チェックすると、AIの応答が自動で音声で読み上げられます"
+            )
+            
+            # 音声エンジンは初めて有効にしたときに検出する（ブラウザ再生では不要）
+            if self.output_mode == "speaker" and not self.is_ready():
+                if not enable_voice:
+                    st.caption("有効にすると音声エンジンを検出します")
+                    return {
+                        "voice_type": "female",
+                        "rate": 150,
+                        "volume": 0.9,
+                        "enabled": False
+                    }
+                with st.spinner("音声エンジンを検出中..."):
+                    self.ensure_ready()
+            
             # 音声機能の利用可能性チェック
             if not self.is_available():
                 st.error("❌ 音声機能が利用できません。")
@@ -296,6 +752,8 @@ class VoiceManager:
             
             # 利用可能な音声エンジンの表示
             available_engines = []
+            if self.output_mode == "browser":
+                available_engines.append(f"ブラウザ再生（{self.browser_renderer.engine} → {self.browser_renderer.audio_format}）")
             if self.engine:
                 available_engines.append("pyttsx3")
             if getattr(self, 'windows_sapi_available', False):
@@ -309,15 +767,13 @@ class VoiceManager:
             # 現在の音声状態表示
             if self.is_speaking:
                 st.warning("🔊 現在音声を再生中です...")
+            # ブラウザで再生中かどうかはサーバーから分からないので、ブラウザ再生では常に表示する
+            if self.is_speaking or self.output_mode == "browser":
                 if st.button("⏹️ 音声停止", key="stop_voice"):
                     self.stop_speaking()
-            
-            enable_voice = st.checkbox(
-                "🎙️ 音声読み上げを有効化",
-                value=st.session_state.get("enable_voice", False),
-                key="enable_voice",
-                help="チェックすると、AIの応答が自動で音声で読み上げられます"
-            )
+                    if self.output_mode == "browser":
+                        import streamlit.components.v1 as components
+                        components.html(browser_stop_html(), height=0)
             
             if enable_voice:
                 st.success("✅ 音声読み上げが有効です")
@@ -359,7 +815,10 @@ class VoiceManager:
                     if st.button("🎵 テスト音声", key="test_voice"):
                         test_text = "こんにちは。音声テストです。"
                         st.info("🔊 テスト音声を再生しています...")
-                        self.speak_text(test_text)
+                        speech = self.speak_text(test_text)
+                        if isinstance(speech, BrowserSpeech):
+                            # 合成を待たず、合成できたものからメイン画面の deliver_pending_speech で送る
+                            st.session_state.pending_speech = {"speech": speech, "message_index": None}
                 
                 with col2:
                     if st.button("🔄 設定リセット", key="reset_voice"):
@@ -375,13 +834,23 @@ class VoiceManager:
                     st.write(f"- pyttsx3エンジン: {'✅' if self.engine else '❌'}")
                     st.write(f"- Windows SAPI: {'✅' if getattr(self, 'windows_sapi_available', False) else '❌'}")
                     st.write(f"- 現在音声再生中: {'✅' if self.is_speaking else '❌'}")
-                    if self.engine:
-                        try:
-                            current_rate = self.engine.getProperty('rate')
-                            current_volume = self.engine.getProperty('volume')
-                            st.write(f"- 現在の設定: 速度={current_rate}, 音量={current_volume}")
-                        except:
-                            st.write("- 設定取得エラー")
+                    st.write(f"- 現在の設定: 速度={self.voice_settings['rate']}, 音量={self.voice_settings['volume']}")
+                    queue_stats = self.get_queue_stats()
+                    st.write(
+                        f"- 読み上げキュー: 待機 {queue_stats['queue_depth']}件 / "
+                        f"読み上げ {queue_stats['spoken']:.0f}件 / 破棄 {queue_stats['dropped'] + queue_stats['replaced']:.0f}件 / "
+                        f"中断 {queue_stats['interrupted']:.0f}件 / 取り消し {queue_stats['superseded']:.0f}件"
+                    )
+                    st.write(
+                        f"- 待ち時間 平均 {queue_stats['avg_wait_ms']:.0f} ms / "
+                        f"読み上げ時間 平均 {queue_stats['avg_speak_ms']:.0f} ms / "
+                        f"最初の音声まで {queue_stats['last_first_audio_ms']:.0f} ms"
+                    )
+                    cache_stats = self.audio_cache.get_stats()
+                    st.write(
+                        f"- 音声キャッシュ: {cache_stats['entries']}件 / {cache_stats['bytes'] / 1024 / 1024:.1f} MB / "
+                        f"ヒット {cache_stats['hits']}回 / ミス {cache_stats['misses']}回"
+                    )
                 
                 st.info("💡 メッセージ送信後、AIの応答が自動で読み上げられます")
             else:
@@ -405,6 +874,8 @@ class VoiceManager:
         Returns:
             bool: 利用可能かどうか
         """
+        if self.output_mode == "browser":
+            return self.browser_renderer.is_available()
         # pyttsx3エンジンまたはWindows SAPIが利用可能な場合
         return self.engine is not None or getattr(self, 'windows_sapi_available', False)
     
@@ -419,14 +890,15 @@ class VoiceManager:
     
     def stop_speaking(self):
         """
-        音声再生を強制停止
+        読み上げ待ちの発話を捨て、再生中の音声の停止を試みる
+        
+        これまでの応答はまだ届いていない文も含めて読み上げず、合成もしない。
+        ブラウザ再生の場合は合成中の文を取り消す（ブラウザで再生中の音声は browser_stop_html で止める）。
         """
         try:
-            if self.is_speaking:
-                self.is_speaking = False
-                print("音声再生を停止しました")
-                # 注意: 現在再生中の音声は完全には停止できませんが、
-                # 新しい音声の再生は防止されます
+            count = self._worker.supersede() + self.browser_renderer.cancel_all()
+            if count:
+                print(f"音声再生を停止しました（{count}件）")
         except Exception as e:
             print(f"音声停止エラー（無視）: {e}")
     
@@ -435,10 +907,10 @@ class VoiceManager:
         リソースのクリーンアップ
         """
         try:
+            self._worker.cancel_all(interrupt=True)
             if self.engine:
                 self.engine.stop()
                 self.engine = None
-            self.is_speaking = False
             print("音声エンジンをクリーンアップしました")
         except Exception as e:
             print(f"クリーンアップエラー（無視）: {e}")